@@ -0,0 +1,73 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+from kmerprediction import native_counter
+from kmerprediction.cardinality import sketch_file, merge, estimate, hash_size
+from kmerprediction.cardinality import map_size, sketch_file_multi
+
+
+def write_genome(path, sequence):
+    with open(path, 'w') as f:
+        f.write('>genome\n')
+        for i in range(0, len(sequence), 60):
+            f.write(sequence[i:i + 60] + '\n')
+
+
+class Estimate(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.files = [self.dir + '/A.fasta', self.dir + '/B.fasta']
+        self.sequences = [''.join(rng.choice(list('ACGT'), 100000)),
+                          ''.join(rng.choice(list('ACGT'), 50000))]
+        for f, sequence in zip(self.files, self.sequences):
+            write_genome(f, sequence)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def distinct(self, files, k):
+        codes = [native_counter.count_file(f, k)[0] for f in files]
+        return len(np.unique(np.concatenate(codes)))
+
+    def test_genome(self):
+        truth = self.distinct(self.files[:1], 21)
+        self.assertLess(abs(estimate(sketch_file(self.files[0], 21)) - truth),
+                        0.05 * truth)
+
+    def test_merge(self):
+        truth = self.distinct(self.files, 21)
+        sketch = merge([sketch_file(f, 21) for f in self.files])
+        self.assertLess(abs(estimate(sketch) - truth), 0.05 * truth)
+
+    def test_small(self):
+        self.assertEqual(estimate(sketch_file(self.files[0], 2)), 10)
+
+    def test_empty(self):
+        path = self.dir + '/empty.fasta'
+        write_genome(path, '')
+        self.assertEqual(estimate(sketch_file(path, 21)), 0)
+
+    def test_multi(self):
+        sketches = sketch_file_multi(self.files[1], [5, 21])
+        for k in [5, 21]:
+            self.assertTrue(np.array_equal(sketches[k],
+                                           sketch_file(self.files[1], k)))
+
+
+class Sizes(unittest.TestCase):
+    def test_hash_size(self):
+        self.assertEqual(hash_size(4000000), '5000000')
+        self.assertEqual(hash_size(0), '1024')
+
+    def test_map_size(self):
+        self.assertEqual(map_size(100, 8), 100 * (8 + 8 + 16) * 2)
+        self.assertEqual(map_size(0, 8, extra=50), 100)
+
+
+if __name__ == "__main__":
+    loader = unittest.TestLoader()
+    all_tests = loader.discover('.', pattern='test_cardinality.py')
+    runner = unittest.TextTestRunner()
+    runner.run(all_tests)
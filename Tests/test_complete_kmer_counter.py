@@ -2,9 +2,42 @@ from builtins import str
 import unittest
 import shutil
 import tempfile
+import io
+import os
 import lmdb
 import numpy as np
+from scipy.sparse import issparse
 from kmerprediction.complete_kmer_counter import count_kmers, get_counts, get_kmer_names
+from kmerprediction.complete_kmer_counter import read_dump, filter_mask
+from kmerprediction.complete_kmer_counter import materialize, load_matrix
+from kmerprediction.complete_kmer_counter import shard_bounds, read_shards
+from kmerprediction.complete_kmer_counter import filter_database
+from kmerprediction.complete_kmer_counter import get_global_counts
+from kmerprediction.complete_kmer_counter import get_file_counts
+from kmerprediction.complete_kmer_counter import KmerCounterError
+import json
+from kmerprediction import constants
+from kmerprediction import native_counter
+
+
+def decode_count(value):
+    return int(np.frombuffer(value[:8], dtype='<u8')[0])
+
+
+def decode_key(key, k=2):
+    return native_counter.decode_kmers(np.frombuffer(key, dtype='>u8'), k)[0]
+
+
+def read_columns(database):
+    env = lmdb.open(str(database), max_dbs=100)
+    columns = []
+    with env.begin(write=False) as txn:
+        for name in ['global_counts', 'file_counts']:
+            db = env.open_db(name.encode(), txn=txn)
+            columns.append([(key, decode_count(value))
+                            for key, value in txn.cursor(db=db)])
+    env.close()
+    return columns
 
 
 def create_temp_files():
@@ -37,17 +70,18 @@ class CountKmers(unittest.TestCase):
         with env.begin(write=False, db=A1) as txn:
             with txn.cursor() as cursor:
                 for key, val in cursor:
-                    if key != 'complete_results'.encode():
-                        count2 += 1
-                    key = key.decode()
-                    val = val.decode()
-                    if key == 'AA' and val == '3':
+                    if len(key) != 8:
+                        continue
+                    count2 += 1
+                    key = decode_key(key)
+                    val = decode_count(val)
+                    if key == 'AA' and val == 3:
                         count1 += 1
-                    elif key == 'AC' and val == '1':
+                    elif key == 'AC' and val == 1:
                         count1 += 1
-                    elif key == 'CA' and val == '1':
+                    elif key == 'CA' and val == 1:
                         count1 += 1
-                    elif key == 'CC' and val == '3':
+                    elif key == 'CC' and val == 3:
                         count1 += 1
         self.assertEqual(count1, count2)
 
@@ -60,17 +94,18 @@ class CountKmers(unittest.TestCase):
         with env.begin(write=False, db=A2) as txn:
             with txn.cursor() as cursor:
                 for key, val in cursor:
-                    if key != 'complete_results'.encode():
-                        count2 += 1
-                    key = key.decode()
-                    val = val.decode()
-                    if key == 'AA' and val == '2':
+                    if len(key) != 8:
+                        continue
+                    count2 += 1
+                    key = decode_key(key)
+                    val = decode_count(val)
+                    if key == 'AA' and val == 2:
                         count1 += 1
-                    elif key == 'AC' and val == '1':
+                    elif key == 'AC' and val == 1:
                         count1 += 1
-                    elif key == 'CA' and val == '1':
+                    elif key == 'CA' and val == 1:
                         count1 += 1
-                    elif key == 'CC' and val == '3':
+                    elif key == 'CC' and val == 3:
                         count1 += 1
         self.assertEqual(count1, count2)
 
@@ -83,17 +118,18 @@ class CountKmers(unittest.TestCase):
         with env.begin(write=False, db=B1) as txn:
             with txn.cursor() as cursor:
                 for key, val in cursor:
-                    if key != 'complete_results'.encode():
-                        count2 += 1
-                    key = key.decode()
-                    val = val.decode()
-                    if key == 'AA' and val == '2':
+                    if len(key) != 8:
+                        continue
+                    count2 += 1
+                    key = decode_key(key)
+                    val = decode_count(val)
+                    if key == 'AA' and val == 2:
                         count1 += 1
-                    elif key == 'AC' and val == '2':
+                    elif key == 'AC' and val == 2:
                         count1 += 1
-                    elif key == 'CA' and val == '1':
+                    elif key == 'CA' and val == 1:
                         count1 += 1
-                    elif key == 'CC' and val == '2':
+                    elif key == 'CC' and val == 2:
                         count1 += 1
         self.assertEqual(count1, count2)
 
@@ -118,6 +154,549 @@ class GetCounts(unittest.TestCase):
         self.assertTrue(val)
 
 
+class GetCountsNative(unittest.TestCase):
+    def setUp(self):
+        self.dir, self.db, self.files = create_temp_files()
+        count_kmers(self.files, self.db, k=2, backend='native')
+        self.counts = get_counts(self.files, self.db)
+        self.names = get_kmer_names(self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_values(self):
+        val = True
+        val = val and np.array_equal(self.counts[0], [3, 1, 1, 3])
+        val = val and np.array_equal(self.counts[1], [2, 1, 1, 3])
+        val = val and np.array_equal(self.counts[2], [2, 2, 1, 2])
+        self.assertTrue(val)
+
+    def test_names(self):
+        self.assertTrue(np.array_equal(self.names, ['AA', 'AC', 'CA', 'CC']))
+
+    def test_dtype(self):
+        counts = get_counts(self.files, self.db, dtype='float32')
+        self.assertEqual(counts.dtype, np.float32)
+        self.assertTrue(np.array_equal(counts, self.counts))
+
+    def test_sparse(self):
+        counts = get_counts(self.files, self.db, sparse=True)
+        self.assertTrue(issparse(counts))
+        self.assertTrue(np.array_equal(counts.toarray(), self.counts))
+
+
+class CompactDtype(unittest.TestCase):
+    def setUp(self):
+        self.dir, self.db, self.files = create_temp_files()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_smallest(self):
+        count_kmers(self.files, self.db, k=2, backend='native')
+        counts = get_counts(self.files, self.db)
+        self.assertEqual(counts.dtype, np.uint8)
+        self.assertEqual(counts[0].tolist(), [3, 1, 1, 3])
+
+    def test_saturate(self):
+        count_kmers(self.files, self.db, k=2, backend='native', saturate=2)
+        counts = get_counts(self.files, self.db)
+        self.assertEqual(counts.tolist(), [[2, 1, 1, 2], [2, 1, 1, 2],
+                                           [2, 2, 1, 2]])
+        path = materialize(self.db)
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.assertEqual((manifest['dtype'], manifest['saturate']),
+                         ('uint8', 2))
+
+    def test_changed(self):
+        count_kmers(self.files, self.db, k=2, backend='native', saturate=2)
+        count_kmers(self.files, self.db, k=2, backend='native')
+        counts = get_counts(self.files, self.db)
+        self.assertEqual(counts[0].tolist(), [3, 1, 1, 3])
+
+
+class TwoPhaseNative(unittest.TestCase):
+    def setUp(self):
+        self.dir, self.db, self.files = create_temp_files()
+        count_kmers(self.files, self.db, k=2, backend='native', stream=False)
+        self.counts = get_counts(self.files, self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_values(self):
+        val = True
+        val = val and np.array_equal(self.counts[0], [3, 1, 1, 3])
+        val = val and np.array_equal(self.counts[1], [2, 1, 1, 3])
+        val = val and np.array_equal(self.counts[2], [2, 2, 1, 2])
+        self.assertTrue(val)
+
+
+class ExternalSort(unittest.TestCase):
+    def setUp(self):
+        self.dir, self.db, self.files = create_temp_files()
+        self.stream_db = self.dir + '/TEMPstream'
+        count_kmers(self.files, self.stream_db, k=2, backend='native')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_values(self):
+        count_kmers(self.files, self.db, k=2, backend='native', external=True)
+        counts = get_counts(self.files, self.db)
+        self.assertTrue(np.array_equal(counts, get_counts(self.files,
+                                                          self.stream_db)))
+        self.assertEqual(read_columns(self.db),
+                         read_columns(self.stream_db))
+
+    def test_add_genomes(self):
+        count_kmers(self.files[:2], self.db, k=2, backend='native',
+                    external=True)
+        count_kmers(self.files, self.db, k=2, backend='native', external=True)
+        self.assertEqual(read_columns(self.db),
+                         read_columns(self.stream_db))
+
+    def test_stream_force(self):
+        count_kmers(self.files, self.stream_db, k=2, backend='native',
+                    force=True)
+        counts = get_counts(self.files, self.stream_db)
+        self.assertTrue(np.array_equal(counts[2], [2, 2, 1, 2]))
+        count_kmers(self.files, self.db, k=2, backend='native', external=True)
+        self.assertEqual(read_columns(self.db),
+                         read_columns(self.stream_db))
+
+    def test_force(self):
+        count_kmers(self.files, self.db, k=2, backend='native', external=True)
+        count_kmers(self.files, self.db, k=2, backend='native', external=True,
+                    force=True)
+        counts = get_counts(self.files, self.db)
+        self.assertTrue(np.array_equal(counts[2], [2, 2, 1, 2]))
+        self.assertEqual(read_columns(self.db),
+                         read_columns(self.stream_db))
+
+
+class Sharded(unittest.TestCase):
+    def setUp(self):
+        self.dir, self.db, self.files = create_temp_files()
+        self.plain = self.dir + '/TEMPplain'
+        count_kmers(self.files, self.plain, k=2, backend='native')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def same(self, db):
+        self.assertTrue(np.array_equal(get_counts(self.files, db),
+                                       get_counts(self.files, self.plain)))
+        self.assertEqual(get_kmer_names(db).tolist(),
+                         get_kmer_names(self.plain).tolist())
+
+    def test_bounds(self):
+        self.assertEqual(shard_bounds(2, 3), [0, 2, 6, 16])
+        bounds = shard_bounds(11, 4)
+        self.assertEqual(bounds, sorted(bounds))
+        self.assertTrue(all(x % 4 ** 7 == 0 for x in bounds))
+
+    def test_values(self):
+        count_kmers(self.files, self.db, k=2, backend='native', shards=3)
+        self.assertEqual(len(read_shards(self.db)), 3)
+        self.same(self.db)
+        self.assertEqual(get_global_counts(self.db).tolist(),
+                         get_global_counts(self.plain).tolist())
+        self.assertEqual(filter_database(self.db, min_file_count=3).tolist(),
+                         filter_database(self.plain, min_file_count=3).tolist())
+
+    def test_output_db(self):
+        output_db = self.dir + '/TEMPoutput'
+        count_kmers(self.files, self.db, k=2, backend='native', shards=2,
+                    output_db=output_db, min_global_count=5)
+        counts = get_counts(self.files, output_db)
+        self.assertEqual(counts.tolist(), [[3, 3], [2, 3], [2, 2]])
+        self.assertEqual(get_kmer_names(output_db).tolist(), ['AA', 'CC'])
+
+    def test_add_genomes(self):
+        count_kmers(self.files[:2], self.db, k=2, backend='native', shards=2)
+        count_kmers(self.files, self.db, k=2, backend='native')
+        self.same(self.db)
+
+    def test_matrix(self):
+        count_kmers(self.files, self.db, k=2, backend='native', shards=2,
+                    make_matrix=True)
+        self.assertIsNotNone(load_matrix(self.db))
+        self.same(self.db)
+
+    def test_layout(self):
+        count_kmers(self.files, self.db, k=2, backend='native', shards=2)
+        with self.assertRaises(KmerCounterError):
+            count_kmers(self.files, self.db, k=2, backend='native', shards=3)
+        with self.assertRaises(KmerCounterError):
+            count_kmers(self.files, self.plain, k=2, backend='native',
+                        shards=2)
+
+
+class GenomeCache(unittest.TestCase):
+    def setUp(self):
+        self.dir, self.db, self.files = create_temp_files()
+        self.cache = self.dir + '/cache'
+        count_kmers(self.files, self.db, k=2, backend='native',
+                    cache=self.cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_renamed(self):
+        renamed = []
+        for f in self.files:
+            renamed.append(f.replace('.fasta', '_copy.fasta'))
+            shutil.copy(f, renamed[-1])
+        db = self.dir + '/TEMPcopy'
+        count_kmers(renamed, db, k=2, backend='native', cache=self.cache,
+                    external=True)
+        self.assertTrue(np.array_equal(get_counts(renamed, db),
+                                       get_counts(self.files, self.db)))
+        entries = [x for x in os.listdir(self.cache) if x.endswith('.npy')]
+        self.assertEqual(len(entries), 6)
+
+    def test_changed_file(self):
+        with open(self.files[2], 'w') as f:
+            f.write('>\nAAAAAAT')
+        count_kmers(self.files, self.db, k=2, backend='native',
+                    cache=self.cache)
+        counts = get_counts(self.files, self.db)
+        self.assertTrue(np.array_equal(counts[0], [3, 1, 0, 1, 3]))
+        self.assertTrue(np.array_equal(counts[2], [5, 0, 1, 0, 0]))
+        stream_db = self.dir + '/TEMPstream'
+        count_kmers(self.files, stream_db, k=2, backend='native')
+        self.assertEqual(read_columns(self.db),
+                         read_columns(stream_db))
+
+
+class BinaryFormat(unittest.TestCase):
+    def setUp(self):
+        self.dir, self.db, self.files = create_temp_files()
+        count_kmers(self.files, self.db, k=2, backend='native')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_values(self):
+        env = lmdb.open(str(self.db), max_dbs=100)
+        metadata = env.open_db('metadata'.encode())
+        global_counts = env.open_db('global_counts'.encode())
+        with env.begin(write=False) as txn:
+            self.assertEqual(txn.get('version'.encode(), db=metadata), b'3')
+            self.assertEqual(txn.get('k'.encode(), db=metadata), b'2')
+            keys = [key for key, _ in txn.cursor(db=global_counts)]
+            value = txn.get(b'\x00' * 8, db=global_counts)
+        env.close()
+        self.assertEqual([decode_key(x) for x in keys], ['AA', 'AC', 'CA', 'CC'])
+        self.assertEqual(len(value), 8)
+        self.assertEqual(decode_count(value), 7)
+
+    def test_packed_names(self):
+        names = get_kmer_names(self.db, packed=True)
+        self.assertEqual(names.dtype, np.uint64)
+        self.assertEqual(native_counter.unpack_names(names).tolist(),
+                         ['AA', 'AC', 'CA', 'CC'])
+
+
+class LegacyFormat(unittest.TestCase):
+    def setUp(self):
+        self.dir, self.db, self.files = create_temp_files()
+        env = lmdb.open(str(self.db), max_dbs=100)
+        A1 = env.open_db('A1'.encode())
+        global_counts = env.open_db('global_counts'.encode())
+        file_counts = env.open_db('file_counts'.encode())
+        with env.begin(write=True) as txn:
+            for kmer, count in [('AA', 3), ('AC', 1), ('CA', 1), ('CC', 3)]:
+                txn.put(kmer.encode(), str(count).encode(), db=A1)
+                txn.put(kmer.encode(), str(count).encode(), db=global_counts)
+                txn.put(kmer.encode(), '1'.encode(), db=file_counts)
+        env.close()
+        count_kmers(self.files, self.db, k=2, backend='native')
+        self.counts = get_counts(self.files, self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_values(self):
+        val = True
+        val = val and np.array_equal(self.counts[0], [3, 1, 1, 3])
+        val = val and np.array_equal(self.counts[1], [2, 1, 1, 3])
+        val = val and np.array_equal(self.counts[2], [2, 2, 1, 2])
+        self.assertTrue(val)
+
+    def test_recount_backfilled(self):
+        # version 1 databases store a 0 for every kmer a genome is missing
+        files = [self.dir + '/G1.fasta', self.dir + '/G2.fasta']
+        with open(files[0], 'w') as f:
+            f.write('>\nAAAAC')
+        with open(files[1], 'w') as f:
+            f.write('>\nCCCC')
+        legacy = self.dir + '/TEMPlegacy'
+        env = lmdb.open(str(legacy), max_dbs=100)
+        global_counts = env.open_db('global_counts'.encode())
+        file_counts = env.open_db('file_counts'.encode())
+        genomes = {'G1': {'AA': 3, 'AC': 1, 'CC': 0},
+                   'G2': {'AA': 0, 'AC': 0, 'CC': 3}}
+        with env.begin(write=True) as txn:
+            for genome, counts in genomes.items():
+                db = env.open_db(genome.encode(), txn=txn)
+                for kmer, count in counts.items():
+                    txn.put(kmer.encode(), str(count).encode(), db=db)
+            for kmer, total, present in [('AA', 3, 1), ('AC', 1, 1),
+                                         ('CC', 3, 1)]:
+                txn.put(kmer.encode(), str(total).encode(), db=global_counts)
+                txn.put(kmer.encode(), str(present).encode(), db=file_counts)
+        env.close()
+        fresh = self.dir + '/TEMPfresh'
+        count_kmers(files, fresh, k=2, backend='native')
+        count_kmers(files, legacy, k=2, backend='native', force=True)
+        self.assertEqual(get_global_counts(legacy).tolist(),
+                         get_global_counts(fresh).tolist())
+        self.assertEqual(get_file_counts(legacy).tolist(),
+                         get_file_counts(fresh).tolist())
+        self.assertEqual(get_file_counts(legacy).tolist(), [1, 1, 1])
+
+
+class LegacyExternal(unittest.TestCase):
+    def setUp(self):
+        self.dir, self.db, self.files = create_temp_files()
+        env = lmdb.open(str(self.db), max_dbs=100)
+        A1 = env.open_db('A1'.encode())
+        global_counts = env.open_db('global_counts'.encode())
+        file_counts = env.open_db('file_counts'.encode())
+        with env.begin(write=True) as txn:
+            for kmer, count in [('AA', 3), ('AC', 1), ('CA', 1), ('CC', 3)]:
+                txn.put(kmer.encode(), str(count).encode(), db=A1)
+                txn.put(kmer.encode(), str(count).encode(), db=global_counts)
+                txn.put(kmer.encode(), '1'.encode(), db=file_counts)
+        env.close()
+        count_kmers(self.files, self.db, k=2, backend='native', external=True)
+        self.counts = get_counts(self.files, self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_values(self):
+        val = True
+        val = val and np.array_equal(self.counts[0], [3, 1, 1, 3])
+        val = val and np.array_equal(self.counts[1], [2, 1, 1, 3])
+        val = val and np.array_equal(self.counts[2], [2, 2, 1, 2])
+        self.assertTrue(val)
+
+    def test_file_counts(self):
+        env = lmdb.open(str(self.db), max_dbs=100)
+        file_counts = env.open_db('file_counts'.encode())
+        with env.begin(write=False, db=file_counts) as txn:
+            values = [(key, value) for key, value in txn.cursor()]
+        env.close()
+        self.assertEqual(values, [(b'AA', b'3'), (b'AC', b'3'), (b'CA', b'3'),
+                                  (b'CC', b'3')])
+
+
+class SparseStorage(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = self.dir + '/TEMPdatabase'
+        self.files = [self.dir + '/A1.fasta', self.dir + '/C1.fasta']
+        with open(self.files[0], 'w') as f:
+            f.write('>\nAAACCCCAA')
+        with open(self.files[1], 'w') as f:
+            f.write('>\nAAAA')
+        count_kmers(self.files, self.db, k=2, backend='native')
+        self.counts = get_counts(self.files, self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_values(self):
+        self.assertTrue(np.array_equal(self.counts[1], [3, 0, 0, 0]))
+
+    def test_no_stored_zeros(self):
+        env = lmdb.open(str(self.db), max_dbs=100)
+        C1 = env.open_db('C1'.encode())
+        with env.begin(write=False, db=C1) as txn:
+            keys = [key for key, _ in txn.cursor()]
+        env.close()
+        self.assertEqual(keys, [b'\x00' * 8, constants.OUTPUT_PREFIX +
+                                'complete_results'.encode()])
+
+
+class FilteredOutput(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = self.dir + '/TEMPdatabase'
+        self.files = [self.dir + '/A1.fasta', self.dir + '/C1.fasta']
+        with open(self.files[0], 'w') as f:
+            f.write('>\nAAACCCCAA')
+        with open(self.files[1], 'w') as f:
+            f.write('>\nAAAA')
+        count_kmers(self.files, self.db, k=2, max_file_count=1,
+                    backend='native')
+        self.counts = get_counts(self.files, self.db)
+        self.names = get_kmer_names(self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_values(self):
+        self.assertTrue(np.array_equal(self.counts[0], [1, 1, 3]))
+        self.assertTrue(np.array_equal(self.counts[1], [0, 0, 0]))
+
+    def test_names(self):
+        self.assertTrue(np.array_equal(self.names, ['AC', 'CA', 'CC']))
+
+
+class FilterColumns(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = self.dir + '/TEMPdatabase'
+        self.files = [self.dir + '/A1.fasta', self.dir + '/C1.fasta']
+        with open(self.files[0], 'w') as f:
+            f.write('>\nAAACCCCAA')
+        with open(self.files[1], 'w') as f:
+            f.write('>\nAAAA')
+        count_kmers(self.files, self.db, k=2, backend='native')
+        count_kmers(self.files, self.db, k=2, max_file_count=1,
+                    name='unique', backend='native')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_names(self):
+        self.assertTrue(np.array_equal(get_kmer_names(self.db),
+                                       ['AA', 'AC', 'CA', 'CC']))
+        self.assertTrue(np.array_equal(get_kmer_names(self.db, 'unique'),
+                                       ['AC', 'CA', 'CC']))
+
+    def test_cached(self):
+        with np.load(self.db + '/' + constants.COLUMNS_FILE) as columns:
+            self.assertEqual(columns['kmers'].tolist(), [0, 1, 4, 5])
+            self.assertEqual(columns['global_counts'].tolist(), [6, 1, 1, 3])
+            self.assertEqual(columns['file_counts'].tolist(), [2, 1, 1, 1])
+
+    def test_stale_cache(self):
+        new_file = self.dir + '/G1.fasta'
+        with open(new_file, 'w') as f:
+            f.write('>\nTTTT')
+        count_kmers(self.files + [new_file], self.db, k=2, name='unique',
+                    max_file_count=1, backend='native')
+        counts = get_counts(self.files + [new_file], self.db, 'unique')
+        self.assertTrue(np.array_equal(counts[2], [0, 0, 0]))
+        with np.load(self.db + '/' + constants.COLUMNS_FILE) as columns:
+            self.assertEqual(columns['global_counts'].tolist(), [9, 1, 1, 3])
+            self.assertEqual(columns['file_counts'].tolist(), [3, 1, 1, 1])
+
+
+    def test_corrupt_cache(self):
+        path = self.db + '/' + constants.COLUMNS_FILE
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        count_kmers(self.files, self.db, k=2, max_file_count=1,
+                    name='unique', backend='native', force=True)
+        self.assertTrue(np.array_equal(get_kmer_names(self.db, 'unique'),
+                                       ['AC', 'CA', 'CC']))
+        with np.load(path) as columns:
+            self.assertEqual(columns['file_counts'].tolist(), [2, 1, 1, 1])
+        self.assertEqual(sorted(os.listdir(self.db)),
+                         sorted(['data.mdb', 'lock.mdb',
+                                 constants.COLUMNS_FILE]))
+
+class FilterMask(unittest.TestCase):
+    def setUp(self):
+        self.global_values = np.array([1, 5, 10, 20])
+        self.file_values = np.array([1, 2, 3, 4])
+
+    def test_global(self):
+        mask = filter_mask(self.global_values, self.file_values, 10, 5, 5, 0)
+        self.assertEqual(mask.tolist(), [False, True, True, False])
+
+    def test_file(self):
+        mask = filter_mask(self.global_values, self.file_values, None, 0, 3, 2)
+        self.assertEqual(mask.tolist(), [False, True, True, False])
+
+
+class Materialize(unittest.TestCase):
+    def setUp(self):
+        self.dir, self.db, self.files = create_temp_files()
+        count_kmers(self.files, self.db, k=2, backend='native')
+        self.path = materialize(self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_manifest(self):
+        with open(self.path + '/manifest.json') as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest['k'], 2)
+        self.assertEqual(manifest['name'], 'complete_results')
+        self.assertEqual(manifest['version'], 3)
+        self.assertEqual(manifest['genomes'], 3)
+
+    def test_rows(self):
+        counts = get_counts(self.files[::-1][:2], self.db)
+        self.assertTrue(np.array_equal(counts, [[2, 2, 1, 2], [2, 1, 1, 3]]))
+        self.assertTrue(np.array_equal(get_kmer_names(self.db),
+                                       ['AA', 'AC', 'CA', 'CC']))
+
+    def test_sparse_rows(self):
+        counts = get_counts(self.files[::-1][:2], self.db, sparse=True)
+        self.assertTrue(issparse(counts))
+        self.assertTrue(np.array_equal(counts.toarray(),
+                                       [[2, 2, 1, 2], [2, 1, 1, 3]]))
+
+    def test_memory_mapped(self):
+        counts, rows, kmers = load_matrix(self.db)
+        self.assertIsInstance(counts, np.memmap)
+        self.assertEqual(rows, {'A1': 0, 'A2': 1, 'B1': 2})
+
+    def test_recount_removes_matrix(self):
+        count_kmers(self.files, self.db, k=2, backend='native', force=True)
+        self.assertIsNone(load_matrix(self.db))
+
+
+class Sizing(unittest.TestCase):
+    def setUp(self):
+        self.dir, self.db, self.files = create_temp_files()
+        count_kmers(self.files, self.db, k=2, backend='native')
+        self.counts = get_counts(self.files, self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_values(self):
+        self.assertTrue(np.array_equal(self.counts[2], [2, 2, 1, 2]))
+
+    def test_metadata(self):
+        env = lmdb.open(str(self.db), max_dbs=100)
+        metadata = env.open_db('metadata'.encode())
+        with env.begin(write=False, db=metadata) as txn:
+            self.assertEqual(txn.get('distinct_kmers'.encode()), b'4')
+            self.assertEqual(txn.get('distinct_kmers/B1'.encode()), b'4')
+            map_size = int(txn.get('map_size'.encode()))
+        env.close()
+        self.assertTrue(map_size < int(160e10))
+
+
+class ReadDump(unittest.TestCase):
+    def setUp(self):
+        self.dump = b'AAC\t12\nACG\t3\nCCC\t150\nGAT\t1'
+
+    def test_chunks(self):
+        for chunk_size in [1, 5, 7, 100]:
+            kmers, counts = read_dump(io.BytesIO(self.dump), chunk_size)
+            self.assertEqual(kmers.tolist(), [b'AAC', b'ACG', b'CCC', b'GAT'])
+            self.assertEqual(counts.tolist(), [12, 3, 150, 1])
+
+    def test_empty(self):
+        kmers, counts = read_dump(io.BytesIO(b''))
+        self.assertEqual(len(kmers), 0)
+        self.assertEqual(len(counts), 0)
+
+
 # class AddCounts(unittest.TestCase):
 #     def setUp(self):
 #         self.dir, self.db, self.files = create_temp_files()
@@ -0,0 +1,76 @@
+import unittest
+import gzip
+import os
+import shutil
+import subprocess
+import tempfile
+from kmerprediction.compression import compression, open_genome, strip_suffix
+from kmerprediction.native_counter import count_file
+from kmerprediction.utils import check_fasta
+from kmerprediction.complete_kmer_counter import make_db_keys
+
+GENOME = b'>x\nAAACCCCAA\n>y\nACGTTT\n'
+
+
+class OpenGenome(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fasta = self.dir + '/A1.fasta'
+        with open(self.fasta, 'wb') as f:
+            f.write(GENOME)
+        self.gzip = self.fasta + '.gz'
+        with gzip.open(self.gzip, 'wb') as f:
+            f.write(GENOME)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_plain(self):
+        self.assertIsNone(compression(self.fasta))
+        with open_genome(self.fasta) as f:
+            self.assertEqual(f.read(), GENOME)
+
+    def test_gzip(self):
+        self.assertEqual(compression(self.gzip), 'gzip')
+        with open_genome(self.gzip) as f:
+            self.assertEqual(f.read(), GENOME)
+
+    def test_bgzip(self):
+        # bgzip files are a series of gzip members
+        bgzip = self.fasta + '.bgz'
+        with open(bgzip, 'wb') as f:
+            f.write(gzip.compress(GENOME[:10]) + gzip.compress(GENOME[10:]))
+        with open_genome(bgzip) as f:
+            self.assertEqual(f.read(), GENOME)
+
+    @unittest.skipIf(shutil.which('zstd') is None, 'zstd is not installed')
+    def test_zstd(self):
+        zstd = self.fasta + '.zst'
+        subprocess.check_call(['zstd', '-q', self.fasta, '-o', zstd])
+        self.assertEqual(compression(zstd), 'zstd')
+        with open_genome(zstd) as f:
+            self.assertEqual(f.read(), GENOME)
+        self.assertEqual(count_file(zstd, 3)[1].tolist(),
+                         count_file(self.fasta, 3)[1].tolist())
+
+    def test_count(self):
+        expected = count_file(self.fasta, 3)
+        kmers, counts = count_file(self.gzip, 3)
+        self.assertEqual(kmers.tolist(), expected[0].tolist())
+        self.assertEqual(counts.tolist(), expected[1].tolist())
+
+    def test_check_fasta(self):
+        self.assertTrue(check_fasta(self.gzip))
+
+    def test_names(self):
+        self.assertEqual(strip_suffix('A1.fasta.gz'), 'A1.fasta')
+        self.assertEqual(strip_suffix('A1.fasta'), 'A1.fasta')
+        self.assertEqual(make_db_keys([self.gzip, self.dir + '/A2.fasta']),
+                         ['A1', 'A2'])
+
+
+if __name__ == "__main__":
+    loader = unittest.TestLoader()
+    all_tests = loader.discover('.', pattern='test_compression.py')
+    runner = unittest.TextTestRunner()
+    runner.run(all_tests)
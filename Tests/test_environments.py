@@ -0,0 +1,76 @@
+import unittest
+import shutil
+import tempfile
+import lmdb
+from kmerprediction.environments import reader, release, hold
+
+
+class Reader(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = self.dir + '/db'
+        self.write(b'A', b'1')
+
+    def tearDown(self):
+        release(self.db)
+        shutil.rmtree(self.dir)
+
+    def write(self, key, value, first=True):
+        if first:
+            release(self.db)
+        env = lmdb.open(self.db)
+        with env.begin(write=True) as txn:
+            txn.put(key, value)
+        env.close()
+
+    def test_shared(self):
+        env = reader(self.db)
+        self.assertIs(reader(self.db + '/'), env)
+        with env.begin() as txn:
+            self.assertEqual(txn.get(b'A'), b'1')
+
+    def test_release(self):
+        env = reader(self.db)
+        release(self.db)
+        self.assertIsNot(reader(self.db), env)
+
+    def test_written(self):
+        reader(self.db)
+        # written without releasing the reader, as another process would
+        self.write(b'B', b'2' * 100000, first=False)
+        with reader(self.db).begin() as txn:
+            self.assertEqual(len(txn.get(b'B')), 100000)
+
+    def test_replaced(self):
+        reader(self.db)
+        release(self.db)
+        shutil.rmtree(self.db)
+        self.write(b'C', b'3')
+        with reader(self.db).begin() as txn:
+            self.assertIsNone(txn.get(b'A'))
+            self.assertEqual(txn.get(b'C'), b'3')
+
+    def test_locked(self):
+        env = reader(self.db)
+        locked = reader(self.db, lock=True)
+        self.assertIsNot(locked, env)
+        # a locked environment also serves unlocked reads
+        self.assertIs(reader(self.db), locked)
+
+    def test_hold(self):
+        release(self.db)
+        env = lmdb.open(self.db)
+        hold(self.db, env)
+        self.assertIs(reader(self.db, lock=True), env)
+        release(self.db)
+        with env.begin() as txn:
+            self.assertEqual(txn.get(b'A'), b'1')
+        env.close()
+        self.assertIsNot(reader(self.db), env)
+
+
+if __name__ == "__main__":
+    loader = unittest.TestLoader()
+    all_tests = loader.discover('.', pattern='test_environments.py')
+    runner = unittest.TextTestRunner()
+    runner.run(all_tests)
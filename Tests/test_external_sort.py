@@ -0,0 +1,88 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+from kmerprediction.external_sort import write_run, create_run, read_run
+from kmerprediction.external_sort import merge_runs
+
+
+def merge_all(runs, memory_budget):
+    chunks = list(merge_runs(runs, memory_budget))
+    if not chunks:
+        return [], [], []
+    return [np.concatenate(x).tolist() for x in zip(*chunks)]
+
+
+class MergeRuns(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.kmers = [rng.randint(0, 500, size).astype(np.uint64)
+                      for size in [300, 50, 1000]]
+        self.runs = []
+        for i, kmers in enumerate(self.kmers):
+            path = write_run(self.dir + '/run%d' % i, kmers,
+                             np.ones(kmers.shape[0]))
+            self.runs.append(read_run(path))
+
+    def tearDown(self):
+        del self.runs
+        shutil.rmtree(self.dir)
+
+    def expected(self):
+        kmers = np.concatenate(self.kmers)
+        unique, counts = np.unique(kmers, return_counts=True)
+        files = np.sum([np.isin(unique, x) for x in self.kmers], axis=0)
+        return unique.tolist(), counts.tolist(), files.tolist()
+
+    def test_sorted_run(self):
+        kmers, counts, files = self.runs[0]
+        self.assertTrue(np.all(kmers[1:] > kmers[:-1]))
+        self.assertEqual(int(np.sum(counts)), 300)
+        self.assertEqual(files, 1)
+
+    def test_merge(self):
+        self.assertEqual(merge_all(self.runs, 2 ** 20), list(self.expected()))
+
+    def test_small_budget(self):
+        chunks = list(merge_runs(self.runs, 500))
+        self.assertGreater(len(chunks), 10)
+        self.assertEqual(merge_all(self.runs, 500), list(self.expected()))
+
+    def test_file_counts(self):
+        kmers, counts, files = create_run(self.dir + '/base', 2, np.uint64,
+                                          files=True)
+        kmers[:] = [7, 600]
+        counts[:] = [10, 4]
+        files[:] = [5, 2]
+        for x in (kmers, counts, files):
+            x.flush()
+        del kmers, counts, files
+        base = read_run(self.dir + '/base')
+        kmers, counts, files = merge_all([base, self.runs[1]], 2 ** 20)
+        self.assertEqual(kmers[-1], 600)
+        self.assertEqual((counts[-1], files[-1]), (4, 2))
+        i = kmers.index(7)
+        self.assertEqual(files[i], 5 + int(7 in self.kmers[1]))
+
+    def test_empty(self):
+        path = write_run(self.dir + '/empty', np.array([], dtype=np.uint64),
+                         np.array([]))
+        self.assertEqual(merge_all([read_run(path)], 100), ([], [], []))
+
+
+class MergeBytes(unittest.TestCase):
+    def test_merge(self):
+        runs = [(np.array([b'AA', b'AC', b'CC']), np.array([1, 2, 3]), 1),
+                (np.array([b'AC', b'GG']), np.array([5, 1]), 1)]
+        kmers, counts, files = merge_all(runs, 100)
+        self.assertEqual(kmers, [b'AA', b'AC', b'CC', b'GG'])
+        self.assertEqual(counts, [1, 7, 3, 1])
+        self.assertEqual(files, [1, 2, 1, 1])
+
+
+if __name__ == "__main__":
+    loader = unittest.TestLoader()
+    all_tests = loader.discover('.', pattern='test_external_sort.py')
+    runner = unittest.TextTestRunner()
+    runner.run(all_tests)
@@ -1,6 +1,7 @@
 from builtins import str
 import unittest
 import numpy as np
+from scipy.sparse import csr_matrix, issparse
 from kmerprediction.feature_scaling import scale_to_range
 
 
@@ -27,6 +28,25 @@ class ScaleToRange(unittest.TestCase):
                         '\nShould all be <= %d and >= %d' % (self.H, self.L))
 
 
+class ScaleToRangeSparse(unittest.TestCase):
+    def setUp(self):
+        self.x_train = np.random.randint(10, size=(12, 6)).astype('float64')
+        self.x_train[0] = 9
+        self.x_test = np.random.randint(10, size=(6, 6)).astype('float64')
+        data = [csr_matrix(self.x_train), np.random.randint(2, size=12),
+                csr_matrix(self.x_test), np.random.randint(2, size=6)]
+        self.new_data = scale_to_range(data, low=-1.0, high=2.0)
+
+    def test_sparse(self):
+        self.assertTrue(issparse(self.new_data[0]) and issparse(self.new_data[2]))
+
+    def test_values(self):
+        self.assertTrue(np.allclose(self.new_data[0].toarray(),
+                                    self.x_train / 9.0 * 2.0))
+        self.assertTrue(np.allclose(self.new_data[2].toarray(),
+                                    self.x_test / 9.0 * 2.0))
+
+
 if __name__ == "__main__":
     loader = unittest.TestLoader()
     all_tests = loader.discover('.', pattern='test_feature_scaling.py')
@@ -5,6 +5,7 @@ from past.utils import old_div
 import unittest
 import numpy as np
 import pandas as pd
+from scipy.sparse import csr_matrix, issparse
 from sklearn.feature_selection import chi2
 from kmerprediction.feature_selection import variance_threshold, remove_constant
 from kmerprediction.feature_selection import select_k_best, select_percentile
@@ -89,6 +90,15 @@ class RemoveConstantFeatures(unittest.TestCase):
             val = False
         self.assertTrue(val)
 
+    def test_sparse(self):
+        features_before = np.array(['a', 'b', 'c', 'd', 'e', 'f'])
+        data = (csr_matrix(self.x_train), [], csr_matrix(self.x_test), [])
+        data, features, args = remove_constant(data, features_before)
+        self.assertTrue(issparse(data[0]) and issparse(data[2]))
+        self.assertTrue(np.array_equal(data[0].toarray(), self.correct_x_train))
+        self.assertTrue(np.array_equal(data[2].toarray(), self.correct_x_test))
+        self.assertTrue(np.array_equal(features, ['b', 'c', 'd', 'e']))
+
 
 class SelectKBest(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,68 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from kmerprediction.genome_cache import describe, describe_all, read_index
+from kmerprediction.genome_cache import file_digest, load, store
+
+
+class Describe(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fasta = self.dir + '/A1.fasta'
+        with open(self.fasta, 'w') as f:
+            f.write('>\nAAACCCCAA')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_digest(self):
+        copy = self.dir + '/copy.fasta'
+        shutil.copy(self.fasta, copy)
+        self.assertEqual(describe(copy)['digest'], file_digest(self.fasta))
+
+    def test_known(self):
+        known = describe(self.fasta)
+        known['digest'] = 'not rehashed'
+        self.assertEqual(describe(self.fasta, known)['digest'], 'not rehashed')
+
+    def test_changed(self):
+        known = describe(self.fasta)
+        with open(self.fasta, 'w') as f:
+            f.write('>\nAACCAACCAA')
+        record = describe(self.fasta, known)
+        self.assertNotEqual(record['digest'], known['digest'])
+
+    def test_index(self):
+        cache = self.dir + '/cache'
+        records = describe_all([self.fasta], cache)
+        index = read_index(cache)
+        self.assertEqual(index[os.path.realpath(self.fasta)],
+                         records[self.fasta])
+
+
+class Entries(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        self.assertIsNone(load(self.dir, 'abc', 2))
+        store(self.dir, 'abc', 2, np.array([3, 1], dtype=np.uint64),
+              np.array([5, 7]))
+        kmers, counts = load(self.dir, 'abc', 2)
+        self.assertEqual(kmers.tolist(), [1, 3])
+        self.assertEqual(counts.tolist(), [7, 5])
+        self.assertIsNone(load(self.dir, 'abc', 3))
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['abc-k2.counts.npy', 'abc-k2.kmers.npy'])
+
+
+if __name__ == "__main__":
+    loader = unittest.TestLoader()
+    all_tests = loader.discover('.', pattern='test_genome_cache.py')
+    runner = unittest.TextTestRunner()
+    runner.run(all_tests)
@@ -4,7 +4,14 @@ import shutil
 import tempfile
 import lmdb
 import numpy as np
+from scipy.sparse import issparse
 from kmerprediction.kmer_counter import count_kmers, get_counts, add_counts, get_kmer_names
+from kmerprediction.native_counter import unpack_names
+from kmerprediction.kmer_counter import merge_shared
+from kmerprediction.kmer_counter import count_kmers_multi, multi_database
+from kmerprediction.kmer_counter import derive_limit
+from kmerprediction.complete_kmer_counter import KmerCounterError
+from kmerprediction import constants
 
 
 def create_temp_files():
@@ -141,6 +148,180 @@ class AddCounts(unittest.TestCase):
         self.assertTrue(val)
 
 
+class NativeBackend(unittest.TestCase):
+    def setUp(self):
+        self.dir, self.db, self.files = create_temp_files()
+        count_kmers(self.files, self.db, k=2, limit=1, backend='native')
+        self.new_file = self.dir + '/B2'
+        with open(self.new_file, 'w') as f:
+            f.write('>\nAAAAAAT')
+        add_counts([self.new_file], self.db, backend='native')
+        self.counts = get_counts(self.files + [self.new_file], self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_values(self):
+        val = True
+        val = val and np.array_equal(self.counts[0], [3, 1, 1, 3])
+        val = val and np.array_equal(self.counts[1], [2, 1, 1, 3])
+        val = val and np.array_equal(self.counts[2], [2, 2, 1, 2])
+        val = val and np.array_equal(self.counts[3], [5, 0, 0, 0])
+        self.assertTrue(val)
+
+    def test_packed_names(self):
+        names = get_kmer_names(self.db, packed=True)
+        self.assertEqual(names.dtype, np.uint64)
+        self.assertEqual(unpack_names(names).tolist(), ['AA', 'AC', 'CA', 'CC'])
+
+    def test_dtype(self):
+        counts = get_counts(self.files, self.db, dtype='int32')
+        self.assertEqual(counts.dtype, np.int32)
+        self.assertTrue(np.array_equal(counts, self.counts[:3]))
+
+    def test_recorded_dtype(self):
+        self.assertEqual(self.counts.dtype, np.uint8)
+
+    def test_saturate(self):
+        count_kmers(self.files, self.db, k=2, limit=1, backend='native',
+                    force=True, saturate=2)
+        counts = get_counts(self.files, self.db)
+        self.assertEqual(counts[0].tolist(), [2, 1, 1, 2])
+
+    def test_sparse(self):
+        counts = get_counts(self.files + [self.new_file], self.db, sparse=True)
+        self.assertTrue(issparse(counts))
+        self.assertTrue(np.array_equal(counts.toarray(), self.counts))
+
+
+class CountKmersMulti(unittest.TestCase):
+    def setUp(self):
+        self.dir, self.db, self.files = create_temp_files()
+        count_kmers_multi(self.files, self.db, [3, 2], limit=1,
+                          backend='native')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_values(self):
+        for k in [2, 3]:
+            single = self.dir + '/single{}'.format(k)
+            count_kmers(self.files, single, k=k, limit=1, backend='native')
+            multi = multi_database(self.db, k)
+            self.assertEqual(get_counts(self.files, multi).tolist(),
+                             get_counts(self.files, single).tolist())
+            self.assertEqual(get_kmer_names(multi).tolist(),
+                             get_kmer_names(single).tolist())
+
+    def test_sized(self):
+        for k in [2, 3]:
+            env = lmdb.open(multi_database(self.db, k), max_dbs=10)
+            metadata = env.open_db('metadata'.encode())
+            with env.begin(db=metadata) as txn:
+                distinct = txn.get('distinct_kmers'.encode())
+            self.assertLess(env.info()['map_size'], constants.MAP_SIZE)
+            env.close()
+            self.assertEqual(int(distinct), {2: 4, 3: 6}[k])
+
+    def test_add_length(self):
+        count_kmers_multi(self.files[:1], self.db, [2, 4], limit=1,
+                          backend='native')
+        names = get_kmer_names(multi_database(self.db, 4))
+        self.assertEqual(names.tolist(), ['AAAC', 'AACC', 'ACCC', 'CCAA',
+                                          'CCCA', 'CCCC'])
+        counts = get_counts(self.files, multi_database(self.db, 2))
+        self.assertEqual(counts[0].tolist(), [3, 1, 1, 3])
+
+
+class DeriveLimit(unittest.TestCase):
+    def setUp(self):
+        self.dir, self.db, self.files = create_temp_files()
+        count_kmers(self.files, self.db, k=2, limit=1, backend='native')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_values(self):
+        for limit in [1, 2, 3]:
+            derived = self.dir + '/derived{}'.format(limit)
+            counted = self.dir + '/counted{}'.format(limit)
+            derive_limit(self.files, self.db, derived, limit)
+            count_kmers(self.files, counted, k=2, limit=limit,
+                        backend='native')
+            self.assertEqual(get_kmer_names(derived).tolist(),
+                             get_kmer_names(counted).tolist())
+            self.assertEqual(get_counts(self.files, derived).tolist(),
+                             get_counts(self.files, counted).tolist())
+
+    def test_subset(self):
+        derived = self.dir + '/derived'
+        derive_limit(self.files[:2], self.db, derived, 3)
+        self.assertEqual(get_kmer_names(derived).tolist(), ['CC'])
+        self.assertEqual(get_counts(self.files[:2], derived).tolist(),
+                         [[3], [3]])
+
+    def test_lower_limit(self):
+        counted = self.dir + '/counted'
+        count_kmers(self.files, counted, k=2, limit=2, backend='native')
+        with self.assertRaises(KmerCounterError):
+            derive_limit(self.files, counted, self.dir + '/derived', 1)
+
+
+class SharedKmers(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = self.dir + '/TEMPdatabase'
+        self.files = [self.dir + '/X1', self.dir + '/X2', self.dir + '/X3']
+        for filename, sequence in zip(self.files, ['AAAAC', 'AAAGG', 'AAAT']):
+            with open(filename, 'w') as f:
+                f.write('>\n' + sequence)
+        count_kmers(self.files[:2], self.db, k=2, limit=1, backend='native')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_values(self):
+        counts = get_counts(self.files[:2], self.db)
+        self.assertEqual(counts.tolist(), [[3], [2]])
+        self.assertEqual(get_kmer_names(self.db).tolist(), ['AA'])
+
+    def test_add_genome(self):
+        count_kmers(self.files, self.db, k=2, limit=1, backend='native')
+        counts = get_counts(self.files, self.db)
+        self.assertEqual(counts.tolist(), [[3], [2], [2]])
+
+    def test_genome_shares_nothing(self):
+        with open(self.files[2], 'w') as f:
+            f.write('>\nCGCG')
+        count_kmers(self.files, self.db, k=2, limit=1, backend='native')
+        self.assertEqual(get_kmer_names(self.db).tolist(), [])
+        env = lmdb.open(self.db, max_dbs=10)
+        with env.begin() as txn:
+            X1 = env.open_db(self.files[0].encode(), txn=txn)
+            self.assertEqual(txn.stat(X1)['entries'], 0)
+        env.close()
+
+
+class MergeShared(unittest.TestCase):
+    def test_merge(self):
+        shared = {'kmers': None, 'counts': {}}
+        merge_shared(shared, 'a', np.array([b'AA', b'AC', b'CC']),
+                     np.array([1, 2, 3]))
+        merge_shared(shared, 'b', np.array([b'AC', b'CC', b'GG']),
+                     np.array([4, 5, 6]))
+        merge_shared(shared, 'c', np.array([b'AA', b'CC']), np.array([7, 8]))
+        self.assertEqual(shared['kmers'].tolist(), [b'CC'])
+        self.assertEqual({k: v.tolist() for k, v in shared['counts'].items()},
+                         {'a': [3], 'b': [5], 'c': [8]})
+
+    def test_empty(self):
+        shared = {'kmers': np.array([b'AA']), 'counts': {'a': np.array([1])}}
+        merge_shared(shared, 'b', np.array([], dtype='S1'),
+                     np.array([], dtype=int))
+        self.assertEqual(shared['kmers'].tolist(), [])
+        self.assertEqual(shared['counts']['b'].tolist(), [])
+
+
 class GetKmerNames(unittest.TestCase):
     def setUp(self):
         self.dir = tempfile.mkdtemp() + '/'
@@ -0,0 +1,140 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+from kmerprediction import native_counter
+from kmerprediction.native_counter import count_file, decode_kmers, encode_kmers
+from kmerprediction.native_counter import count_file_multi
+
+
+def reverse_complement(kmer):
+    return kmer[::-1].translate(str.maketrans('ACGT', 'TGCA'))
+
+
+def brute_force(sequences, k):
+    counts = {}
+    for sequence in sequences:
+        for i in range(len(sequence) - k + 1):
+            kmer = sequence[i:i + k]
+            if set(kmer) - set('ACGT'):
+                continue
+            kmer = min(kmer, reverse_complement(kmer))
+            counts[kmer] = counts.get(kmer, 0) + 1
+    return counts
+
+
+class CountFile(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fasta = self.dir + '/A1.fasta'
+        with open(self.fasta, 'w') as f:
+            f.write('>\nAAACCCCAA')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_counts(self):
+        codes, counts = count_file(self.fasta, 2)
+        kmers = decode_kmers(codes, 2)
+        self.assertEqual(list(kmers), ['AA', 'AC', 'CA', 'CC'])
+        self.assertEqual(list(counts), [3, 1, 1, 3])
+
+    def test_limit(self):
+        codes, counts = count_file(self.fasta, 2, limit=2)
+        self.assertEqual(list(decode_kmers(codes, 2)), ['AA', 'CC'])
+
+
+class MatchesBruteForce(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fasta = self.dir + '/genome.fasta'
+        rng = np.random.RandomState(0)
+        self.sequences = [''.join(rng.choice(list('ACGT'), 500)),
+                          ''.join(rng.choice(list('ACGTN'), 300))]
+        with open(self.fasta, 'w') as f:
+            for index, sequence in enumerate(self.sequences):
+                f.write('>record{}\n'.format(index))
+                for i in range(0, len(sequence), 60):
+                    f.write(sequence[i:i + 60] + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check(self, k):
+        codes, counts = count_file(self.fasta, k)
+        output = dict(zip(decode_kmers(codes, k), counts))
+        self.assertEqual(output, brute_force(self.sequences, k))
+
+    def test_dense(self):
+        self.check(5)
+
+    def test_sparse(self):
+        self.check(native_counter.DENSE_MAX_K + 2)
+
+    def test_chunked(self):
+        chunk_size = native_counter.CHUNK_SIZE
+        native_counter.CHUNK_SIZE = 64
+        try:
+            self.check(4)
+            self.check(native_counter.DENSE_MAX_K + 1)
+        finally:
+            native_counter.CHUNK_SIZE = chunk_size
+
+    def check_multi(self, ks):
+        counted = count_file_multi(self.fasta, ks)
+        self.assertEqual(sorted(counted), sorted(ks))
+        for k in ks:
+            codes, counts = counted[k]
+            output = dict(zip(decode_kmers(codes, k), counts))
+            self.assertEqual(output, brute_force(self.sequences, k))
+
+    def test_multi(self):
+        self.check_multi([7, 3, native_counter.DENSE_MAX_K + 2])
+
+    def test_multi_chunked(self):
+        chunk_size = native_counter.CHUNK_SIZE
+        native_counter.CHUNK_SIZE = 64
+        try:
+            self.check_multi([1, 4, native_counter.DENSE_MAX_K + 1, 31])
+        finally:
+            native_counter.CHUNK_SIZE = chunk_size
+
+
+class EncodeKmers(unittest.TestCase):
+    def test_round_trip(self):
+        kmers = ['AAAAAAA', 'ACGTACG', 'TTTTTTT', 'GATTACA']
+        codes = encode_kmers(kmers)
+        self.assertEqual(list(decode_kmers(codes, 7)), kmers)
+
+    def test_order(self):
+        kmers = ['AGGA', 'AAAA', 'CGCG', 'ATAT']
+        codes = encode_kmers(kmers)
+        self.assertEqual(list(np.argsort(codes)), list(np.argsort(kmers)))
+
+
+class PackNames(unittest.TestCase):
+    def test_round_trip(self):
+        kmers = ['AAAAAAA', 'ACGTACG', 'TTTTTTT', 'GATTACA']
+        names = native_counter.pack_names(encode_kmers(kmers), 7)
+        self.assertEqual(names.dtype, np.uint64)
+        self.assertEqual(list(native_counter.unpack_names(names)), kmers)
+
+    def test_order(self):
+        kmers = ['AGGA', 'AAAA', 'CGCG', 'ATAT']
+        names = native_counter.pack_names(encode_kmers(kmers), 4)
+        self.assertEqual(list(np.argsort(names)), list(np.argsort(kmers)))
+
+    def test_strings(self):
+        names = np.array(['PM1-A1', 'PM1-A2'])
+        self.assertTrue(np.array_equal(native_counter.unpack_names(names), names))
+
+    def test_too_long(self):
+        with self.assertRaises(ValueError):
+            native_counter.pack_names(np.zeros(1, dtype=np.uint64), 32)
+
+
+if __name__ == "__main__":
+    loader = unittest.TestLoader()
+    all_tests = loader.discover('.', pattern='test_native_counter.py')
+    runner = unittest.TextTestRunner()
+    runner.run(all_tests)
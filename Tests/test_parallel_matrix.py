@@ -0,0 +1,99 @@
+import unittest
+import importlib.util
+import itertools
+import os
+import shutil
+import tempfile
+import numpy as np
+from kmerprediction.native_counter import encode_kmers
+
+path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src',
+                    'parallel_matrix.py')
+spec = importlib.util.spec_from_file_location('parallel_matrix', path)
+parallel_matrix = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(parallel_matrix)
+
+COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+
+
+def column_names(k):
+    # The column dictionary of the dict based script
+    col_names = {}
+    for item in itertools.product('ACGT', repeat=k):
+        dna = ''.join(item)
+        revcomp = ''.join(COMPLEMENT[x] for x in reversed(dna))
+        if revcomp < dna:
+            dna = revcomp
+        if dna not in col_names:
+            col_names[dna] = len(col_names)
+    return col_names
+
+
+class CanonicalRank(unittest.TestCase):
+    def test_rank(self):
+        for k in range(1, 8):
+            names = list(column_names(k))
+            codes = encode_kmers(np.array(names, dtype='S'))
+            self.assertEqual(parallel_matrix.count_canonical(k), len(names))
+            self.assertEqual(parallel_matrix.canonical_codes(k).tolist(),
+                             codes.tolist())
+            self.assertEqual(parallel_matrix.canonical_rank(codes, k).tolist(),
+                             list(range(len(names))))
+
+
+class MakeRow(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.k = 5
+        rng = np.random.RandomState(0)
+        kmers = [''.join(x) for x in itertools.product('ACGT', repeat=self.k)]
+        chosen = rng.choice(kmers, 300, replace=False)
+        self.counts = {}
+        self.dump = self.dir + '/results.GENOME1.fasta'
+        with open(self.dump, 'w') as f:
+            for kmer in chosen:
+                revcomp = ''.join(COMPLEMENT[x] for x in reversed(kmer))
+                # jellyfish dumps each canonical kmer once
+                if min(kmer, revcomp) in self.counts:
+                    continue
+                count = int(rng.randint(1, 400))
+                self.counts[min(kmer, revcomp)] = count
+                f.write('>{}\n{}\n'.format(count, kmer))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def expected(self):
+        col_names = column_names(self.k)
+        row = [0] * len(col_names)
+        for kmer, count in self.counts.items():
+            row[col_names[kmer]] = count
+        return row
+
+    def make_row(self, dtype):
+        shape = (2, parallel_matrix.count_canonical(self.k))
+        parallel_matrix.kmer_matrix = np.zeros(shape, dtype=dtype)
+        try:
+            result = parallel_matrix.make_row((1, self.dump))
+            return result, parallel_matrix.kmer_matrix.copy()
+        finally:
+            del parallel_matrix.kmer_matrix
+
+    def test_row(self):
+        (genomeid, count), matrix = self.make_row('uint32')
+        self.assertEqual(genomeid, 'GENOME1')
+        self.assertEqual(count, max(self.counts.values()))
+        self.assertEqual(matrix[1].tolist(), self.expected())
+        self.assertFalse(np.any(matrix[0]))
+
+    def test_saturate(self):
+        (genomeid, count), matrix = self.make_row('uint8')
+        self.assertEqual(matrix[1].tolist(),
+                         [min(x, 255) for x in self.expected()])
+
+
+if __name__ == "__main__":
+    loader = unittest.TestLoader()
+    all_tests = loader.discover('.', pattern='test_parallel_matrix.py')
+    runner = unittest.TextTestRunner()
+    runner.run(all_tests)
@@ -0,0 +1,135 @@
+import unittest
+import shutil
+import tempfile
+import lmdb
+import numpy as np
+from kmerprediction.pipeline import run, result_size, schedule, max_in_flight
+
+
+def fail(x):
+    raise ValueError(x)
+
+
+def nested(n):
+    lengths = []
+    run([(x,) for x in range(n)], np.arange,
+        lambda job, result: lengths.append(result.shape[0]))
+    return sorted(lengths)
+
+
+class Run(unittest.TestCase):
+    def setUp(self):
+        self.jobs = [(x,) for x in range(10)]
+        self.results = {}
+
+    def consume(self, job, result):
+        self.results[job[0]] = result
+
+    def test_every_job(self):
+        run(self.jobs, np.arange, self.consume, workers=3)
+        self.assertEqual(sorted(self.results), list(range(10)))
+        for x, result in self.results.items():
+            self.assertTrue(np.array_equal(result, np.arange(x)))
+
+    def test_small_budget(self):
+        run(self.jobs, np.arange, self.consume, workers=3, memory_budget=1)
+        self.assertEqual(sorted(self.results), list(range(10)))
+
+    def test_no_jobs(self):
+        run([], np.arange, self.consume)
+        self.assertEqual(self.results, {})
+
+    def test_stats(self):
+        stats = run(self.jobs, np.arange, self.consume, workers=2)
+        self.assertEqual(sorted(x[0] for x in stats), self.jobs)
+        self.assertTrue(all(x[1] >= 0 and x[2] >= 0 for x in stats))
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            run(self.jobs, fail, self.consume, workers=2)
+
+    def test_nested(self):
+        run(self.jobs[:4], nested, self.consume, workers=2)
+        for x, result in self.results.items():
+            self.assertEqual(result, list(range(x)))
+
+
+
+class Batched(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.env = lmdb.open(self.dir + '/db')
+        self.jobs = [(x,) for x in range(10)]
+
+    def tearDown(self):
+        self.env.close()
+        shutil.rmtree(self.dir)
+
+    def write(self, txn, job, result):
+        txn.put(str(job[0]).encode(), result.tobytes())
+
+    def test_commits(self):
+        start = self.env.info()['last_txnid']
+        run(self.jobs, np.arange, self.write, workers=2, env=self.env,
+            commit_count=4)
+        # 10 results in batches of 4, 4 and 2
+        self.assertEqual(self.env.info()['last_txnid'] - start, 3)
+        with self.env.begin() as txn:
+            self.assertEqual(txn.stat()['entries'], 10)
+
+    def test_commit_size(self):
+        start = self.env.info()['last_txnid']
+        run(self.jobs, np.arange, self.write, workers=2, env=self.env,
+            commit_size=1)
+        # the empty result of job 0 is committed along with the next one
+        self.assertEqual(self.env.info()['last_txnid'] - start, 9)
+
+    def test_rollback(self):
+        def write(txn, job, result):
+            if job[0] == 5:
+                raise ValueError(job)
+            self.write(txn, job, result)
+        with self.assertRaises(ValueError):
+            run(self.jobs, np.arange, write, workers=1, env=self.env,
+                commit_count=4)
+        with self.assertRaises(ValueError):
+            run(self.jobs, fail, self.write, workers=1, env=self.env)
+        with self.env.begin() as txn:
+            self.assertLessEqual(txn.stat()['entries'], 4)
+            self.assertEqual(txn.stat()['entries'] % 4, 0)
+
+
+class MaxInFlight(unittest.TestCase):
+    def test_budget(self):
+        self.assertEqual(max_in_flight(4, 100, 30), 3)
+        self.assertEqual(max_in_flight(4, 100, 1000), 1)
+
+    def test_small_results(self):
+        self.assertEqual(max_in_flight(4, 2 ** 30, 1), 8)
+        self.assertEqual(max_in_flight(4, 2 ** 30, 0), 8)
+
+class Schedule(unittest.TestCase):
+    def test_many_jobs(self):
+        self.assertEqual(schedule(400, cores=8), (8, 1))
+
+    def test_few_jobs(self):
+        self.assertEqual(schedule(2, cores=8), (2, 4))
+
+    def test_workers(self):
+        self.assertEqual(schedule(400, cores=8, workers=3), (3, 2))
+
+    def test_no_jobs(self):
+        self.assertEqual(schedule(0, cores=8), (1, 8))
+
+
+class ResultSize(unittest.TestCase):
+    def test_size(self):
+        result = (np.zeros(4, dtype='S3'), np.zeros(4, dtype=np.int64))
+        self.assertEqual(result_size(result), 12 + 32)
+
+
+if __name__ == "__main__":
+    loader = unittest.TestLoader()
+    all_tests = loader.discover('.', pattern='test_pipeline.py')
+    runner = unittest.TextTestRunner()
+    runner.run(all_tests)
@@ -0,0 +1,134 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+from unittest import mock
+from kmerprediction import native_counter
+from kmerprediction import read_filter
+from kmerprediction.read_filter import bloom_filter, bloom_bits, bloom_add
+from kmerprediction.read_filter import bloom_contains, count_file, is_reads
+from kmerprediction.read_filter import count_file_multi, read_chunks
+from kmerprediction.complete_kmer_counter import count_kmers, get_counts
+from kmerprediction.complete_kmer_counter import get_kmer_names
+
+
+def write_reads(path, reads):
+    with open(path, 'w') as f:
+        for i, read in enumerate(reads):
+            f.write('@read{}\n{}\n+\n{}\n'.format(i, read, 'I' * len(read)))
+
+
+class Bloom(unittest.TestCase):
+    def test_contains(self):
+        bloom = bloom_filter(1000)
+        codes = np.arange(0, 2000, 2, dtype=np.uint64)
+        bloom_add(bloom, bloom_bits(bloom, codes))
+        self.assertTrue(np.all(bloom_contains(bloom, bloom_bits(bloom, codes))))
+        others = np.arange(1, 2000, 2, dtype=np.uint64)
+        found = bloom_contains(bloom, bloom_bits(bloom, others))
+        self.assertLess(np.mean(found), 0.1)
+
+    def test_coverage(self):
+        # 100x coverage of a 2000 base genome, about 2000 distinct canonical
+        # 21-mers in 200000 bases
+        tmp = tempfile.mkdtemp()
+        try:
+            rng = np.random.RandomState(1)
+            genome = ''.join(rng.choice(list('ACGT'), 2000))
+            starts = rng.randint(0, 1900, 2000)
+            reads = tmp + '/R1.fastq'
+            write_reads(reads, [genome[x:x + 100] for x in starts])
+            with mock.patch.object(read_filter, 'bloom_filter',
+                                   wraps=read_filter.bloom_filter) as made:
+                codes, counts = count_file(reads, 21)
+            exact, totals = native_counter.count_file(reads, 21)
+        finally:
+            shutil.rmtree(tmp)
+        self.assertEqual(made.call_count, 2)
+        for args, kwargs in made.call_args_list:
+            self.assertGreater(args[0], 1800)
+            self.assertLess(args[0], 2200)
+        # 12.4 bits per distinct kmer rounds up to 4 KB, where sizing by
+        # bases would take 8 bits per base, 256 KB
+        self.assertEqual(bloom_filter(2200).shape[0], 4096)
+        self.assertEqual(codes.tolist(), exact[totals >= 2].tolist())
+
+
+class CountReads(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        genome = ''.join(rng.choice(list('ACGT'), 2000))
+        reads = []
+        for start in rng.randint(0, 1900, 200):
+            read = list(genome[start:start + 100])
+            # an error in half of the reads
+            if rng.rand() < 0.5:
+                read[rng.randint(100)] = rng.choice(list('ACGT'))
+            reads.append(''.join(read))
+        self.reads = self.dir + '/R1.fastq'
+        write_reads(self.reads, reads)
+        self.fasta = self.dir + '/A1.fasta'
+        with open(self.fasta, 'w') as f:
+            f.write('>\n' + genome)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def expected(self, k):
+        codes, counts = native_counter.count_file(self.reads, k)
+        return codes[counts >= 2].tolist(), counts[counts >= 2].tolist()
+
+    def test_is_reads(self):
+        self.assertTrue(is_reads(self.reads))
+        self.assertFalse(is_reads(self.fasta))
+
+    def test_dense(self):
+        codes, counts = count_file(self.reads, 7)
+        self.assertEqual((codes.tolist(), counts.tolist()), self.expected(7))
+
+    def test_bloom(self):
+        chunk_size = native_counter.CHUNK_SIZE
+        native_counter.CHUNK_SIZE = 500
+        try:
+            codes, counts = count_file(self.reads, 21)
+        finally:
+            native_counter.CHUNK_SIZE = chunk_size
+        self.assertEqual((codes.tolist(), counts.tolist()), self.expected(21))
+
+    def test_chunks(self):
+        chunk_size = native_counter.CHUNK_SIZE
+        native_counter.CHUNK_SIZE = 500
+        try:
+            chunks = list(read_chunks(self.reads))
+            counted = count_file_multi(self.reads, [7, 21])
+        finally:
+            native_counter.CHUNK_SIZE = chunk_size
+        self.assertGreater(len(chunks), 1)
+        # 200 reads of 100 bases, joined by an invalid base within each chunk
+        self.assertEqual(sum(x.shape[0] + 1 for x in chunks), 200 * 101)
+        for k in [7, 21]:
+            codes, counts = counted[k]
+            self.assertEqual((codes.tolist(), counts.tolist()),
+                             self.expected(k))
+
+    def test_fasta(self):
+        codes, counts = count_file(self.fasta, 21)
+        self.assertIn(1, counts.tolist())
+
+    def test_count_kmers(self):
+        db = self.dir + '/db'
+        count_kmers([self.reads], db, k=21, backend='native')
+        counts = get_counts([self.reads], db)
+        names = get_kmer_names(db)
+        codes, expected = self.expected(21)
+        self.assertEqual(counts[0].tolist(), expected)
+        self.assertEqual(names.tolist(),
+                         native_counter.decode_kmers(codes, 21).tolist())
+
+
+if __name__ == "__main__":
+    loader = unittest.TestLoader()
+    all_tests = loader.discover('.', pattern='test_read_filter.py')
+    runner = unittest.TextTestRunner()
+    runner.run(all_tests)
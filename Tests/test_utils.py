@@ -434,6 +434,43 @@ class CheckFasta(unittest.TestCase):
         self.assertTrue(val)
 
 
+class SniffFasta(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, contents):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(contents)
+        return path
+
+    def test_fasta(self):
+        self.assertTrue(check_fasta(self.write('a.fasta', b'\n>A1\nAACC\n')))
+        self.assertTrue(check_fasta(self.write('b.fasta', b'>')))
+
+    def test_fastq(self):
+        path = self.write('a.fastq', b'@r1\nAACC\n+\nIIII\n@r2\nAC\n+\nII\n')
+        self.assertTrue(check_fasta(path))
+        path = self.write('b.fastq', b'@r1\nAACC\n+\nII\n')
+        self.assertFalse(check_fasta(path))
+
+    def test_non_fasta(self):
+        self.assertFalse(check_fasta(self.write('a.txt', b'import os\n')))
+        self.assertFalse(check_fasta(self.write('b.txt', b'')))
+        self.assertFalse(check_fasta(self.write('c.bin', b'\x00\xff' * 10)))
+
+    def test_changed(self):
+        path = self.write('a.fasta', b'>A1\nAACC\n')
+        self.assertTrue(check_fasta(path))
+        stat = os.stat(path)
+        self.write('a.fasta', b'not a fasta file')
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertFalse(check_fasta(path))
+
+
 class ValidFile(unittest.TestCase):
     def setUp(self):
         self.dir = tempfile.mkdtemp()
@@ -0,0 +1,193 @@
+"""
+HyperLogLog estimates of the number of distinct canonical kmers in a genome,
+used to size jellyfish's hash and the lmdb map before any kmers are counted.
+
+Every kmer is encoded with native_counter, hashed, and the first PRECISION
+bits of the hash pick a register that remembers the longest run of trailing
+zeros seen in the rest of the hash. Sketches of different genomes are merged
+by taking the larger value of each register, so the number of distinct
+kmers across a cohort can be estimated without counting any of them.
+"""
+
+import numpy as np
+from kmerprediction import native_counter
+
+# Number of bits used to pick a register, the relative error of an estimate is
+# about 1.04 / sqrt(2 ** PRECISION), 0.8% with 2 ** 14 registers.
+PRECISION = 14
+
+# Every lmdb entry costs its key, its value and a node header, and B-tree
+# pages are only partly full, ENTRY_OVERHEAD and PAGE_FILL account for both.
+ENTRY_OVERHEAD = 16
+PAGE_FILL = 0.5
+
+# Extra room given to jellyfish's hash over the estimated number of kmers.
+HASH_HEADROOM = 1.25
+
+_MIX = [np.uint64(0x9E3779B97F4A7C15), np.uint64(0xBF58476D1CE4E5B9),
+        np.uint64(0x94D049BB133111EB)]
+
+
+def hash_codes(codes):
+    """
+    Scramble kmer codes with the splitmix64 finalizer so that their bits are
+    evenly distributed.
+
+    Args:
+        codes (ndarray):    uint64 kmer codes.
+
+    Returns:
+        ndarray: The uint64 hash of each code.
+    """
+    z = codes + _MIX[0]
+    z = (z ^ (z >> np.uint64(30))) * _MIX[1]
+    z = (z ^ (z >> np.uint64(27))) * _MIX[2]
+    return z ^ (z >> np.uint64(31))
+
+
+def sketch_codes(codes, registers=None, precision=PRECISION):
+    """
+    Add kmer codes to a HyperLogLog sketch.
+
+    Args:
+        codes (ndarray):        uint64 kmer codes.
+        registers (ndarray):    The sketch to add to, a new sketch is made if
+                                not given.
+        precision (int):        log2 of the number of registers.
+
+    Returns:
+        ndarray: The uint8 registers of the sketch.
+    """
+    if registers is None:
+        registers = np.zeros(2 ** precision, dtype=np.uint8)
+    if codes.shape[0] == 0:
+        return registers
+    hashes = hash_codes(codes)
+    index = (hashes >> np.uint64(64 - precision)).astype(np.intp)
+    rest = hashes & np.uint64(2 ** (64 - precision) - 1)
+    lowest = rest & (~rest + np.uint64(1))
+    rank = np.full(rest.shape[0], 64 - precision + 1, dtype=np.uint8)
+    found = rest != 0
+    rank[found] = np.log2(lowest[found].astype(np.float64)).astype(np.uint8) + 1
+    np.maximum.at(registers, index, rank)
+    return registers
+
+
+def sketch_file(input_file, k, precision=PRECISION):
+    """
+    Make a HyperLogLog sketch of the canonical kmers of length k in a fasta or
+    fastq file.
+
+    Args:
+        input_file (str):   Path to the file to sketch.
+        k (int):            Length of kmer, at most native_counter.MAX_K.
+        precision (int):    log2 of the number of registers.
+
+    Returns:
+        ndarray: The uint8 registers of the sketch.
+    """
+    encoded = native_counter.encode_sequences(
+        native_counter.read_sequences(input_file))
+    return sketch_encoded(encoded, k, precision)
+
+
+def sketch_encoded(encoded, k, precision=PRECISION):
+    """
+    Make a HyperLogLog sketch of the canonical kmers of length k in encoded
+    sequences.
+
+    Args:
+        encoded (ndarray):  Output of native_counter.encode_sequences.
+        k (int):            Length of kmer, at most native_counter.MAX_K.
+        precision (int):    log2 of the number of registers.
+
+    Returns:
+        ndarray: The uint8 registers of the sketch.
+    """
+    registers = np.zeros(2 ** precision, dtype=np.uint8)
+    n = max(encoded.shape[0] - k + 1, 0)
+    for start in range(0, n, native_counter.CHUNK_SIZE):
+        chunk = encoded[start:start + native_counter.CHUNK_SIZE + k - 1]
+        sketch_codes(native_counter.kmer_codes(chunk, k), registers)
+    return registers
+
+
+def sketch_file_multi(input_file, ks, precision=PRECISION):
+    """
+    Make a sketch of the canonical kmers of every length in ks in a fasta or
+    fastq file, reading and encoding the file once, see sketch_file.
+
+    Args:
+        input_file (str):   Path to the file to sketch.
+        ks (list(int)):     Lengths of kmer, at most native_counter.MAX_K.
+        precision (int):    log2 of the number of registers.
+
+    Returns:
+        dict: Maps each k to the registers of its sketch.
+    """
+    encoded = native_counter.encode_sequences(
+        native_counter.read_sequences(input_file))
+    return {k: sketch_encoded(encoded, k, precision) for k in ks}
+
+
+def merge(sketches):
+    """
+    Combine sketches into a sketch of every kmer in any of them.
+
+    Args:
+        sketches (list(ndarray)):   Sketches made with the same precision.
+
+    Returns:
+        ndarray: The merged registers.
+    """
+    return np.maximum.reduce([np.asarray(x, dtype=np.uint8) for x in sketches])
+
+
+def estimate(registers):
+    """
+    Estimate the number of distinct kmers added to a sketch.
+
+    Args:
+        registers (ndarray):    The sketch.
+
+    Returns:
+        int: The estimated number of distinct kmers.
+    """
+    m = registers.shape[0]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.exp2(-registers.astype(np.float64)))
+    zeros = np.count_nonzero(registers == 0)
+    if raw <= 2.5 * m and zeros:
+        raw = m * np.log(m / zeros)
+    return int(round(raw))
+
+
+def hash_size(distinct):
+    """
+    Pick the jellyfish hash size (-s) for a genome.
+
+    Args:
+        distinct (int): Estimated number of distinct kmers in the genome.
+
+    Returns:
+        str: The hash size to pass to jellyfish.
+    """
+    return '%d' % max(int(distinct * HASH_HEADROOM), 1024)
+
+
+def map_size(entries, k, value_size=8, extra=0):
+    """
+    Estimate how many bytes of lmdb map are needed to store entries.
+
+    Args:
+        entries (int):      Number of key value pairs.
+        k (int):            Length of the kmer keys.
+        value_size (int):   Size in bytes of each value.
+        extra (int):        Bytes of large values (such as output arrays) to
+                            make room for on top of entries.
+
+    Returns:
+        int: The number of bytes.
+    """
+    size = entries * (k + value_size + ENTRY_OVERHEAD) / PAGE_FILL
+    return int(size + extra / PAGE_FILL)
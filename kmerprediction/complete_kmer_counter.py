@@ -1,13 +1,25 @@
 import lmdb
+import json
 import sys
 import os
 import subprocess
 import numpy as np
 import pandas as pd
-from threading import Thread
+from scipy.sparse import csr_matrix
 import tempfile
 import shutil
+import itertools
+import zipfile
+import threading
 from kmerprediction import constants
+from kmerprediction import cardinality
+from kmerprediction import compression
+from kmerprediction import environments
+from kmerprediction import external_sort
+from kmerprediction import genome_cache
+from kmerprediction import native_counter
+from kmerprediction import pipeline
+from kmerprediction import read_filter
 import logging
 
 class KmerCounterError(Exception):
@@ -17,24 +29,388 @@ class KmerCounterError(Exception):
     """
 
 
-def count_file(input_file, output_file, k):
+def check_backend(backend):
     """
-    Use jellyfish to count kmers of length k in input_file and store the
-    result in output_file.
+    Raise a KmerCounterError if backend is not a known kmer counter.
 
     Args:
-        input_file (str):   Path to a fasta file to count kmers in.
+        backend (str):  Name of the kmer counter.
+
+    Returns:
+        None
+    """
+    if backend not in constants.BACKENDS:
+        msg = 'Unknown kmer counting backend: {}, expected one of {}'
+        raise(KmerCounterError(msg.format(backend, constants.BACKENDS)))
+
+
+def read_metadata(env, key, txn=None):
+    """
+    Get a value out of the metadata database of env.
+
+    Args:
+        env (lmdb.Environment): Environment containing the complete results.
+        key (str):              The metadata key.
+        txn (lmdb.Transaction): Transaction to read in, needed while a write
+                                transaction is open on env in this thread.
+
+    Returns:
+        bytes: The value, None if it is not recorded.
+    """
+    if txn is None:
+        with env.begin(write=False) as txn:
+            return read_metadata(env, key, txn)
+    try:
+        metadata = env.open_db('metadata'.encode(), txn=txn, create=False)
+    except lmdb.NotFoundError:
+        return None
+    return txn.get(key.encode(), db=metadata)
+
+
+def read_version(env, txn=None):
+    """
+    Get the storage format version of the database in env. Databases made
+    before the version was recorded store their counts as ascii strings and
+    are version 1.
+
+    Args:
+        env (lmdb.Environment): Environment containing the complete results.
+        txn (lmdb.Transaction): Transaction to read in, see read_metadata.
+
+    Returns:
+        int: The format version.
+    """
+    version = read_metadata(env, 'version', txn)
+    return 1 if version is None else int(version)
+
+
+def write_version(env, k=None):
+    """
+    Record the storage format version of the database in env. New databases
+    get constants.DB_VERSION, or the last unpacked version if k is too long to
+    pack. Databases that already contain counts but no version are marked as
+    version 1, and any other database without a version (such as an old
+    output database) as version 2, so that they can still be read and added
+    to. k is recorded alongside the version.
+
+    Args:
+        env (lmdb.Environment): Environment containing the complete results.
+        k (int):                The length of kmer stored in env.
+
+    Returns:
+        int: The format version.
+    """
+    fresh = env.stat()['entries'] == 0
+    metadata = env.open_db('metadata'.encode())
+    with env.begin(write=True, db=metadata) as txn:
+        version = txn.get('version'.encode())
+        if version is None:
+            try:
+                global_counts = env.open_db('global_counts'.encode(), txn=txn,
+                                            create=False)
+                counted = txn.stat(global_counts)['entries']
+            except lmdb.NotFoundError:
+                counted = 0
+            if counted:
+                version = 1
+            elif fresh and (k is None or k <= native_counter.MAX_K):
+                version = constants.DB_VERSION
+            else:
+                version = constants.PACKED_VERSION - 1
+            txn.put('version'.encode(), str(version).encode())
+        if k is not None and txn.get('k'.encode()) is None:
+            txn.put('k'.encode(), str(k).encode())
+    return int(version)
+
+
+def read_k(env, txn=None):
+    """
+    Get the length of kmer stored in env, recorded by write_version.
+
+    Args:
+        env (lmdb.Environment): Environment containing the complete results.
+        txn (lmdb.Transaction): Transaction to read in, see read_metadata.
+
+    Returns:
+        int: The length of kmer, None if never recorded.
+    """
+    k = read_metadata(env, 'k', txn)
+    return None if k is None else int(k)
+
+
+def encode_keys(kmers, version, k=None):
+    """
+    Convert kmers into lmdb keys. Packed versions store each kmer as its
+    native_counter code, earlier versions as ascii.
+
+    Args:
+        kmers (ndarray):    The kmers as bytes or as native_counter codes.
+        version (int):      The storage format version of the database.
+        k (int):            The length of the kmers, only needed to convert
+                            codes into ascii keys.
+
+    Returns:
+        list(bytes): One key per kmer.
+    """
+    kmers = np.asarray(kmers)
+    if kmers.shape[0] == 0:
+        return []
+    if version < constants.PACKED_VERSION:
+        if kmers.dtype == np.uint64:
+            kmers = native_counter.decode_kmers(kmers, k, as_bytes=True)
+        return kmers.tolist()
+    if kmers.dtype != np.uint64:
+        kmers = native_counter.encode_kmers(kmers)
+    keys = kmers.astype(constants.KEY_DTYPE)
+    return keys.view('V{}'.format(keys.itemsize)).tolist()
+
+
+def decode_keys(keys, version):
+    """
+    Convert lmdb keys back into kmers, the inverse of encode_keys.
+
+    Args:
+        keys (list(bytes)): The keys to convert.
+        version (int):      The storage format version of the database.
+
+    Returns:
+        ndarray: The kmers as bytes, or as uint64 codes for packed versions.
+    """
+    if version < constants.PACKED_VERSION:
+        return np.array(keys, dtype='S')
+    keys = np.frombuffer(b''.join(keys), dtype=constants.KEY_DTYPE)
+    return keys.astype(np.uint64)
+
+
+def output_key(name, version):
+    """
+    Get the key the output for name is stored under in a genome's database.
+    In packed versions the key is prefixed with constants.OUTPUT_PREFIX so that
+    it can never be read as a kmer.
+
+    Args:
+        name (str):     Identifier for the output.
+        version (int):  The storage format version of the database.
+
+    Returns:
+        bytes: The key.
+    """
+    if version < constants.PACKED_VERSION:
+        return name.encode()
+    return constants.OUTPUT_PREFIX + name.encode()
+
+
+def kmer_names(kmers, k=None, packed=False):
+    """
+    Convert kmers read out of a database into the kmer names returned by
+    get_kmer_names.
+
+    Args:
+        kmers (ndarray):    The kmers as bytes or as native_counter codes.
+        k (int):            The length of the kmers, needed for codes.
+        packed (bool):      If True the names are returned as the uint64
+                            codes made by native_counter.pack_names, decode
+                            them with native_counter.unpack_names. Kmers too
+                            long to pack are returned as strings.
+
+    Returns:
+        ndarray: The name of each kmer.
+    """
+    kmers = np.asarray(kmers)
+    if kmers.dtype != np.uint64:
+        if kmers.shape[0] == 0 or not packed:
+            return kmers.astype('U')
+        k = kmers.dtype.itemsize
+        if k >= native_counter.MAX_K:
+            return kmers.astype('U')
+        kmers = native_counter.encode_kmers(kmers)
+    if packed and k < native_counter.MAX_K:
+        return native_counter.pack_names(kmers, k)
+    return native_counter.decode_kmers(kmers, k)
+
+
+def encode_counts(counts, version):
+    """
+    Convert counts into lmdb values.
+
+    Args:
+        counts (ndarray):   The counts to convert.
+        version (int):      The storage format version of the database.
+
+    Returns:
+        list(bytes): One value per count.
+    """
+    if version == 1:
+        return [str(x).encode() for x in np.asarray(counts).tolist()]
+    counts = np.asarray(counts, dtype=constants.COUNT_DTYPE)
+    return counts.view('V{}'.format(counts.itemsize)).tolist()
+
+
+def decode_counts(values, version):
+    """
+    Convert lmdb values back into counts, the inverse of encode_counts.
+
+    Args:
+        values (list(bytes)):   The values to convert.
+        version (int):          The storage format version of the database.
+
+    Returns:
+        ndarray: The counts.
+    """
+    if version == 1:
+        return np.array([int(x) for x in values], dtype=np.int64)
+    counts = np.frombuffer(b''.join(values), dtype=constants.COUNT_DTYPE)
+    return counts.astype(np.int64)
+
+
+def compact_dtype(max_count, saturate=None):
+    """
+    Get the smallest dtype in constants.OUTPUT_DTYPES that can hold every
+    count up to max_count. Counts are clamped to saturate when it is given, so
+    the dtype only needs to hold the smaller of the two.
+
+    Args:
+        max_count (int):    The largest count to store.
+        saturate (int):     The count larger counts are clamped to, or None.
+
+    Returns:
+        numpy.dtype: The dtype.
+    """
+    if saturate is not None:
+        max_count = min(max_count, saturate)
+    for dtype in constants.OUTPUT_DTYPES:
+        if max_count <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(constants.OUTPUT_DTYPES[-1])
+
+
+def read_dtype(env, name=None):
+    """
+    Get the dtype, and the count they were clamped to, that the counts of
+    name are stored in, recorded by write_dtype.
+
+    Args:
+        env (lmdb.Environment): The database the counts are stored in.
+        name (str):             The output the counts belong to, None for
+                                the counts of the whole database.
+
+    Returns:
+        tuple(numpy.dtype, int): The dtype and the count, each None if not
+                                 recorded.
+    """
+    suffix = '' if name is None else '/' + name
+    try:
+        metadata = env.open_db('metadata'.encode(), create=False)
+    except lmdb.NotFoundError:
+        return None, None
+    with env.begin(write=False, db=metadata) as txn:
+        dtype = txn.get(('dtype' + suffix).encode())
+        saturate = txn.get(('saturate' + suffix).encode())
+    dtype = None if dtype is None else np.dtype(dtype.decode())
+    saturate = None if saturate is None else int(saturate)
+    return dtype, saturate
+
+
+def write_dtype(env, dtype, saturate=None, name=None):
+    """
+    Record the dtype the counts of name are stored in, and the count they
+    were clamped to, see read_dtype.
+
+    Args:
+        env (lmdb.Environment): The database the counts are stored in.
+        dtype (numpy.dtype):    The dtype of the counts.
+        saturate (int):         The count larger counts were clamped to, or
+                                None.
+        name (str):             The output the counts belong to, None for
+                                the counts of the whole database.
+
+    Returns:
+        None
+    """
+    suffix = '' if name is None else '/' + name
+    metadata = env.open_db('metadata'.encode())
+    with env.begin(write=True, db=metadata) as txn:
+        txn.put(('dtype' + suffix).encode(), np.dtype(dtype).name.encode())
+        if saturate is None:
+            txn.delete(('saturate' + suffix).encode())
+        else:
+            txn.put(('saturate' + suffix).encode(), str(saturate).encode())
+
+
+def jellyfish_count(input_file, output_file, k, threads=None, size=None,
+                    limit=None):
+    """
+    Run jellyfish count on input_file. Compressed files are decompressed by a
+    thread that streams them into jellyfish's stdin, so the uncompressed
+    genome is never written to disk, see compression.feed. For sequencing
+    reads (see read_filter) jellyfish keeps the kmers it has seen once in a
+    Bloom filter instead of its hash, and they are left out of its output.
+
+    Args:
+        input_file (str):   Path to a fasta or fastq file to count kmers in,
+                            which may be compressed.
+        output_file (str):  Path to store jellyfish's binary output in.
+        k (int):            Length of kmer to count.
+        threads (int):      Number of threads jellyfish may use, see
+                            count_file.
+        size (str):         Jellyfish hash size, see count_file.
+        limit (int):        If given kmers that appear fewer than limit times
+                            are dropped.
+
+    Returns:
+        None
+    """
+    threads = threads or pipeline.schedule(1)[1]
+    compressed = compression.compression(input_file) is not None
+    args = ['jellyfish', 'count', '-m', '%d' % k, '-s',
+            size or constants.HASH_SIZE, '-t', '%d' % threads, '-C',
+            '/dev/stdin' if compressed else str(input_file),
+            '-o', str(output_file)]
+    if constants.FILTER_READS and read_filter.is_reads(input_file):
+        args += ['--bf-size', size or constants.HASH_SIZE]
+        limit = max(limit or 0, read_filter.MIN_COUNT)
+    if limit:
+        args += ['-L', '%d' % limit]
+    if not compressed:
+        p = subprocess.Popen(args, bufsize=-1)
+        p.communicate()
+        return
+    p = subprocess.Popen(args, bufsize=-1, stdin=subprocess.PIPE)
+    feeder = threading.Thread(target=compression.feed,
+                              args=(input_file, p.stdin))
+    feeder.start()
+    p.wait()
+    feeder.join()
+
+
+def count_file(input_file, output_file, k, backend=constants.DEFAULT_BACKEND,
+               threads=None, size=None):
+    """
+    Use jellyfish or native_counter to count kmers of length k in input_file
+    and store the result in output_file.
+
+    Args:
+        input_file (str):   Path to a fasta file to count kmers in, which may
+                            be compressed.
         output_file (str):  Path to a csv file to store results in.
         k (int)             Length of kmer to count.
+        backend (str):      'jellyfish' to count with the jellyfish program,
+                            'native' to count with native_counter.
+        threads (int):      Number of threads jellyfish may use, defaults to
+                            every core, see pipeline.schedule.
+        size (str):         Jellyfish hash size, defaults to
+                            constants.HASH_SIZE, see size_database.
 
     Returns:
         None
     """
+    if backend == 'native':
+        codes, counts = read_filter.count_file(input_file, k)
+        native_counter.write_dump(codes, counts, k, output_file)
+        return
+
     handle, temp_file = tempfile.mkstemp()
-    args = ['jellyfish', 'count', '-m', '%d' % k, '-s', '10M', '-t', '30',
-            '-C', str(input_file), '-o', str(temp_file)]
-    p = subprocess.Popen(args, bufsize=-1)
-    p.communicate()
+    jellyfish_count(input_file, temp_file, k, threads, size)
 
     args = ['jellyfish', 'dump', '-c', '-t', str(temp_file), '-o', str(output_file)]
     p = subprocess.Popen(args, bufsize=-1)
@@ -44,9 +420,135 @@ def count_file(input_file, output_file, k):
     logging.info('Counted kmers for {}'.format(input_file))
 
 
-def count_all(fasta_files, temp_files, db_keys, k, env, force):
+def grow_map(env, size):
+    """
+    Make sure env has room for size more bytes than it currently holds.
+
+    Args:
+        env (lmdb.Environment): The environment to grow, must not have any
+                                open transactions.
+        size (int):             The number of bytes to make room for.
+
+    Returns:
+        int: The map size of env.
+    """
+    used = (env.info()['last_pgno'] + 1) * env.stat()['psize']
+    size = max(used + size, constants.MIN_MAP_SIZE)
+    if size > env.info()['map_size']:
+        env.set_mapsize(size)
+    return env.info()['map_size']
+
+
+def size_database(fasta_files, db_keys, k, env, force, outputs=True,
+                  workers=None, cores=None, stale=None):
+    """
+    Estimate the number of distinct kmers in each genome that is going to be
+    counted, and in every genome in the database, with HyperLogLog sketches.
+    The estimates and the merged sketch are recorded in the metadata database
+    and the map of env is grown to fit the counts.
+
+    Args:
+        fasta_files (list):     Paths to fasta files that will be counted.
+        db_keys (list):         The lmdb keys to identify each file in the
+                                database with.
+        k (int):                The length of kmer to count.
+        env (lmdb.Environment): Environment to store the counts in.
+        force (bool):           If True every file will be recounted, if False
+                                only files that do not appear in the database.
+        outputs (bool):         If True room is also made for global_counts,
+                                file_counts and the output of every genome.
+        workers (int):          Number of genomes to sketch at once, see
+                                pipeline.schedule.
+        cores (int):            Total number of cores to use, see
+                                pipeline.schedule.
+        stale (list):           db_keys that will be recounted because their
+                                file changed, see stale_genomes.
+
+    Returns:
+        dict: The jellyfish hash size for each fasta file that will be
+              counted.
+    """
+    if k > native_counter.MAX_K:
+        logging.info('Can not estimate the size of {}-mer counts'.format(k))
+        grow_map(env, constants.MAP_SIZE)
+        return {}
+
+    stale = stale or []
+    jobs = []
+    keys = {}
+    for i, v in enumerate(fasta_files):
+        with env.begin(write=False) as txn:
+            if force or db_keys[i] in stale or not txn.get(db_keys[i].encode(),
+                                                           default=False):
+                jobs.append((v, k))
+                keys[v] = db_keys[i]
+
+    registers = {}
+
+    def collect(job, result):
+        registers[keys[job[0]]] = result
+
+    workers = pipeline.schedule(len(jobs), cores, workers)[0]
+    pipeline.run(jobs, cardinality.sketch_file, collect, workers)
+    sizes = record_sizes(env, k, db_keys, registers, outputs)
+    return {f: sizes[key] for f, key in keys.items() if key in sizes}
+
+
+def record_sizes(env, k, db_keys, registers, outputs=True):
+    """
+    Merge the sketches of the genomes that are going to be counted into the
+    sketch recorded in the metadata database, record the estimates and grow
+    the map of env to fit the counts, see size_database.
+
+    Args:
+        env (lmdb.Environment): Environment to store the counts in.
+        k (int):                The length of kmer to count.
+        db_keys (list):         Every genome in the database.
+        registers (dict):       Maps the db_key of each genome that is going
+                                to be counted to its sketch.
+        outputs (bool):         See size_database.
+
+    Returns:
+        dict: The jellyfish hash size for each db_key in registers.
+    """
+    metadata = env.open_db('metadata'.encode())
+    with env.begin(write=False, db=metadata) as txn:
+        sketch = txn.get('sketch'.encode())
+    sketches = [] if sketch is None else [np.frombuffer(sketch, dtype=np.uint8)]
+    sketches.extend(registers.values())
+    distinct = {key: cardinality.estimate(x) for key, x in registers.items()}
+    if not sketches:
+        grow_map(env, constants.MAP_SIZE)
+        return {}
+
+    sketch = cardinality.merge(sketches)
+    total = cardinality.estimate(sketch)
+    entries = total + sum(distinct.values())
+    extra = 0
+    if outputs:
+        entries += 2 * total
+        extra = len(db_keys) * total * np.dtype(int).itemsize
+    size = grow_map(env, cardinality.map_size(entries, k, extra=extra))
+    logging.info('Estimated {} distinct kmers, map size {}'.format(total, size))
+
+    with env.begin(write=True, db=metadata) as txn:
+        txn.put('sketch'.encode(), sketch.tobytes())
+        txn.put('distinct_kmers'.encode(), str(total).encode())
+        txn.put('map_size'.encode(), str(size).encode())
+        for key, value in distinct.items():
+            txn.put('distinct_kmers/{}'.format(key).encode(),
+                    str(value).encode())
+    return {key: cardinality.hash_size(value)
+            for key, value in distinct.items()}
+
+
+def count_all(fasta_files, temp_files, db_keys, k, env, force,
+              backend=constants.DEFAULT_BACKEND, workers=None, cores=None,
+              hash_sizes=None, stale=None):
     """
     Counts kmers of length k for each fasta file in fasta_files in parrallel.
+    The cores are split between the genomes counted at once and the threads
+    given to each jellyfish process by pipeline.schedule.
 
     Args:
         fasta_files (list):     Paths to fasta files to count kmers in.
@@ -60,40 +562,221 @@ def count_all(fasta_files, temp_files, db_keys, k, env, force):
         force (bool):           If True kmers for all files are recounted, if
                                 False only Files that do not appear in the
                                 database already are recounted.
+        backend (str):          The kmer counter to use, see count_file.
+        workers (int):          Number of genomes to count at once, see
+                                pipeline.schedule.
+        cores (int):            Total number of cores to use, see
+                                pipeline.schedule.
+        hash_sizes (dict):      The jellyfish hash size of each fasta file,
+                                see size_database.
+        stale (list):           db_keys to recount because their file
+                                changed, see stale_genomes.
     Returns:
         recounts (list): Every db_key whose kmers were recounted.
     """
     logging.info('Begin Counting kmers')
-    threads = []
+    stale = stale or []
+    jobs = []
     recounts = []
     if force:
         logging.info('Force set to True, recounting all genomes')
     for i, v in enumerate(fasta_files):
         with env.begin(write=False) as txn:
-            if force or not txn.get(db_keys[i].encode(), default=False):
-                args = [v, temp_files[i], k]
-                threads.append(Thread(target=count_file, args=args))
+            if force or db_keys[i] in stale or not txn.get(db_keys[i].encode(),
+                                                           default=False):
+                jobs.append((v, temp_files[i], k, backend))
                 recounts.append(db_keys[i])
     if not force:
         logging.info('Force set to False, Recounting {}'.format(recounts))
-    for t in threads:
-        t.start()
-    for t in threads:
-        t.join()
+    hash_sizes = hash_sizes or {}
+    workers, threads = pipeline.schedule(len(jobs), cores, workers)
+    jobs = [job + (threads, hash_sizes.get(job[0])) for job in jobs]
+    pipeline.run(jobs, count_file, lambda job, result: None, workers)
     logging.info('Done counting kmers')
     return recounts
 
 
-def add_file(input_file, key, global_counts, file_counts, env):
+def read_dump(stream, chunk_size=constants.DUMP_CHUNK_SIZE):
     """
-    Add the kmer counts contained in the input csv file to the database in
-    env under the identifier key. Update global_counts and file_counts.
+    Parse the output of "jellyfish dump -c" in large chunks.
 
     Args:
-        input_file (str):           Path to a csv file containing jellyfish
-                                    output.
+        stream (file):      Binary file object (or pipe) containing one
+                            whitespace separated kmer count pair per line.
+        chunk_size (int):   Number of bytes to parse at once.
+
+    Returns:
+        tuple(ndarray, ndarray): The kmers as bytes and their counts.
+    """
+    kmers = []
+    counts = []
+    tail = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        chunk = tail + chunk
+        end = chunk.rfind(b'\n') + 1
+        tail = chunk[end:]
+        fields = chunk[:end].split()
+        if fields:
+            kmers.append(np.array(fields[0::2]))
+            counts.append(np.array(fields[1::2]).astype(np.int64))
+    fields = tail.split()
+    if fields:
+        kmers.append(np.array(fields[0::2]))
+        counts.append(np.array(fields[1::2]).astype(np.int64))
+    if not kmers:
+        return np.array([], dtype='S1'), np.array([], dtype=np.int64)
+    return np.concatenate(kmers), np.concatenate(counts)
+
+
+def count_genome(input_file, k, limit=None, backend=constants.DEFAULT_BACKEND,
+                 threads=None, size=None, packed=False):
+    """
+    Count kmers of length k in input_file without writing the counts to disk.
+    The output of jellyfish dump is read straight from a pipe.
+
+    Args:
+        input_file (str):   Path to a fasta file to count kmers in, which may
+                            be compressed.
+        k (int):            Length of kmer to count.
+        limit (int):        If given kmers that appear fewer than limit times
+                            are dropped.
+        backend (str):      The kmer counter to use, see count_file.
+        threads (int):      Number of threads jellyfish may use, see
+                            count_file.
+        size (str):         Jellyfish hash size, see count_file.
+        packed (bool):      If True the kmers are returned as native_counter
+                            codes, see encode_keys.
+
+    Returns:
+        tuple(ndarray, ndarray): The kmers as bytes (or codes) and their
+                                 counts.
+    """
+    if backend == 'native':
+        codes, counts = read_filter.count_file(input_file, k, limit)
+        if packed:
+            return codes, counts
+        return native_counter.decode_kmers(codes, k, as_bytes=True), counts
+
+    handle, temp_file = tempfile.mkstemp()
+    jellyfish_count(input_file, temp_file, k, threads, size, limit)
+
+    args = ['jellyfish', 'dump', '-c', '-t', str(temp_file)]
+    p = subprocess.Popen(args, bufsize=-1, stdout=subprocess.PIPE)
+    kmers, counts = read_dump(p.stdout)
+    p.communicate()
+
+    os.remove(temp_file)
+    logging.info('Counted kmers for {}'.format(input_file))
+    if packed:
+        return native_counter.encode_kmers(kmers), counts
+    return kmers, counts
+
+
+def count_cached(input_file, k, limit=None, backend=constants.DEFAULT_BACKEND,
+                 threads=None, size=None, packed=False, cache=None,
+                 digest=None):
+    """
+    Count kmers like count_genome, looking the genome up in a content
+    addressed cache first, see genome_cache. Genomes that are not in the
+    cache are counted and added to it, so the same file is only counted once
+    for each k no matter what it is named or which database it is added to.
+
+    Args:
+        input_file (str):   Path to a fasta file to count kmers in, which may
+                            be compressed.
+        k (int):            Length of kmer to count.
+        limit (int):        If given kmers that appear fewer than limit times
+                            are dropped.
+        backend (str):      The kmer counter to use, see count_file.
+        threads (int):      Number of threads jellyfish may use, see
+                            count_file.
+        size (str):         Jellyfish hash size, see count_file.
+        packed (bool):      If True the kmers are returned as native_counter
+                            codes, see encode_keys.
+        cache (str):        Directory of the genome cache, the cache is not
+                            used if None.
+        digest (str):       Digest of input_file, see genome_cache.describe.
+
+    Returns:
+        tuple(ndarray, ndarray): The kmers as bytes (or codes) and their
+                                 counts.
+    """
+    if cache is None or digest is None:
+        return count_genome(input_file, k, limit, backend, threads, size,
+                            packed)
+
+    # entries hold codes whenever k allows it, so packed and unpacked
+    # databases share them
+    codes = k <= native_counter.MAX_K
+    found = genome_cache.load(cache, digest, k)
+    if found is None:
+        kmers, counts = count_genome(input_file, k, None, backend, threads,
+                                     size, codes)
+        genome_cache.store(cache, digest, k, kmers, counts)
+    else:
+        kmers, counts = [np.asarray(x) for x in found]
+    if codes and not packed:
+        kmers = native_counter.decode_kmers(kmers, k, as_bytes=True)
+    if limit:
+        keep = counts >= limit
+        kmers = kmers[keep]
+        counts = counts[keep]
+    return kmers, counts
+
+
+def pop_genome(txn, db, version, k):
+    """
+    Delete every kmer of a genome from its database, outputs stored in the
+    database are kept.
+
+    Args:
+        txn (lmdb.Transaction): Write transaction to delete the kmers in.
+        db (database):          The genome's database.
+        version (int):          The storage format version of the database.
+        k (int):                The length of the kmers.
+
+    Legacy databases store a count of 0 for every kmer of the database that
+    is missing from the genome. Those kmers are deleted but not returned, they
+    were never counted in global_counts or file_counts.
+
+    Returns:
+        tuple(ndarray, ndarray): The deleted kmers that the genome has and
+                                 their counts.
+    """
+    length = 8 if version >= constants.PACKED_VERSION else k
+    with txn.cursor(db=db) as cursor:
+        found = [(key, value) for key, value in cursor if len(key) == length]
+    keys = [x[0] for x in found]
+    for key in keys:
+        txn.delete(key, db=db)
+    kmers = decode_keys(keys, version)
+    counts = decode_counts([x[1] for x in found], version)
+    present = counts > 0
+    return kmers[present], counts[present]
+
+
+def add_kmers(kmers, counts, key, global_counts, file_counts, env, txn=None):
+    """
+    Add kmer counts to the database in env under the identifier key. Update
+    global_counts and file_counts. The kmers are sorted and merged in numpy
+    and then every database is written to with one putmulti call. If key is
+    already in the database its old counts are replaced, and taken out of
+    global_counts and file_counts. The generation in the metadata database is
+    increased so that cached count_columns are remade.
+
+    The genome is added in txn if given, so that several genomes can be
+    committed together, see pipeline.run, otherwise in a transaction of its
+    own.
+
+    Args:
+        kmers (ndarray):            The kmers to add, as bytes or as
+                                    native_counter codes.
+        counts (ndarray):           The count of each kmer.
         key (str):                  Identifier for a named database
-                                    corresponding to input_file
+                                    corresponding to the counted genome.
         global_counts (database):   Named database with keys of kmers and values
                                     of their total count across all files in the
                                     database.
@@ -102,31 +785,96 @@ def add_file(input_file, key, global_counts, file_counts, env):
                                     the database.
         env (lmdb.Environment):     Environment containing the database to store
                                     the complete results in.
+        txn (lmdb.Transaction):     Write transaction on env to add the genome
+                                    in.
     Returns:
         None
     """
-    current = env.open_db(key.encode())
-    with env.begin(write=True, db=current) as txn:
-        with open(input_file, 'r') as f:
-            for line in f:
-                kmer = line.split()[0].encode()
-                count = str(line.split()[1]).encode()
-                txn.put(kmer, count, db=current)
-
-                curr_global_count = txn.get(kmer, default=0, db=global_counts)
-                new_global_count = str(int(curr_global_count) + int(count)).encode()
-                txn.put(kmer, new_global_count, db=global_counts)
-
-                curr_file_count = txn.get(kmer, default=0, db=file_counts)
-                new_file_count = str(1 + int(curr_file_count)).encode()
-                txn.put(kmer, new_file_count, db=file_counts)
+    if txn is None:
+        with env.begin(write=True) as txn:
+            return add_kmers(kmers, counts, key, global_counts, file_counts,
+                             env, txn)
+
+    version = read_version(env, txn)
+    if version >= constants.PACKED_VERSION and kmers.dtype != np.uint64:
+        kmers = native_counter.encode_kmers(kmers)
+    kmers, index = np.unique(kmers, return_inverse=True)
+    counts = np.bincount(index.ravel(), weights=counts,
+                         minlength=len(kmers)).astype(np.int64)
+    k = read_k(env, txn) or kmers.dtype.itemsize
+
+    current = env.open_db(key.encode(), txn=txn)
+    metadata = env.open_db('metadata'.encode(), txn=txn)
+    generation = int(txn.get('generation'.encode(), default='0'.encode(),
+                             db=metadata))
+    txn.put('generation'.encode(), str(generation + 1).encode(), db=metadata)
+    append = txn.stat(current)['entries'] == 0
+    old_kmers, old_counts = np.array([], dtype=kmers.dtype), 0
+    if not append:
+        old_kmers, old_counts = pop_genome(txn, current, version, k)
+        append = txn.stat(current)['entries'] == 0
+    with txn.cursor(db=current) as cursor:
+        cursor.putmulti(zip(encode_keys(kmers, version),
+                            encode_counts(counts, version)),
+                        append=append)
+
+    changed = np.union1d(kmers, old_kmers) if len(old_kmers) else kmers
+    new_index = np.searchsorted(changed, kmers)
+    old_index = np.searchsorted(changed, old_kmers)
+    keys = encode_keys(changed, version)
+    totals = []
+    for increment, old_increment in [(counts, old_counts), (1, 1)]:
+        delta = np.zeros(len(keys), dtype=np.int64)
+        delta[new_index] += increment
+        delta[old_index] -= old_increment
+        totals.append(delta)
+
+    for db, total in zip([global_counts, file_counts], totals):
+        with txn.cursor(db=db) as cursor:
+            found = cursor.getmulti(keys)
+            if found:
+                found_keys, found_values = zip(*found)
+                found_index = np.searchsorted(
+                    changed, decode_keys(found_keys, version))
+                total[found_index] += decode_counts(found_values, version)
+    present = totals[1] > 0
+    for db, total in zip([global_counts, file_counts], totals):
+        with txn.cursor(db=db) as cursor:
+            cursor.putmulti(zip(itertools.compress(keys, present),
+                                encode_counts(total[present], version)))
+        for gone in itertools.compress(keys, ~present):
+            txn.delete(gone, db=db)
     logging.info('Added {} to DB'.format(key))
 
 
-def add_all(temp_files, db_keys, global_counts, file_counts, env, force, recounts):
+def read_file(input_file, packed=False):
+    """
+    Read the kmer counts out of a csv file made by count_file.
+
+    Args:
+        input_file (str):   Path to a csv file containing jellyfish output.
+        packed (bool):      If True the kmers are returned as native_counter
+                            codes.
+
+    Returns:
+        tuple(ndarray, ndarray): The kmers as bytes (or codes) and their
+                                 counts.
+    """
+    with open(input_file, 'rb') as f:
+        kmers, counts = read_dump(f)
+    if packed:
+        return native_counter.encode_kmers(kmers), counts
+    return kmers, counts
+
+
+def add_all(temp_files, db_keys, global_counts, file_counts, env, force,
+            recounts, workers=None, memory_budget=constants.MEMORY_BUDGET,
+            cores=None):
     """
     Add all kmer counts from each file in temp_files to the database
-    contained in env under the identifiers contianed in db_keys.
+    contained in env under the identifiers contianed in db_keys. The files
+    are parsed by a pool of worker processes and every genome is written to
+    the database by the calling process.
 
     Args:
         temp_files (list):          The paths to each csv file output by jellyfish.
@@ -146,102 +894,517 @@ def add_all(temp_files, db_keys, global_counts, file_counts, env, force, recount
                                     is in recounts are added to the database.
         recounts (list):            A list of all db_keys that were changed by
                                     count_all
+        workers (int):              Number of worker processes, see
+                                    pipeline.run.
+        memory_budget (int):        Bytes of parsed counts that may be waiting
+                                    to be written at once.
+        cores (int):                Total number of cores to use, see
+                                    pipeline.schedule.
     Returns:
         recounts (list): Every db_key that was altered in the database.
     """
     logging.info('Begin adding genomes to database')
-    threads = []
+    packed = read_version(env) >= constants.PACKED_VERSION
+    jobs = []
+    keys = {}
     if force:
         logging.info('Force set to True, adding all genomes to database')
     for i, f in enumerate(temp_files):
         with env.begin(write=False) as txn:
             if force or not txn.get(db_keys[i].encode(), default=False) or db_keys[i] in recounts:
-                args = [f, db_keys[i], global_counts, file_counts, env]
-                threads.append(Thread(target=add_file, args=args))
+                jobs.append((f, packed))
+                keys[f] = db_keys[i]
                 if db_keys[i] not in recounts:
                     recounts.append(db_keys[i])
     if not force:
         logging.info('Force set to False, Adding {} to the DB'.format(recounts))
-    for t in threads:
-        t.start()
-    for t in threads:
-        t.join()
+
+    def write(txn, job, result):
+        add_kmers(result[0], result[1], keys[job[0]], global_counts,
+                  file_counts, env, txn)
+
+    workers = pipeline.schedule(len(jobs), cores, workers)[0]
+    pipeline.run(jobs, read_file, write, workers, memory_budget, env=env)
     logging.info('Done adding genomes to database')
     return recounts
 
 
-def backfill_file(db_key, env, global_counts):
+def stream_all(fasta_files, db_keys, k, global_counts, file_counts, env, force,
+               backend=constants.DEFAULT_BACKEND, workers=None,
+               memory_budget=constants.MEMORY_BUDGET, cores=None,
+               hash_sizes=None, stale=None, cache=None, sources=None):
     """
-    Insert all kmers into db_key with a value of 0 that appear in the database,
-    but not in db_key.
+    Count the kmers in every fasta file in a pool of worker processes, adding
+    each genome to the database as soon as its count finishes. Replaces
+    count_all followed by add_all so that counting and adding to the database
+    overlap.
 
     Args:
-        db_key (str):               Named database
+        fasta_files (list):         Paths to fasta files to count kmers in.
+        db_keys (list):             The lmdb keys to identify each file in the
+                                    database with.
+        k (int):                    The length of kmer to count.
+        global_counts (database):   Named database with keys of kmers and values
+                                    of their total count across all files in the
+                                    database.
+        file_counts (database):     Named database with keys of kmers and values
+                                    of the number of files they appear in across
+                                    the database.
         env (lmdb.Environment):     Environment containing the database to store
                                     the complete results in.
-        global_counts (database):   Named database containing every kmer in the
-                                    database with their total count over all
-                                    files in the database.
+        force (bool):               If True kmers for all files are recounted,
+                                    if False only files that do not appear in
+                                    the database already are recounted.
+        backend (str):              The kmer counter to use, see count_file.
+        workers (int):              Number of genomes to count at once, see
+                                    pipeline.schedule.
+        memory_budget (int):        Bytes of counted kmers that may be waiting
+                                    to be written at once.
+        cores (int):                Total number of cores to use, see
+                                    pipeline.schedule.
+        hash_sizes (dict):          The jellyfish hash size of each fasta
+                                    file, see size_database.
+        stale (list):               db_keys to recount because their file
+                                    changed, see stale_genomes.
+        cache (str):                Directory of the genome cache, see
+                                    count_cached.
+        sources (dict):             Description of each fasta file, see
+                                    genome_cache.describe_all. Needed to use
+                                    cache.
     Returns:
-        None
+        recounts (list): Every db_key that was altered in the database.
+    """
+    logging.info('Begin counting kmers and adding genomes to database')
+    packed = read_version(env) >= constants.PACKED_VERSION
+    stale = stale or []
+    jobs = []
+    keys = {}
+    recounts = []
+    if force:
+        logging.info('Force set to True, recounting all genomes')
+    for i, v in enumerate(fasta_files):
+        with env.begin(write=False) as txn:
+            if force or db_keys[i] in stale or not txn.get(db_keys[i].encode(),
+                                                           default=False):
+                jobs.append((v, k, None, backend))
+                keys[v] = db_keys[i]
+                recounts.append(db_keys[i])
+    if not force:
+        logging.info('Force set to False, Recounting {}'.format(recounts))
+
+    def write(txn, job, result):
+        add_kmers(result[0], result[1], keys[job[0]], global_counts,
+                  file_counts, env, txn)
+
+    hash_sizes = hash_sizes or {}
+    digests = {f: x['digest'] for f, x in (sources or {}).items()}
+    workers, threads = pipeline.schedule(len(jobs), cores, workers)
+    jobs = [job + (threads, hash_sizes.get(job[0]), packed, cache,
+                   digests.get(job[0])) for job in jobs]
+    pipeline.run(jobs, count_cached, write, workers, memory_budget, env=env)
+    logging.info('Done counting kmers and adding genomes to database')
+    return recounts
+
+
+def sort_genome(input_file, run_path, k, backend=constants.DEFAULT_BACKEND,
+                threads=None, size=None, packed=False, cache=None,
+                digest=None):
+    """
+    Count kmers of length k in input_file and write them to a sorted run, see
+    external_sort.write_run.
+
+    Args:
+        input_file (str):   Path to a fasta file to count kmers in, which may
+                            be compressed.
+        run_path (str):     Path to write the run to, without a suffix.
+        k (int):            Length of kmer to count.
+        backend (str):      The kmer counter to use, see count_file.
+        threads (int):      Number of threads jellyfish may use, see
+                            count_file.
+        size (str):         Jellyfish hash size, see count_file.
+        packed (bool):      If True the kmers are stored as native_counter
+                            codes, see encode_keys.
+        cache (str):        Directory of the genome cache, see count_cached.
+        digest (str):       Digest of input_file, see count_cached.
+
+    Returns:
+        str: run_path
     """
-    current = env.open_db(db_key.encode())
-    with env.begin(write=True, db=current) as txn:
-        with txn.cursor(db=global_counts) as cursor:
-            for key, value in cursor:
-                if not txn.get(key, default=False, db=current):
-                    txn.put(key, '0'.encode(), db=current)
-    logging.info('Backfilled {}'.format(db_key))
+    kmers, counts = count_cached(input_file, k, None, backend, threads, size,
+                                 packed, cache, digest)
+    return external_sort.write_run(run_path, kmers, counts)
 
 
-def backfill_all(db_keys, global_counts, env, force, recounts):
+def spill_counts(txn, global_counts, file_counts, run_path, version, k,
+                 memory_budget=constants.MEMORY_BUDGET):
     """
-    Backfill every named database in db_keys in parrallel.
+    Copy global_counts and file_counts into a run on disk a chunk at a time,
+    so that they can be merged with new genomes by external_sort.merge_runs.
 
     Args:
-        db_keys (list):             The identifiers corresponding to each file
-                                    in temp_files to be used as names in the
+        txn (lmdb.Transaction):     Transaction to read the counts in.
+        global_counts (database):   Database of the total count of each kmer.
+        file_counts (database):     Database of the number of files each kmer
+                                    appears in.
+        run_path (str):             Path to write the run to, without a
+                                    suffix.
+        version (int):              The storage format version of the
                                     database.
-        global_counts (database):   Named database containing every kmer in the
-                                    database with their total count over all
-                                    files in the database.
+        k (int):                    The length of the kmers.
+        memory_budget (int):        Bytes of counts that may be read at once.
+
+    Returns:
+        tuple(ndarray, ndarray, ndarray): The run, see external_sort.read_run.
+    """
+    dtype = np.uint64 if version >= constants.PACKED_VERSION else 'S%d' % k
+    entries = txn.stat(global_counts)['entries']
+    kmers, counts, files = external_sort.create_run(run_path, entries, dtype,
+                                                    files=True)
+    chunk = external_sort.chunk_length(memory_budget, 1,
+                                       np.dtype(dtype).itemsize)
+    with txn.cursor(db=global_counts) as g, txn.cursor(db=file_counts) as f:
+        pairs = zip(g.iternext(), f.iternext())
+        start = 0
+        while True:
+            block = list(itertools.islice(pairs, chunk))
+            if not block:
+                break
+            end = start + len(block)
+            kmers[start:end] = decode_keys([x[0][0] for x in block], version)
+            counts[start:end] = decode_counts([x[0][1] for x in block],
+                                              version)
+            files[start:end] = decode_counts([x[1][1] for x in block],
+                                             version)
+            start = end
+    for x in (kmers, counts, files):
+        x.flush()
+    del kmers, counts, files
+    return external_sort.read_run(run_path)
+
+
+def remove_genome(txn, db, run_path, version, k):
+    """
+    Delete every kmer of a genome that is being recounted from its database
+    and write them to a run with negative counts, so that merging the run
+    takes the genome back out of the global and file counts, see pop_genome.
+
+    Args:
+        txn (lmdb.Transaction): Write transaction to delete the kmers in.
+        db (database):          The genome's database.
+        run_path (str):         Path to write the run to, without a suffix.
+        version (int):          The storage format version of the database.
+        k (int):                The length of the kmers.
+
+    Returns:
+        tuple(ndarray, ndarray, int): The run, see external_sort.read_run.
+    """
+    kmers, counts = pop_genome(txn, db, version, k)
+    external_sort.write_run(run_path, kmers, -counts)
+    return external_sort.read_run(run_path, files=-1)
+
+
+def external_all(fasta_files, db_keys, k, global_counts, file_counts, env,
+                 force, backend=constants.DEFAULT_BACKEND, workers=None,
+                 memory_budget=constants.MEMORY_BUDGET, cores=None,
+                 hash_sizes=None, stale=None, cache=None, sources=None):
+    """
+    Count the kmers in every fasta file in a pool of worker processes and
+    write each genome to a sorted run on disk. The runs and the existing
+    global_counts and file_counts are then merged in key order with
+    external_sort.merge_runs, global_counts and file_counts are rewritten in
+    one sequential pass and every genome is written to its database, all in
+    one transaction. Unlike stream_all no kmer is ever looked up in the
+    database, and memory use does not grow with the number of distinct kmers.
+
+    Args:
+        fasta_files (list):         Paths to fasta files to count kmers in.
+        db_keys (list):             The lmdb keys to identify each file in the
+                                    database with.
+        k (int):                    The length of kmer to count.
+        global_counts (database):   Named database with keys of kmers and values
+                                    of their total count across all files in the
+                                    database.
+        file_counts (database):     Named database with keys of kmers and values
+                                    of the number of files they appear in across
+                                    the database.
         env (lmdb.Environment):     Environment containing the database to store
                                     the complete results in.
-        force (bool):               If True every file in temp_file is added to
-                                    the database, if False only files whose
-                                    db_key is not present in the database or
-                                    whose db_key is in recounts are added to the
-                                    database.
-        recounts (list):            A list of all db_keys that were changed by
-                                    count_all.
+        force (bool):               If True kmers for all files are recounted,
+                                    if False only files that do not appear in
+                                    the database already are recounted.
+        backend (str):              The kmer counter to use, see count_file.
+        workers (int):              Number of genomes to count at once, see
+                                    pipeline.schedule.
+        memory_budget (int):        Bytes of kmers that may be held by one
+                                    step of the merge.
+        cores (int):                Total number of cores to use, see
+                                    pipeline.schedule.
+        hash_sizes (dict):          The jellyfish hash size of each fasta
+                                    file, see size_database.
+        stale (list):               db_keys to recount because their file
+                                    changed, see stale_genomes.
+        cache (str):                Directory of the genome cache, see
+                                    count_cached.
+        sources (dict):             Description of each fasta file, see
+                                    genome_cache.describe_all. Needed to use
+                                    cache.
     Returns:
         recounts (list): Every db_key that was altered in the database.
     """
-    logging.info('Begin backfilling genomes')
-    with env.begin(write=False, db=global_counts) as txn:
-        total_kmers = txn.stat()['entries']
-    threads = []
-    if force:
-        logging.info('Force set to True, backfilling all genomes')
-    for k in db_keys:
-        curr_db = env.open_db(k.encode())
-        with env.begin(write=False, db=curr_db) as txn:
-            curr_kmers = txn.stat()['entries']
-        if force or curr_kmers < total_kmers or k in recounts:
-            args = [k, env, global_counts]
-            threads.append(Thread(target=backfill_file, args=args))
-            if k not in recounts:
-                recounts.append(k)
-    if not force:
-        logging.info('Force set to False, Backfilling {}'.format(recounts))
-    for t in threads:
-        t.start()
-    for t in threads:
-        t.join()
-    logging.info('Done backfilling genomes')
+    logging.info('Begin counting kmers into sorted runs')
+    version = read_version(env)
+    packed = version >= constants.PACKED_VERSION
+    temp_dir = tempfile.mkdtemp()
+    stale = stale or []
+    jobs = []
+    keys = {}
+    recounts = []
+    replaced = []
+    for i, v in enumerate(fasta_files):
+        with env.begin(write=False) as txn:
+            exists = txn.get(db_keys[i].encode(), default=False)
+        if force or db_keys[i] in stale or not exists:
+            jobs.append((v, os.path.join(temp_dir, 'genome%d' % i), k, backend))
+            keys[v] = db_keys[i]
+            recounts.append(db_keys[i])
+            if exists:
+                replaced.append(db_keys[i])
+    if not jobs:
+        shutil.rmtree(temp_dir)
+        return recounts
+
+    runs = {}
+
+    def collect(job, run_path):
+        runs[keys[job[0]]] = run_path
+
+    hash_sizes = hash_sizes or {}
+    digests = {f: x['digest'] for f, x in (sources or {}).items()}
+    workers, threads = pipeline.schedule(len(jobs), cores, workers)
+    jobs = [job + (threads, hash_sizes.get(job[0]), packed, cache,
+                   digests.get(job[0])) for job in jobs]
+    pipeline.run(jobs, sort_genome, collect, workers)
+    logging.info('Done counting kmers into sorted runs')
+
+    genome_runs = {key: external_sort.read_run(path)
+                   for key, path in runs.items()}
+    with env.begin(write=False) as txn:
+        entries = txn.stat(global_counts)['entries']
+    entries = 2 * entries + 3 * sum(x[0].shape[0] for x in genome_runs.values())
+    grow_map(env, cardinality.map_size(entries, k))
+
+    dbs = {key: env.open_db(key.encode()) for key in runs}
+    metadata = env.open_db('metadata'.encode())
+    with env.begin(write=True) as txn:
+        merged = [spill_counts(txn, global_counts, file_counts,
+                               os.path.join(temp_dir, 'base'), version, k,
+                               memory_budget)]
+        for i, key in enumerate(replaced):
+            merged.append(remove_genome(txn, dbs[key],
+                                        os.path.join(temp_dir, 'old%d' % i),
+                                        version, k))
+
+        for key, run in genome_runs.items():
+            append = txn.stat(dbs[key])['entries'] == 0
+            chunk = external_sort.chunk_length(memory_budget, 1,
+                                               run[0].dtype.itemsize)
+            with txn.cursor(db=dbs[key]) as cursor:
+                for start in range(0, run[0].shape[0], chunk):
+                    kmers = encode_keys(run[0][start:start + chunk], version)
+                    counts = encode_counts(run[1][start:start + chunk],
+                                           version)
+                    cursor.putmulti(zip(kmers, counts), append=append)
+            merged.append(run)
+            logging.info('Added {} to DB'.format(key))
+
+        txn.drop(global_counts, delete=False)
+        txn.drop(file_counts, delete=False)
+        with txn.cursor(db=global_counts) as g, txn.cursor(db=file_counts) as f:
+            for kmers, counts, files in external_sort.merge_runs(merged,
+                                                                 memory_budget):
+                keep = files > 0
+                kmers = encode_keys(kmers[keep], version)
+                g.putmulti(zip(kmers, encode_counts(counts[keep], version)),
+                           append=True)
+                f.putmulti(zip(kmers, encode_counts(files[keep], version)),
+                           append=True)
+
+        generation = int(txn.get('generation'.encode(), default='0'.encode(),
+                                 db=metadata))
+        txn.put('generation'.encode(), str(generation + 1).encode(),
+                db=metadata)
+    del merged, genome_runs
+    shutil.rmtree(temp_dir)
+    logging.info('Done merging sorted runs into database')
     return recounts
 
 
+def read_sources(env, db_keys):
+    """
+    Get the description of the file each genome in env was counted from.
+
+    Args:
+        env (lmdb.Environment): Environment containing the complete results.
+        db_keys (list):         The genomes to look up.
+
+    Returns:
+        dict: Maps each db_key whose source was recorded to its description,
+              see genome_cache.describe.
+    """
+    metadata = env.open_db('metadata'.encode())
+    sources = {}
+    with env.begin(write=False, db=metadata) as txn:
+        for key in db_keys:
+            value = txn.get('source/{}'.format(key).encode())
+            if value is not None:
+                sources[key] = json.loads(value.decode())
+    return sources
+
+
+def write_sources(env, db_keys, records):
+    """
+    Record the description of the file each genome was counted from.
+
+    Args:
+        env (lmdb.Environment): Environment containing the complete results.
+        db_keys (list):         The genomes to record.
+        records (list(dict)):   The description of each genome's file.
+
+    Returns:
+        None
+    """
+    metadata = env.open_db('metadata'.encode())
+    with env.begin(write=True, db=metadata) as txn:
+        for key, record in zip(db_keys, records):
+            txn.put('source/{}'.format(key).encode(),
+                    json.dumps(record).encode())
+
+
+def stale_genomes(db_keys, recorded, records):
+    """
+    Find genomes whose file has changed since they were counted. Genomes
+    without a recorded source are assumed to be up to date.
+
+    Args:
+        db_keys (list):         The genomes to check.
+        recorded (dict):        Recorded sources, see read_sources.
+        records (list(dict)):   The current description of each genome's
+                                file.
+
+    Returns:
+        list: The db_keys whose file has a different digest.
+    """
+    return [key for key, record in zip(db_keys, records)
+            if key in recorded and recorded[key]['digest'] != record['digest']]
+
+
+def read_generation(env):
+    """
+    Get how many times global_counts and file_counts have been changed.
+
+    Args:
+        env (lmdb.Environment): Environment containing the complete results.
+
+    Returns:
+        int: The generation of the counts, 0 if never recorded.
+    """
+    try:
+        metadata = env.open_db('metadata'.encode(), create=False)
+    except lmdb.NotFoundError:
+        return 0
+    with env.begin(write=False, db=metadata) as txn:
+        return int(txn.get('generation'.encode(), default='0'.encode()))
+
+
+def count_columns(global_counts, file_counts, env):
+    """
+    Get every kmer in the database along with its global count and file
+    count as aligned numpy columns. The columns are cached in
+    constants.COLUMNS_FILE inside the database directory and reused until the
+    counts change, so that many filters can be applied to one database
+    without reading it again. The cache is written to a temporary file and
+    moved into place, and a cache that can not be read is remade.
+
+    Args:
+        global_counts (database):   Database containing counts of how many
+                                    times in total each kmer appears in the
+                                    database.
+        file_counts (database):     Database containing counts of how many
+                                    files each kmer appears in.
+        env (lmdb.Environment):     Environment containing the complete
+                                    results.
+
+    Returns:
+        tuple(ndarray, ndarray, ndarray): The sorted kmers (as bytes, or
+                                          codes in packed versions), their
+                                          global counts and their file
+                                          counts.
+    """
+    generation = read_generation(env)
+    path = os.path.join(env.path(), constants.COLUMNS_FILE)
+    if generation and os.path.exists(path):
+        try:
+            with np.load(path) as columns:
+                if int(columns['generation']) == generation:
+                    return (columns['kmers'], columns['global_counts'],
+                            columns['file_counts'])
+        except (ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            logging.warning('Could not read cached count columns {}'
+                            .format(path))
+
+    version = read_version(env)
+    output = []
+    with env.begin(write=False) as txn:
+        for db in [global_counts, file_counts]:
+            with txn.cursor(db=db) as cursor:
+                items = list(cursor.iternext())
+            keys, values = zip(*items) if items else ([], [])
+            output.append((decode_keys(keys, version),
+                           decode_counts(values, version)))
+    (kmers, global_values), (file_kmers, file_values) = output
+    if not np.array_equal(kmers, file_kmers):
+        msg = 'global_counts and file_counts contain different kmers in {}'
+        raise(KmerCounterError(msg.format(env.path())))
+
+    if generation:
+        temp_file = None
+        try:
+            handle, temp_file = tempfile.mkstemp(dir=env.path())
+            with os.fdopen(handle, 'wb') as f:
+                np.savez(f, generation=generation, kmers=kmers,
+                         global_counts=global_values, file_counts=file_values)
+            os.replace(temp_file, path)
+        except (IOError, OSError):
+            logging.warning('Could not cache count columns in {}'.format(path))
+            if temp_file is not None and os.path.exists(temp_file):
+                os.remove(temp_file)
+    return kmers, global_values, file_values
+
+
+def filter_mask(global_values, file_values, max_global_count,
+                min_global_count, max_file_count, min_file_count):
+    """
+    Find the kmers whose counts meet the requirements of filter_kmers.
+
+    Args:
+        global_values (ndarray):    The global count of each kmer.
+        file_values (ndarray):      The file count of each kmer.
+        max_global_count (int):     See filter_kmers, None for no limit.
+        min_global_count (int):     See filter_kmers.
+        max_file_count (int):       See filter_kmers.
+        min_file_count (int):       See filter_kmers.
+
+    Returns:
+        ndarray: True for every kmer that meets the requirements.
+    """
+    mask = global_values >= min_global_count
+    if max_global_count:
+        mask &= global_values <= max_global_count
+    mask &= file_values <= max_file_count
+    mask &= file_values >= min_file_count
+    return mask
+
+
 def filter_kmers(global_counts, file_counts, env, max_global_count,
                  min_global_count, max_file_count, min_file_count):
     """
@@ -267,77 +1430,147 @@ def filter_kmers(global_counts, file_counts, env, max_global_count,
                                 can appear in inorder to be outoput.
 
     Returns:
-        valid_kmers (list): Every kmer that appears in the database and meets
-                            the requirements.
+        valid_kmers (ndarray):  Every kmer that appears in the database and
+                                meets the requirements, as bytes or as codes,
+                                see count_columns.
+    """
+    kmers, global_values, file_values = count_columns(global_counts,
+                                                      file_counts, env)
+    mask = filter_mask(global_values, file_values, max_global_count,
+                       min_global_count, max_file_count, min_file_count)
+    return kmers[mask]
+
+
+def filter_database(database, max_global_count=None, min_global_count=0,
+                    max_file_count=None, min_file_count=0):
+    """
+    Get every kmer in database that passes the filter of filter_kmers. The
+    kmers of each shard of a sharded database are filtered separately and
+    concatenated in order.
+
+    Args:
+        database (str):         Path to the complete database.
+        max_global_count (int): See filter_kmers, None for no limit.
+        min_global_count (int): See filter_kmers.
+        max_file_count (int):   See filter_kmers, None for no limit.
+        min_file_count (int):   See filter_kmers.
+
+    Returns:
+        ndarray: The sorted kmers that pass the filter, see filter_kmers.
     """
-    global_kmers = []
+    if max_file_count is None:
+        max_file_count = np.iinfo(np.int64).max
     valid_kmers = []
-    with env.begin(write=False, db=global_counts) as global_txn:
-        with global_txn.cursor() as global_cursor:
-            for key, global_value in global_cursor:
-                global_value = int(global_value)
-                if max_global_count:
-                    if global_value <= max_global_count and global_value >= min_global_count:
-                        global_kmers.append(key)
-                else:
-                    if global_value >= min_global_count:
-                        global_kmers.append(key)
-    with env.begin(write=False, db=file_counts) as file_txn:
-        for kmer in global_kmers:
-            file_value = file_txn.get(kmer)
-            if int(file_value) <= max_file_count and int(file_value) >= min_file_count:
-                valid_kmers.append(kmer.decode())
-
-    return valid_kmers
-
-
-def output_file(key, valid_kmers, input_env, output_env, name, write_kmers):
-    """
-    Convert the key, value pairs in input_env under key to a numpy string
-    representation of a 1D array in output_env under key[name].
-
-    Args:
-        key (str):                      Identifier for the named database in
-                                        both envs.
-        valid_kmers (list):             The list of kmers to include in the
-                                        output.
-        input_env (lmdb.Environment):   Environment containing the complete
-                                        kmer count results.
-        output_env (lmdb.Environment):  Environment where you want to store
-                                        the output values, can be the same
-                                        environment as input_env.
-        name (str):                     The key to store the output value
-                                        under. Usefull when using multiple
-                                        kmer filter methods.
-        write_kmers (bool):             If True the kmer names are written as
-                                        to the output_env under a database
-                                        named name.
+    for path in read_shards(database) or [database]:
+        # count_columns may write its cache while the database is read
+        env = environments.reader(path, lock=True)
+        try:
+            global_counts = env.open_db('global_counts'.encode(), create=False)
+            file_counts = env.open_db('file_counts'.encode(), create=False)
+        except lmdb.NotFoundError:
+            msg = 'Attempted to filter kmers in {}, which has no counts'
+            raise(KmerCounterError(msg.format(path)))
+        valid_kmers.append(filter_kmers(global_counts, file_counts, env,
+                                        max_global_count, min_global_count,
+                                        max_file_count, min_file_count))
+    return np.concatenate(valid_kmers)
+
+
+# The kmers included in the output, the dtype of the output and the count
+# larger counts are clamped to, shared with every output worker process by
+# init_output_worker so that they are not sent along with each genome.
+_valid_kmers = []
+_output_dtype = np.dtype(int)
+_saturate = None
+
+
+def init_output_worker(valid_kmers, dtype=int, saturate=None):
+    """
+    Store valid_kmers in an output worker process, see make_output.
+
+    Args:
+        valid_kmers (ndarray):  The kmers to include in the output, sorted
+                                alphabetically, as returned by filter_kmers.
+        dtype:                  The dtype of each output, see compact_dtype.
+        saturate (int):         The count larger counts are clamped to, or
+                                None.
+
     Returns:
         None
     """
-    db = input_env.open_db(key.encode())
-    output = np.zeros(len(valid_kmers), dtype=int)
-    kmer_name_db = output_env.open_db(name.encode())
-    with input_env.begin(write=False, db=db) as txn_in:
-        with output_env.begin(write=True, db=kmer_name_db) as txn_out:
-            for index, kmer in enumerate(valid_kmers):
-                output[index] = int(txn_in.get(kmer.encode(), db=db))
-                if write_kmers:
-                    txn_out.put(kmer.encode(), '1'.encode())
-    db = output_env.open_db(key.encode())
-    with output_env.begin(write=True, db=db) as txn:
-        txn.put(name.encode(), output.tostring(), db=db)
-    logging.info('Made output key for {}'.format(key))
+    global _valid_kmers, _output_dtype, _saturate
+    _output_dtype = np.dtype(dtype)
+    _saturate = saturate
+    _valid_kmers = np.asarray(valid_kmers)
+    if _valid_kmers.dtype.kind == 'U':
+        _valid_kmers = _valid_kmers.astype('S')
 
 
-def output_all(db_keys, valid_kmers, env, output_env, name, force, recounts):
+def make_output(database, key):
     """
-    Create the output value for each key in db_keys in parrallel.
+    Convert the key, value pairs in database under key to a 1D array of the
+    counts of the valid kmers passed to init_output_worker. Only the kmers
+    that appear in a genome are stored in its database, every valid kmer that
+    is missing is given a count of 0.
+
+    The genome's database and the valid kmers are both sorted, so instead of
+    looking up every valid kmer the database is read with one cursor scan and
+    joined to the valid kmers with np.searchsorted.
+
+    Args:
+        database (str): Path to the database containing the complete kmer
+                        count results.
+        key (str):      Identifier for the named database of the genome.
+
+    Returns:
+        ndarray: The count of each valid kmer, clamped to and in the dtype
+                 passed to init_output_worker.
+    """
+    # the outputs are written to the database while it is read
+    env = environments.reader(database, lock=True)
+    version = read_version(env)
+    db = env.open_db(key.encode(), create=False)
+    output = np.zeros(len(_valid_kmers), dtype=int)
+    with env.begin(write=False, db=db) as txn:
+        with txn.cursor() as cursor:
+            items = list(cursor.iternext())
+    if version >= constants.PACKED_VERSION:
+        # Skip the outputs, every packed kmer key is exactly one code long.
+        size = np.dtype(constants.KEY_DTYPE).itemsize
+        items = [x for x in items if len(x[0]) == size]
+    if not items or not len(_valid_kmers):
+        return output.astype(_output_dtype)
+
+    keys, values = zip(*items)
+    keys = decode_keys(keys, version)
+    index = np.searchsorted(_valid_kmers, keys)
+    index = np.minimum(index, len(_valid_kmers) - 1)
+    found = _valid_kmers[index] == keys
+    values = [v for v, f in zip(values, found.tolist()) if f]
+    output[index[found]] = decode_counts(values, version)
+    if _saturate is not None:
+        np.minimum(output, _saturate, out=output)
+    return output.astype(_output_dtype)
+
+
+def output_all(db_keys, valid_kmers, env, output_env, name, force, recounts,
+               workers=None, memory_budget=constants.MEMORY_BUDGET,
+               cores=None, max_count=None, saturate=None):
+    """
+    Create the output value for each key in db_keys in parrallel. The output
+    arrays are made by a pool of worker processes and stored in output_env
+    under key[name] by the calling process.
+
+    The outputs are stored in the smallest dtype that holds max_count (see
+    compact_dtype), which is recorded in output_env. Every output is remade
+    when the dtype or saturate differ from the ones already recorded for
+    name, so that all of the outputs of name share one dtype.
 
     Args:
         db_keys (list):                 Every db_key to make the output for.
-        valid_kmers (list):             The list of kmers to include in the
-                                        output.
+        valid_kmers (ndarray):          The kmers to include in the output,
+                                        sorted alphabetically as returned by
+                                        filter_kmers.
         env: (limdb.Environment):       Environment containing the complete
                                         kmer count results.
         output_env (lmdb.Environment):  Environment where you want to store the
@@ -345,35 +1578,71 @@ def output_all(db_keys, valid_kmers, env, output_env, name, force, recounts):
                                         environment as env.
         name (str):                     The key to store the output value under.
                                         Usefull when using multiple kmer filter
-                                        methods.
+                                        methods. The kmer names are written to
+                                        output_env under a database named name.
         force (bool):                   If True every output is remade, if False
                                         only db_keys that do not have a valid
                                         name key in output_env or appear in
                                         recounts are remade.
         recounts (list):                Every db_key altered by count_all.
+        workers (int):                  Number of worker processes, see
+                                        pipeline.run.
+        memory_budget (int):            Bytes of output arrays that may be
+                                        waiting to be written at once.
+        cores (int):                    Total number of cores to use, see
+                                        pipeline.schedule.
+        max_count (int):                The largest count of a valid kmer in
+                                        any genome, or an upper bound on it.
+                                        None to store int64 outputs.
+        saturate (int):                 Counts larger than saturate are
+                                        stored as saturate, None to store
+                                        every count.
     Returns:
         None
     """
     logging.info('Begin making output')
-    threads = []
+    if max_count is None:
+        dtype = np.dtype(int)
+    else:
+        dtype = compact_dtype(max_count, saturate)
+    if read_dtype(output_env, name) != (dtype, saturate):
+        logging.info('Storing {} outputs as {}'.format(name, dtype))
+        force = True
+    jobs = []
     if force:
         logging.info('Force set to True, creating all outputs')
-    write_kmers = True
     for k in db_keys:
         curr_db = env.open_db(k.encode())
         with env.begin(write=False, db=curr_db) as txn:
             if force or not txn.get(k.encode(), default=False, db=curr_db) or k in recounts:
-                args = [k, valid_kmers, env, output_env, name, write_kmers]
-                threads.append(Thread(target=output_file, args=args))
-                write_kmers = False
+                jobs.append((env.path(), k))
                 if k not in recounts:
                     recounts.append(k)
     if not force:
         logging.info('Force set to False, creating outputs for {}'.format(recounts))
-    for t in threads:
-        t.start()
-    for t in threads:
-        t.join()
+
+    version = read_version(output_env)
+    if jobs:
+        remove_matrix(output_env.path(), name)
+        write_dtype(output_env, dtype, saturate, name)
+        keys = encode_keys(valid_kmers, version, read_k(env))
+        kmer_name_db = output_env.open_db(name.encode())
+        with output_env.begin(write=True, db=kmer_name_db) as txn:
+            txn.drop(kmer_name_db, delete=False)
+            with txn.cursor() as cursor:
+                cursor.putmulti(zip(keys, ['1'.encode()] * len(keys)),
+                                append=True)
+
+    def write(txn, job, output):
+        key = job[1]
+        db = output_env.open_db(key.encode(), txn=txn)
+        txn.put(output_key(name, version), output.tobytes(), db=db)
+        logging.info('Made output key for {}'.format(key))
+
+    workers = pipeline.schedule(len(jobs), cores, workers)[0]
+    pipeline.run(jobs, make_output, write, workers, memory_budget,
+                 init_output_worker, (valid_kmers, dtype, saturate),
+                 env=output_env)
     logging.info('Done making output')
 
 
@@ -385,18 +1654,484 @@ def make_db_keys(input_files):
         input_files (list): The files to convert.
     Returns:
         output (list): Every input file path with the absolute path and file
-                       suffix stripped.
+                       suffix stripped, compressed files also lose their
+                       compression suffix.
     """
-    output = [x.split('/')[-1] for x in input_files]
+    output = [compression.strip_suffix(x.split('/')[-1]) for x in input_files]
     output = [x.split('.')[:-1] for x in output]
     output = ['.'.join(x) for x in output]
     return output
 
 
+def matrix_path(database, name=constants.DEFAULT_NAME):
+    """
+    Get the directory that holds the materialized matrix for name.
+
+    Args:
+        database (str): File path to the database containing the output.
+        name (str):     Identifier for the output in database.
+
+    Returns:
+        str: The path of the directory.
+    """
+    return os.path.join(database, name + constants.MATRIX_SUFFIX)
+
+
+def remove_matrix(database, name=constants.DEFAULT_NAME):
+    """
+    Delete the materialized matrix for name, it is out of date as soon as
+    any output is remade.
+
+    Args:
+        database (str): File path to the database containing the output.
+        name (str):     Identifier for the output in database.
+
+    Returns:
+        None
+    """
+    path = matrix_path(database, name)
+    if os.path.exists(path):
+        logging.info('Removing out of date matrix {}'.format(path))
+        shutil.rmtree(path)
+
+
+def materialize(database, name=constants.DEFAULT_NAME, files=None):
+    """
+    Write the output for name in database to a directory of files that can
+    be read without lmdb: counts.npy, an (n_genomes, n_kmers) array that is
+    memory mapped when read, genomes.npy and kmers.npy holding the db key of
+    each row and the kmer (as bytes, or as a uint64 code in packed versions)
+    of each column, and manifest.json holding k, name,
+    the database version, the shape of the matrix and the dtype the counts
+    are stored in (and the count they were clamped to, see output_all). get_counts and
+    get_kmer_names read from the matrix whenever it exists.
+
+    Args:
+        database (str): File path to the database containing the output.
+        name (str):     Identifier for the output in database.
+        files (list):   The fasta files to include, defaults to every genome
+                        with an output stored under name.
+
+    Returns:
+        str: The path of the directory the matrix was written to.
+    """
+    # every shard of a sharded database holds every genome
+    env = environments.reader((read_shards(database) or [database])[0])
+    version = read_version(env)
+    saturate = read_dtype(env, name)[1]
+    with env.begin(write=False, buffers=True) as txn:
+        if files is None:
+            skip = ['global_counts', 'file_counts', 'metadata', name]
+            db_keys = []
+            for key in list(txn.cursor().iternext(values=False)):
+                key = bytes(key).decode()
+                if key in skip:
+                    continue
+                current = env.open_db(key.encode(), txn=txn, create=False)
+                if txn.get(output_key(name, version), db=current) is not None:
+                    db_keys.append(key)
+        else:
+            db_keys = make_db_keys(files)
+
+    counts = read_outputs(db_keys, database, name)
+    kmers, k = read_names(database, name)
+    if k is None:
+        k = kmers.dtype.itemsize if kmers.shape[0] else 0
+
+    temp_dir = tempfile.mkdtemp(dir=database)
+    matrix = np.lib.format.open_memmap(os.path.join(temp_dir, 'counts.npy'),
+                                       mode='w+', dtype=counts.dtype,
+                                       shape=(len(db_keys), kmers.shape[0]))
+    matrix[:] = counts.reshape(matrix.shape)
+    matrix.flush()
+    del matrix
+    np.save(os.path.join(temp_dir, 'genomes.npy'), np.array(db_keys, dtype='U'))
+    np.save(os.path.join(temp_dir, 'kmers.npy'), kmers)
+    manifest = {'k': k, 'name': name, 'version': version,
+                'genomes': len(db_keys), 'kmers': int(kmers.shape[0]),
+                'dtype': str(counts.dtype), 'saturate': saturate}
+    with open(os.path.join(temp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    remove_matrix(database, name)
+    path = matrix_path(database, name)
+    os.rename(temp_dir, path)
+    logging.info('Materialized {} genomes in {}'.format(len(db_keys), path))
+    return path
+
+
+def load_matrix(database, name=constants.DEFAULT_NAME):
+    """
+    Open the materialized matrix for name in database.
+
+    Args:
+        database (str): File path to the database containing the output.
+        name (str):     Identifier for the output in database.
+
+    Returns:
+        tuple(ndarray, dict, ndarray): The memory mapped counts, a dict from
+                                       db key to row, and the kmer of each
+                                       column. None if there is no matrix.
+    """
+    path = matrix_path(database, name)
+    if not os.path.exists(os.path.join(path, 'manifest.json')):
+        return None
+    counts = np.load(os.path.join(path, 'counts.npy'), mmap_mode='r')
+    genomes = np.load(os.path.join(path, 'genomes.npy'))
+    kmers = np.load(os.path.join(path, 'kmers.npy'), mmap_mode='r')
+    rows = {key: index for index, key in enumerate(genomes.tolist())}
+    return counts, rows, kmers
+
+
+def shard_bounds(k, shards):
+    """
+    Split the codes of the kmers of length k into shards contiguous ranges,
+    each a range of kmer prefixes of constants.SHARD_PREFIX bases, that hold
+    about as many canonical kmers. A kmer is canonical when it is not larger
+    than its reverse complement, so canonical kmers thin out linearly towards
+    the end of the codes and the fraction of them below a fraction u of the
+    codes is 2u - u ** 2.
+
+    Args:
+        k (int):        Length of the kmers.
+        shards (int):   Number of ranges.
+
+    Returns:
+        list(int): The shards + 1 boundaries of the ranges, shard i holds the
+                   codes from bounds[i] up to but not including bounds[i + 1].
+    """
+    space = 4 ** k
+    step = 4 ** max(k - constants.SHARD_PREFIX, 0)
+    bounds = [0]
+    for i in range(1, shards):
+        u = 1 - np.sqrt(1 - i / float(shards))
+        bounds.append(max(int(space * u) // step * step, bounds[-1]))
+    bounds.append(space)
+    return bounds
+
+
+def read_shards(database):
+    """
+    Get the shards of a sharded database, see count_sharded.
+
+    Args:
+        database (str): Path to the database.
+
+    Returns:
+        list(str): The path of each shard in the order of their kmers, None
+                   if database is not sharded.
+    """
+    path = os.path.join(database, constants.SHARDS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        shards = json.load(f)['shards']
+    return [os.path.join(database, 'shard{}'.format(i)) for i in range(shards)]
+
+
+def open_shards(database, k, bounds):
+    """
+    Record the layout of a sharded database, or check that it matches the
+    layout already recorded.
+
+    Args:
+        database (str):     Path to the database.
+        k (int):            Length of the kmers.
+        bounds (list(int)): The kmer code range of each shard, see
+                            shard_bounds.
+
+    Returns:
+        list(str): The path of each shard, see read_shards.
+    """
+    manifest = {'k': k, 'shards': len(bounds) - 1, 'bounds': bounds}
+    path = os.path.join(database, constants.SHARDS_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            recorded = json.load(f)
+        if recorded != manifest:
+            msg = '{} is split into {} shards of {}-mers, not {} shards of {}-mers'
+            msg = msg.format(database, recorded['shards'], recorded['k'],
+                             manifest['shards'], k)
+            raise(KmerCounterError(msg))
+    else:
+        if os.path.exists(os.path.join(database, environments.DATA_FILE)):
+            msg = '{} is an unsharded database and can not be sharded'
+            raise(KmerCounterError(msg.format(database)))
+        if not os.path.exists(database):
+            os.makedirs(database)
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+    return read_shards(database)
+
+
+def split_genome(input_file, run_dir, key, k, bounds,
+                 backend=constants.DEFAULT_BACKEND, threads=None, size=None,
+                 cache=None, digest=None):
+    """
+    Count the kmers of input_file and write the kmers of each shard to a
+    sorted run, see external_sort.write_run.
+
+    Args:
+        input_file (str):   Path to a fasta file to count kmers in, which may
+                            be compressed.
+        run_dir (str):      Directory holding a directory of runs for each
+                            shard, named by the index of the shard.
+        key (str):          The db key of the genome, the name of its runs.
+        k (int):            Length of kmer to count.
+        bounds (list(int)): The kmer code range of each shard, see
+                            shard_bounds.
+        backend (str):      The kmer counter to use, see count_file.
+        threads (int):      Number of threads jellyfish may use, see
+                            count_file.
+        size (str):         Jellyfish hash size, see count_file.
+        cache (str):        Directory of the genome cache, see count_cached.
+        digest (str):       Digest of input_file, see count_cached.
+
+    Returns:
+        str: key
+    """
+    kmers, counts = count_cached(input_file, k, None, backend, threads, size,
+                                 True, cache, digest)
+    if kmers.shape[0] > 1 and not np.all(kmers[1:] > kmers[:-1]):
+        order = np.argsort(kmers)
+        kmers = kmers[order]
+        counts = counts[order]
+    cuts = np.searchsorted(kmers, np.array(bounds[1:-1], dtype=np.uint64))
+    starts = [0] + cuts.tolist()
+    ends = cuts.tolist() + [kmers.shape[0]]
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        external_sort.write_run(os.path.join(run_dir, str(i), key),
+                                kmers[start:end], counts[start:end])
+    return key
+
+
+def build_shard(shard, run_dir, db_keys, recounts, k, records,
+                max_global_count, min_global_count, max_file_count,
+                min_file_count):
+    """
+    Add the runs written by split_genome for one shard to the shard's
+    database, in a process of its own with its own writer.
+
+    Args:
+        shard (str):            Path to the shard's database.
+        run_dir (str):          Directory of the shard's runs.
+        db_keys (list):         Every genome in the database.
+        recounts (list):        The genomes that were counted.
+        k (int):                Length of the kmers.
+        records (list(dict)):   Description of each genome's file, see
+                                write_sources.
+        max_global_count (int): See filter_kmers.
+        min_global_count (int): See filter_kmers.
+        max_file_count (int):   See filter_kmers.
+        min_file_count (int):   See filter_kmers.
+
+    Returns:
+        int: The largest global count of a kmer in the shard that passes the
+             filter, see output_all.
+    """
+    environments.release(shard)
+    env = lmdb.open(shard, map_size=constants.MIN_MAP_SIZE, max_dbs=4000,
+                    max_readers=int(1e7))
+    write_version(env, k)
+    runs = [os.path.join(run_dir, key) for key in recounts]
+    entries = sum(np.load(external_sort.run_files(x)[0], mmap_mode='r').shape[0]
+                  for x in runs)
+    # every kmer is stored in its genome, global_counts and file_counts
+    grow_map(env, cardinality.map_size(3 * entries, k))
+    global_counts = env.open_db('global_counts'.encode())
+    file_counts = env.open_db('file_counts'.encode())
+    for key, run in zip(recounts, runs):
+        kmers, counts, _ = external_sort.read_run(run)
+        add_kmers(np.array(kmers), np.array(counts), key, global_counts,
+                  file_counts, env)
+    write_sources(env, db_keys, records)
+
+    kmers, global_values, file_values = count_columns(global_counts,
+                                                      file_counts, env)
+    mask = filter_mask(global_values, file_values, max_global_count,
+                       min_global_count, max_file_count, min_file_count)
+    env.close()
+    return int(global_values[mask].max()) if mask.any() else 0
+
+
+def output_shard(shard, output_shard, db_keys, recounts, k, name, force,
+                 max_count, saturate, max_global_count, min_global_count,
+                 max_file_count, min_file_count):
+    """
+    Make the outputs of one shard, in a process of its own, see output_all.
+    Every shard is given the largest count of every shard so that all of
+    their outputs share one dtype.
+
+    Args:
+        shard (str):            Path to the shard's database.
+        output_shard (str):     Path to the shard of the output database, or
+                                None to store the outputs in shard.
+        db_keys (list):         Every genome to make the output for.
+        recounts (list):        The genomes that were counted.
+        k (int):                Length of the kmers.
+        name (str):             The key to store the outputs under.
+        force (bool):           If True every output is remade.
+        max_count (int):        The largest count of a valid kmer in any
+                                shard.
+        saturate (int):         See output_all.
+        max_global_count (int): See filter_kmers.
+        min_global_count (int): See filter_kmers.
+        max_file_count (int):   See filter_kmers.
+        min_file_count (int):   See filter_kmers.
+
+    Returns:
+        str: shard
+    """
+    environments.release(shard)
+    env = lmdb.open(shard, map_size=constants.MIN_MAP_SIZE, max_dbs=4000,
+                    max_readers=int(1e7))
+    # make_output runs in this process, see pipeline.run
+    environments.hold(shard, env)
+    global_counts = env.open_db('global_counts'.encode())
+    file_counts = env.open_db('file_counts'.encode())
+    valid_kmers = filter_kmers(global_counts, file_counts, env,
+                               max_global_count, min_global_count,
+                               max_file_count, min_file_count)
+    extra = len(db_keys) * len(valid_kmers) * compact_dtype(
+        max_count, saturate).itemsize
+    size = cardinality.map_size(len(valid_kmers), k, extra=extra)
+
+    output_env = env
+    if output_shard:
+        environments.release(output_shard)
+        output_env = lmdb.open(output_shard, map_size=constants.MIN_MAP_SIZE,
+                               max_dbs=4000, max_readers=int(1e7))
+        write_version(output_env, k)
+    grow_map(output_env, size)
+
+    output_all(db_keys, valid_kmers, env, output_env, name, force,
+               list(recounts), max_count=max_count, saturate=saturate)
+    if output_shard:
+        output_env.close()
+    environments.release(shard)
+    env.close()
+    return shard
+
+
+def count_sharded(fasta_files, db_keys, database, k, shards, output_db=None,
+                  min_global_count=0, max_global_count=None,
+                  min_file_count=0, max_file_count=None, force=False,
+                  name=constants.DEFAULT_NAME,
+                  backend=constants.DEFAULT_BACKEND, workers=None,
+                  memory_budget=constants.MEMORY_BUDGET, cores=None,
+                  cache=None, saturate=None):
+    """
+    Count kmers into a database split into shards by kmer prefix, see
+    shard_bounds. Each shard is a complete database of its own holding the
+    kmers in its range of every genome, so shards are written by separate
+    processes at once instead of waiting on one lmdb writer. The genomes are
+    counted by a pool of worker processes that split each genome's kmers
+    into a sorted run per shard, then one process per shard adds its runs
+    to the shard and filters its kmers, and finally one process per shard
+    makes the shard's outputs. The readers (get_counts, get_kmer_names,
+    filter_database and so on) concatenate the shards in order, so a sharded
+    database reads the same as an unsharded one. Only packed kmers can be
+    sharded.
+
+    Args:
+        fasta_files (list):     The paths to each fasta file to count.
+        db_keys (list):         The db key of each fasta file.
+        database (str):         Path to the sharded database, shard i is
+                                stored in database/shard{i}.
+        k (int):                The length of kmer to count.
+        shards (int):           The number of shards.
+        output_db (str):        Path to a sharded database to store the
+                                outputs in, see count_kmers.
+        min_global_count (int): See filter_kmers.
+        max_global_count (int): See filter_kmers.
+        min_file_count (int):   See filter_kmers.
+        max_file_count (int):   See filter_kmers.
+        force (bool):           If True every genome is recounted.
+        name (str):             The key to store the outputs under.
+        backend (str):          The kmer counter to use, see count_file.
+        workers (int):          Number of genomes to count at once, see
+                                pipeline.schedule.
+        memory_budget (int):    See pipeline.run.
+        cores (int):            Total number of cores to use, see
+                                pipeline.schedule.
+        cache (str):            Directory of the genome cache, see
+                                count_cached.
+        saturate (int):         See output_all.
+
+    Returns:
+        None
+    """
+    if k > native_counter.MAX_K:
+        msg = 'Only kmers up to {} long can be sharded, not {}'
+        raise(KmerCounterError(msg.format(native_counter.MAX_K, k)))
+    bounds = shard_bounds(k, shards)
+    paths = open_shards(database, k, bounds)
+    output_paths = [None] * shards
+    if output_db:
+        output_paths = open_shards(output_db, k, bounds)
+
+    # every genome has a database in every shard, so the first shard knows
+    # which genomes have been counted
+    counted = set()
+    recorded = {}
+    if os.path.exists(os.path.join(paths[0], environments.DATA_FILE)):
+        env = environments.reader(paths[0])
+        with env.begin(write=False) as txn:
+            counted = {key for key in db_keys if txn.get(key.encode())}
+        recorded = read_sources(env, db_keys)
+        environments.release(paths[0])
+    sources = genome_cache.describe_all(
+        fasta_files, cache, {f: recorded.get(key) for f, key in
+                             zip(fasta_files, db_keys)})
+    records = [sources[f] for f in fasta_files]
+    stale = stale_genomes(db_keys, recorded, records)
+    if stale:
+        logging.info('Files changed since they were counted: {}'.format(stale))
+    recounts = [key for key in db_keys
+                if force or key in stale or key not in counted]
+    logging.info('Counting {} into {} shards'.format(recounts, shards))
+
+    run_dir = tempfile.mkdtemp()
+    for i in range(shards):
+        os.makedirs(os.path.join(run_dir, str(i)))
+    jobs = [(f, run_dir, key, k, bounds, backend)
+            for f, key in zip(fasta_files, db_keys) if key in recounts]
+    count_workers, threads = pipeline.schedule(len(jobs), cores, workers)
+    jobs = [job + (threads, None, cache, sources[job[0]]['digest'])
+            for job in jobs]
+
+    def split(job, key):
+        logging.info('Split {} into {} shards'.format(key, shards))
+
+    pipeline.run(jobs, split_genome, split, count_workers, memory_budget)
+
+    filters = (max_global_count, min_global_count, max_file_count,
+               min_file_count)
+    max_counts = []
+    jobs = [(path, os.path.join(run_dir, str(i)), db_keys, recounts, k,
+             records) + filters for i, path in enumerate(paths)]
+    pipeline.run(jobs, build_shard,
+                 lambda job, result: max_counts.append(result), shards,
+                 memory_budget)
+    shutil.rmtree(run_dir)
+    logging.info('Done adding genomes to {} shards'.format(shards))
+
+    jobs = [(path, output_path, db_keys, recounts, k, name, force,
+             max(max_counts), saturate) + filters
+            for path, output_path in zip(paths, output_paths)]
+    pipeline.run(jobs, output_shard, lambda job, result: None, shards,
+                 memory_budget)
+    logging.info('Done making output for {} shards'.format(shards))
+
+
 def count_kmers(fasta_files, database, k=constants.DEFAULT_K, verbose=True,
                 output_db=None, min_global_count=0, max_global_count=None,
                 min_file_count=0, max_file_count=None, force=False,
-                name=constants.DEFAULT_NAME):
+                name=constants.DEFAULT_NAME, backend=constants.DEFAULT_BACKEND,
+                stream=True, workers=None, memory_budget=constants.MEMORY_BUDGET,
+                cores=constants.CORES, sizing=True, make_matrix=False,
+                external=False, cache=constants.GENOME_CACHE,
+                saturate=constants.SATURATE, shards=constants.SHARDS):
     """
     Count kmers in fasta_files of length k. Store the complete results in
     database and the simplified output in output_db.
@@ -423,59 +2158,172 @@ def count_kmers(fasta_files, database, k=constants.DEFAULT_K, verbose=True,
                                 the complete output for a fasta file. User can
                                 specify so that multiple filter results can be
                                 stored in one DB.
+        backend (str):          'jellyfish' to count kmers with the jellyfish
+                                program, 'native' to count them in process
+                                with native_counter.
+        stream (bool):          If True each genome is added to the database
+                                as soon as its kmers are counted and the
+                                counts are never written to disk. If False
+                                every genome is counted into a temporary file
+                                before any are added to the database.
+        workers (int):          Number of worker processes used to count,
+                                parse and output genomes. Chosen from cores
+                                if not given.
+        memory_budget (int):    Upper limit, in bytes, on the counts held by
+                                the workers that are waiting to be written to
+                                the database.
+        cores (int):            Total number of cores to use, split between
+                                the genomes counted at once and the threads
+                                each jellyfish process gets. Defaults to
+                                every core.
+        sizing (bool):          If True the number of distinct kmers is
+                                estimated before counting and used to size
+                                jellyfish's hash and the database, see
+                                size_database. If False constants.HASH_SIZE
+                                and constants.MAP_SIZE are used.
+        make_matrix (bool):     If True the output is materialized after it
+                                is made, see materialize.
+        external (bool):        If True every genome is counted into a sorted
+                                run on disk and the runs are merged into the
+                                database in one pass, see external_all. Used
+                                instead of stream when the distinct kmers of
+                                the cohort do not fit in memory.
+        cache (str):            Directory of a cache of per genome counts
+                                shared by every database, see count_cached.
+                                Only used when stream or external is True.
+        saturate (int):         Counts larger than saturate are stored as
+                                saturate, so the outputs may use a smaller
+                                dtype, see output_all. None to store every
+                                count.
+        shards (int):           If more than 1 the database (and output_db)
+                                is split into this many shards by kmer prefix
+                                and each shard is built by its own process,
+                                see count_sharded. Defaults to the number of
+                                shards database was built with.
     Returns:
         None
     """
     logging.info('Begin complete_kmer_counter.count_kmers')
+    check_backend(backend)
     max_file_count = max_file_count or len(fasta_files) + 1
 
     db_keys = make_db_keys(fasta_files)
-    temp_dir = tempfile.mkdtemp()
-    temp_files = [temp_dir + '/' + x for x in db_keys]
+
+    shards = shards or len(read_shards(database) or [])
+    if shards > 1:
+        count_sharded(fasta_files, db_keys, database, k, shards, output_db,
+                      min_global_count, max_global_count, min_file_count,
+                      max_file_count, force, name, backend, workers,
+                      memory_budget, cores, cache, saturate)
+        if make_matrix:
+            materialize(output_db or database, name, fasta_files)
+        logging.info('Done complete_kmer_counter.count_kmers')
+        return
+    if read_shards(database):
+        msg = '{} is sharded, it can not be counted into as one database'
+        raise(KmerCounterError(msg.format(database)))
 
     if not os.path.exists(database):
         os.makedirs(database)
 
-    env = lmdb.open(database, map_size=160e10, max_dbs=4000, max_readers=1e7)
+    environments.release(database)
+    env = lmdb.open(database, map_size=constants.MIN_MAP_SIZE, max_dbs=4000,
+                    max_readers=int(1e7))
+    write_version(env, k)
     global_counts = env.open_db('global_counts'.encode())
     file_counts = env.open_db('file_counts'.encode())
 
-    recounts = count_all(fasta_files, temp_files, db_keys, k, env, force)
-    recounts = add_all(temp_files, db_keys, global_counts, file_counts, env, force, recounts)
-    recounts = backfill_all(db_keys, global_counts, env, force, recounts)
+    recorded = read_sources(env, db_keys)
+    sources = genome_cache.describe_all(
+        fasta_files, cache, {f: recorded.get(key) for f, key in
+                             zip(fasta_files, db_keys)})
+    records = [sources[f] for f in fasta_files]
+    stale = stale_genomes(db_keys, recorded, records)
+    if stale:
+        logging.info('Files changed since they were counted: {}'.format(stale))
+
+    if sizing:
+        hash_sizes = size_database(fasta_files, db_keys, k, env, force,
+                                   workers=workers, cores=cores, stale=stale)
+    else:
+        hash_sizes = {}
+        grow_map(env, constants.MAP_SIZE)
+
+    if external:
+        recounts = external_all(fasta_files, db_keys, k, global_counts,
+                                file_counts, env, force, backend, workers,
+                                memory_budget, cores, hash_sizes, stale,
+                                cache, sources)
+    elif stream:
+        recounts = stream_all(fasta_files, db_keys, k, global_counts,
+                              file_counts, env, force, backend, workers,
+                              memory_budget, cores, hash_sizes, stale, cache,
+                              sources)
+    else:
+        temp_dir = tempfile.mkdtemp()
+        temp_files = [temp_dir + '/' + x for x in db_keys]
+        recounts = count_all(fasta_files, temp_files, db_keys, k, env, force,
+                             backend, workers, cores, hash_sizes, stale)
+        recounts = add_all(temp_files, db_keys, global_counts, file_counts,
+                           env, force, recounts, workers, memory_budget, cores)
+        shutil.rmtree(temp_dir)
+    write_sources(env, db_keys, records)
+
+    kmers, global_values, file_values = count_columns(global_counts,
+                                                      file_counts, env)
+    mask = filter_mask(global_values, file_values, max_global_count,
+                       min_global_count, max_file_count, min_file_count)
+    valid_kmers = kmers[mask]
+    # No genome has more of a kmer than all of the genomes together
+    max_count = int(global_values[mask].max()) if mask.any() else 0
 
     if output_db:
         if not os.path.exists(output_db):
             os.makedirs(output_db)
-        output_env = lmdb.open(output_db, map_size=160e10, max_dbs=4000,
-                               max_readers=1e7)
+        environments.release(output_db)
+        output_env = lmdb.open(output_db, map_size=constants.MIN_MAP_SIZE,
+                               max_dbs=4000, max_readers=int(1e7))
+        write_version(output_env, k)
+        extra = len(db_keys) * len(valid_kmers) * compact_dtype(
+            max_count, saturate).itemsize
+        grow_map(output_env, cardinality.map_size(len(valid_kmers), k,
+                                                  extra=extra))
     else:
         output_env = env
 
-    valid_kmers = filter_kmers(global_counts, file_counts, env,
-                               max_global_count, min_global_count,
-                               max_file_count, min_file_count)
-
-    output_all(db_keys, valid_kmers, env, output_env, name, force, recounts)
-
-    shutil.rmtree(temp_dir)
+    output_all(db_keys, valid_kmers, env, output_env, name, force, recounts,
+               workers, memory_budget, cores, max_count, saturate)
 
     env.close()
+    if make_matrix:
+        if output_db:
+            output_env.close()
+        materialize(output_db or database, name, fasta_files)
     logging.info('Done complete_kmer_counter.count_kmers')
 
 
-def get_counts(files, database, name=constants.DEFAULT_NAME):
+def get_counts(files, database, name=constants.DEFAULT_NAME, dtype=None,
+               from_matrix=True, sparse=False):
     """
     Get the kmer counts for files stored in database under name.
 
     Args:
-        files (list):   The file to get the counts for.
-        database (str): File path to database.
-        name (str):     Identifier for the output in database.
+        files (list):       The file to get the counts for.
+        database (str):     File path to database.
+        name (str):         Identifier for the output in database.
+        dtype:              The dtype of the output, defaults to the dtype
+                            the output is stored in, see output_all.
+        from_matrix (bool): If True and the output has been materialized
+                            with materialize, the rows for files are read
+                            out of the memory mapped matrix instead of lmdb.
+        sparse (bool):      If True a scipy.sparse.csr_matrix is returned,
+                            it is built one genome at a time so the dense
+                            matrix is never held in memory.
 
     Returns:
-        output (ndarray):   An (n_samples, n_features) shape numpy array ready
-                            to be passed to a machine learning method.
+        output (ndarray):   An (n_samples, n_features) shape numpy array (or
+                            csr_matrix) ready to be passed to a machine
+                            learning method.
     """
     db_keys = make_db_keys(files)
 
@@ -483,10 +2331,73 @@ def get_counts(files, database, name=constants.DEFAULT_NAME):
         msg = 'Attempted to get counts from an uncreated database: {}'.format(database)
         raise(KmerCounterError(msg))
 
-    env = lmdb.open(database, map_size=160e10, max_dbs=4000, max_readers=1e7)
-    with env.begin(write=False) as txn:
-        arrays = []
-        for index, value in enumerate(db_keys):
+    matrix = load_matrix(database, name) if from_matrix else None
+    if matrix is not None:
+        counts, rows, kmers = matrix
+        if all(key in rows for key in db_keys):
+            index = [rows[key] for key in db_keys]
+            if sparse:
+                return to_csr((counts[x] for x in index), dtype)
+            return counts[index].astype(dtype or counts.dtype, copy=False)
+        logging.info('Not every genome is in the matrix, reading from lmdb')
+    return read_outputs(db_keys, database, name, dtype, sparse)
+
+
+def to_csr(rows, dtype=None):
+    """
+    Build a csr_matrix out of dense rows, keeping only the nonzero counts of
+    each row before the next one is read.
+
+    Args:
+        rows (iterable(ndarray)):   1D arrays of the same length.
+        dtype:                      The dtype of the output, defaults to the
+                                    dtype of the rows.
+
+    Returns:
+        scipy.sparse.csr_matrix: The rows stacked into a matrix.
+    """
+    indptr = [0]
+    indices = []
+    data = []
+    n_columns = 0
+    for row in rows:
+        n_columns = row.shape[0]
+        nonzero = np.flatnonzero(row)
+        indices.append(nonzero)
+        data.append(row[nonzero].astype(dtype or row.dtype))
+        indptr.append(indptr[-1] + nonzero.shape[0])
+    if not data:
+        return csr_matrix((0, 0), dtype=dtype or int)
+    return csr_matrix((np.concatenate(data), np.concatenate(indices), indptr),
+                      shape=(len(data), n_columns))
+
+
+def iter_outputs(db_keys, database, name=constants.DEFAULT_NAME):
+    """
+    Yield the output stored under name for each db key out of database, in
+    the dtype recorded for name by output_all. Each array is a view of the
+    database and is only valid until the next one is yielded.
+
+    Args:
+        db_keys (list): Identifiers of the genomes to read, see make_db_keys.
+        database (str): File path to database.
+        name (str):     Identifier for the output in database.
+
+    Returns:
+        generator(ndarray): The output of each genome.
+    """
+    shards = read_shards(database)
+    if shards:
+        for rows in zip(*[iter_outputs(db_keys, x, name) for x in shards]):
+            yield np.concatenate(rows)
+        return
+
+    env = environments.reader(database)
+    key = output_key(name, read_version(env))
+    dtype = read_dtype(env, name)[0] or np.dtype(int)
+    n_columns = None
+    with env.begin(write=False, buffers=True) as txn:
+        for value in db_keys:
 
             try:
                 current = env.open_db(value.encode(), txn=txn, create=False)
@@ -496,32 +2407,98 @@ def get_counts(files, database, name=constants.DEFAULT_NAME):
                 logging.exception(msg)
                 raise(KmerCounterError(msg))
 
-            results = txn.get(name.encode(), default=None, db=current)
+            results = txn.get(key, default=None, db=current)
             if results is None:
                 msg = 'Attempted to get counts for potentially invalid filter method:'
                 msg += ' {} for genome: {} in DB: {}'.format(name, value, database)
                 raise(KmerCounterError(msg))
 
-            results = np.fromstring(results, dtype='int')
-            arrays.append(results)
-        output = np.vstack(arrays)
-    env.close()
-    return output
+            results = np.frombuffer(results, dtype=dtype)
+            if n_columns is None:
+                n_columns = results.shape[0]
+            if results.shape[0] != n_columns:
+                msg = 'Output for genome: {} in DB: {} has {} kmers, expected {}'
+                msg = msg.format(value, database, results.shape[0], n_columns)
+                raise(KmerCounterError(msg))
+            yield results
 
 
-def get_kmer_names(database, name=constants.DEFAULT_NAME):
+def read_outputs(db_keys, database, name=constants.DEFAULT_NAME, dtype=None,
+                 sparse=False):
     """
-    Get the names of every kmer in the database.
+    Read the output stored under name for each db key out of database. The
+    stored arrays are read without copying them out of the database and into
+    the output, which is allocated once.
 
     Args:
-        database (str): Filepath to the database.
+        db_keys (list): Identifiers of the genomes to read, see make_db_keys.
+        database (str): File path to database.
         name (str):     Identifier for the output in database.
+        dtype:          The dtype of the output, defaults to the dtype the
+                        output is stored in.
+        sparse (bool):  If True return a csr_matrix, see get_counts.
+
+    Returns:
+        output (ndarray):   An (n_samples, n_features) shape numpy array.
+    """
+    rows = iter_outputs(db_keys, database, name)
+    if sparse:
+        return to_csr(rows, dtype)
+    output = np.array([], dtype=dtype or int)
+    for index, results in enumerate(rows):
+        if index == 0:
+            output = np.empty((len(db_keys), results.shape[0]),
+                              dtype=dtype or results.dtype)
+        output[index] = results
+    return output
+
+
+def get_kmer_names(database, name=constants.DEFAULT_NAME, from_matrix=True,
+                   packed=False):
+    """
+    Get the names of every kmer in the output.
+
+    Args:
+        database (str):     Filepath to the database.
+        name (str):         Identifier for the output in database.
+        from_matrix (bool): If True and the output has been materialized the
+                            names are read from the matrix's kmer index.
+        packed (bool):      If True the names are returned as uint64 codes,
+                            see kmer_names.
 
     Returns:
         output (ndarray):   A (n_features,) shape numpy array containing the names of
                             every kmer in the output.
     """
-    env = lmdb.open(database, map_size=160e10, max_dbs=4000, max_readers=1e7)
+    matrix = load_matrix(database, name) if from_matrix else None
+    if matrix is not None:
+        with open(os.path.join(matrix_path(database, name), 'manifest.json')) as f:
+            k = json.load(f)['k']
+        return kmer_names(matrix[2], k, packed)
+
+    kmers, k = read_names(database, name)
+    return kmer_names(kmers, k, packed)
+
+
+def read_names(database, name=constants.DEFAULT_NAME):
+    """
+    Read the kmers of the output stored under name out of database.
+
+    Args:
+        database (str):     Filepath to the database.
+        name (str):         Identifier for the output in database.
+
+    Returns:
+        tuple(ndarray, int): The kmers, as bytes or as codes (see
+                             decode_keys), and their length if it was
+                             recorded.
+    """
+    shards = read_shards(database)
+    if shards:
+        names = [read_names(x, name) for x in shards]
+        return np.concatenate([x[0] for x in names]), names[0][1]
+
+    env = environments.reader(database)
 
     try:
         db = env.open_db(name.encode(), create=False)
@@ -531,13 +2508,12 @@ def get_kmer_names(database, name=constants.DEFAULT_NAME):
         logging.exception(msg)
         raise(KmerCounterError(msg))
 
+    version = read_version(env)
+    k = read_k(env)
     with env.begin(write=False, db=db) as txn:
-        output = np.zeros(txn.stat()['entries'], dtype='<U64')
         with txn.cursor() as cursor:
-            for index, (key, value) in enumerate(cursor):
-                output[index] = key.decode()
-    env.close()
-    return output
+            keys = list(cursor.iternext(values=False))
+    return decode_keys(keys, version), k
 
 
 def get_global_counts(database):
@@ -551,7 +2527,11 @@ def get_global_counts(database):
         global counts (ndarray): The total number of times each kmer appears
                                  in the database
     """
-    env = lmdb.open(database, map_size=160e10, max_dbs=4000, max_readers=1e7)
+    shards = read_shards(database)
+    if shards:
+        return np.concatenate([get_global_counts(x) for x in shards])
+
+    env = environments.reader(database)
 
     try:
         db = env.open_db('global_counts'.encode(), create=False)
@@ -561,12 +2541,10 @@ def get_global_counts(database):
         logging.exception(msg)
         raise(KmerCounterError(msg))
 
+    version = read_version(env)
     with env.begin(write=False, db=db) as txn:
-        output = np.zeros(txn.stat()['entries'], dtype=int)
         with txn.cursor() as cursor:
-            for index, (key, value) in enumerate(cursor):
-                output[index] = int(value.decode())
-    env.close()
+            output = decode_counts(list(cursor.iternext(keys=False)), version)
     return output
 
 def get_file_counts(database):
@@ -579,7 +2557,11 @@ def get_file_counts(database):
     Returns:
         file counts (ndarray): The number of files each kmer appears in.
     """
-    env = lmdb.open(database, map_size=160e10, max_dbs=4000, max_readers=1e7)
+    shards = read_shards(database)
+    if shards:
+        return np.concatenate([get_file_counts(x) for x in shards])
+
+    env = environments.reader(database)
 
     try:
         db = env.open_db('file_counts'.encode(), create=False)
@@ -589,10 +2571,8 @@ def get_file_counts(database):
         logging.exception(msg)
         raise(KmerCounterError(msg))
 
+    version = read_version(env)
     with env.begin(write=False, db=db) as txn:
-        output = np.zeros(txn.stat()['entries'], dtype=int)
         with txn.cursor() as cursor:
-            for index, (key, value) in enumerate(cursor):
-                output[index] = int(value.decode())
-    env.close()
+            output = decode_counts(list(cursor.iternext(keys=False)), version)
     return output
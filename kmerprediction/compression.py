@@ -0,0 +1,126 @@
+"""
+Transparent reading of gzip, bgzip and zstandard compressed genomes.
+
+Compressed files are recognised by their first bytes rather than their suffix
+and are decompressed as they are read, the uncompressed genome is never
+written to disk. gzip and bgzip files (bgzip is a series of gzip members) are
+read with the gzip module. zstandard files are read with the zstandard package
+when it is installed, and through a zstd process otherwise.
+
+Every genome is decompressed by the worker process that counts it, and when
+jellyfish does the counting the decompressed genome is streamed into its
+stdin while it counts, see feed.
+"""
+
+import contextlib
+import gzip
+import io
+import shutil
+import subprocess
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Suffixes removed from a file name along with its own suffix, see
+# strip_suffix.
+SUFFIXES = ('.gz', '.bgz', '.zst')
+
+# Bytes decompressed at once while streaming a genome
+BLOCK_SIZE = 2 ** 20
+
+
+def compression(path):
+    """
+    Find out how a file is compressed.
+
+    Args:
+        path (str): The file to check.
+
+    Returns:
+        str: 'gzip', 'zstd' or None if the file is not compressed.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(ZSTD_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic == ZSTD_MAGIC:
+        return 'zstd'
+    return None
+
+
+@contextlib.contextmanager
+def open_genome(path):
+    """
+    Open a genome for reading whether or not it is compressed.
+
+    Args:
+        path (str): The fasta or fastq file, which may be compressed.
+
+    Returns:
+        file: A binary file that reads the decompressed genome, to be used
+              in a with statement.
+    """
+    method = compression(path)
+    if method == 'gzip':
+        with gzip.open(path, 'rb') as f:
+            yield f
+    elif method == 'zstd' and zstandard is not None:
+        with open(path, 'rb') as raw:
+            reader = zstandard.ZstdDecompressor().stream_reader(raw)
+            with io.BufferedReader(reader, BLOCK_SIZE) as f:
+                yield f
+    elif method == 'zstd':
+        p = subprocess.Popen(['zstd', '-dcq', str(path)],
+                             stdout=subprocess.PIPE, bufsize=BLOCK_SIZE)
+        try:
+            yield p.stdout
+        finally:
+            p.stdout.close()
+            p.wait()
+    else:
+        with open(path, 'rb') as f:
+            yield f
+
+
+def feed(path, stream):
+    """
+    Write the decompressed contents of a genome to stream and close it. Used
+    to stream a compressed genome into a counter that reads its stdin.
+
+    Args:
+        path (str):     The genome, see open_genome.
+        stream (file):  A binary file, such as the stdin of a process.
+
+    Returns:
+        None
+    """
+    try:
+        with open_genome(path) as f:
+            shutil.copyfileobj(f, stream, BLOCK_SIZE)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            stream.close()
+        except BrokenPipeError:
+            pass
+
+
+def strip_suffix(filename):
+    """
+    Remove a compression suffix from a file name.
+
+    Args:
+        filename (str): The file name.
+
+    Returns:
+        str: filename without .gz, .bgz or .zst.
+    """
+    for suffix in SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
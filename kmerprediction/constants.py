@@ -69,4 +69,93 @@ DEFAULT_NAME = 'complete_results'
 DEFAULT_K = 7
 DEFAULT_LIMIT = 13
 
+# kmer counting programs known to complete_kmer_counter and kmer_counter
+BACKENDS = ['jellyfish', 'native']
+DEFAULT_BACKEND = 'jellyfish'
+
+# number of bytes of jellyfish dump output parsed at once
+DUMP_CHUNK_SIZE = 2 ** 24
+
+# storage format of complete_kmer_counter databases, version 1 databases
+# store counts as ascii strings, version 2 as COUNT_DTYPE integers, version 3
+# also stores every kmer as its packed native_counter code
+DB_VERSION = 3
+COUNT_DTYPE = '<u8'
+
+# first version whose kmer keys are KEY_DTYPE codes, big endian so that lmdb
+# sorts the codes in the same (alphabetical) order as the kmers. Kmers longer
+# than native_counter.MAX_K are stored in the previous version.
+PACKED_VERSION = 3
+KEY_DTYPE = '>u8'
+
+# prefix of the key each output is stored under in a packed genome database,
+# makes the key longer than any packed kmer.
+OUTPUT_PREFIX = b'\xff' * 8
+
+# upper limit, in bytes, on the kmer counts that parser workers may hold in
+# memory before the single database writer has committed them
+MEMORY_BUDGET = 2 * 1024 ** 3
+
+# the writer commits the results of the worker processes every COMMIT_COUNT
+# results or COMMIT_SIZE bytes of results, and at most PENDING_PER_WORKER jobs
+# per worker are in flight at once, see pipeline.run
+COMMIT_COUNT = 64
+COMMIT_SIZE = 256 * 1024 ** 2
+PENDING_PER_WORKER = 2
+
+# largest number of bytes utils.check_fasta reads from the first line of a
+# file while deciding if it is fasta or fastq
+SNIFF_SIZE = 2 ** 16
+
+# drop the kmers seen only once when a genome is given as sequencing reads
+# (fastq), see read_filter
+FILTER_READS = True
+
+# directory of the cache of per genome kmer counts shared by every complete
+# database, see genome_cache, None to not cache counts
+GENOME_CACHE = None
+
+# total number of cores the kmer counters may use at once, None for all of
+# the cores on the machine
+CORES = None
+
+# dtypes the kmer count matrices may be stored in, the smallest one that holds
+# the largest count is used, see complete_kmer_counter.compact_dtype
+OUTPUT_DTYPES = ['uint8', 'uint16', 'uint32', 'uint64']
+
+# largest count stored in a kmer count matrix, larger counts are clamped to
+# it, None to keep every count
+SATURATE = None
+
+# lock the databases opened by the read APIs, see environments.reader. Only
+# needed if a database may be written by another process while it is read,
+# the reads made while a database is being built are always locked
+READ_LOCK = False
+
+# jellyfish hash size and lmdb map size used when the number of distinct kmers
+# can not be estimated, see cardinality.py, and the map size databases are
+# opened with before they are grown to fit their estimated size
+HASH_SIZE = '10M'
+MAP_SIZE = int(160e10)
+MIN_MAP_SIZE = 2 ** 26
+
+# file in a complete_kmer_counter database directory that caches the global
+# and file counts as numpy columns, see complete_kmer_counter.count_columns
+COLUMNS_FILE = 'count_columns.npz'
+
+# suffix of the directory inside an output database that holds the
+# materialized matrix for a filter name, see complete_kmer_counter.materialize
+MATRIX_SUFFIX = '_matrix'
+
+# number of shards a complete database is split into by kmer prefix, each
+# built by its own process, see complete_kmer_counter.count_sharded. None
+# keeps the whole database in one environment
+SHARDS = None
+
+# file in a sharded complete database directory that records the range of
+# kmer codes in each shard, and the number of leading bases the ranges are
+# split on
+SHARDS_FILE = 'shards.json'
+SHARD_PREFIX = 4
+
 LOG_DIRECTORY = './kmerprediction_logs/'
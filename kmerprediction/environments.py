@@ -0,0 +1,156 @@
+"""
+A process wide registry of read only lmdb environments.
+
+Opening a large database maps the whole file and, with locking, attaches to
+its reader table, which costs far more than reading a few outputs out of it.
+get_counts and get_kmer_names are called several times for every repetition
+of a model, so every read API opens its database through reader, which opens
+each database once per process and hands the same environment out again on
+later calls. The environments are closed when the process exits.
+
+Readers are opened without locking (see constants.READ_LOCK), which is only
+safe while no other process writes to the database. Reads that may overlap a
+writer, such as the output workers of complete_kmer_counter.output_all, ask
+for a locked environment instead. Writers in this process call release before
+opening a database for writing, and an environment is reopened whenever its
+data file has been written to or replaced since it was opened, a read only
+environment can not see pages past the end of its map. A writer that runs
+readers in its own process hands them its environment with hold, lmdb
+environments must not be opened twice in one process.
+
+Worker processes forked from a process that holds readers do not reuse the
+inherited environments, lmdb environments must not be shared across a fork,
+each worker opens its own instead.
+"""
+
+import atexit
+import logging
+import os
+import lmdb
+from kmerprediction import constants
+
+DATA_FILE = 'data.mdb'
+
+# Maps the real path of each database to its environment and the stamp of its
+# data file when it was opened, see data_stamp, and whether it was opened with
+# locking.
+_readers = {}
+
+# Maps the real path of each database written by this process to the writable
+# environment reader hands out for it, see hold.
+_writers = {}
+_owner = os.getpid()
+
+# Environments inherited across a fork, kept referenced so that they are never
+# closed by a process that does not own them.
+_inherited = []
+
+
+def data_stamp(path):
+    """
+    Identify the current contents of the data file of a database.
+
+    Args:
+        path (str): The database directory.
+
+    Returns:
+        tuple: The inode, size and modification time of the file, None if
+               the file does not exist.
+    """
+    try:
+        stat = os.stat(os.path.join(path, DATA_FILE))
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def reader(database, lock=None):
+    """
+    Get a shared read only environment for database, opening it if this
+    process has not opened it yet. Do not close the environment, use release.
+
+    Args:
+        database (str): Path to the lmdb database.
+        lock (bool):    If True the environment is opened with locking, so
+                        that it may be read while another process writes to
+                        it. Defaults to constants.READ_LOCK.
+
+    Returns:
+        lmdb.Environment: The environment, or the writable environment held
+                          for database by this process, see hold.
+    """
+    global _owner
+    if os.getpid() != _owner:
+        _inherited.extend(x[0] for x in _readers.values())
+        _inherited.extend(_writers.values())
+        _readers.clear()
+        _writers.clear()
+        _owner = os.getpid()
+
+    lock = constants.READ_LOCK if lock is None else lock
+    path = os.path.realpath(str(database))
+    if path in _writers:
+        return _writers[path]
+    stamp = data_stamp(path)
+    if path in _readers:
+        env, opened_stamp, locked = _readers[path]
+        if opened_stamp == stamp and (locked or not lock):
+            return env
+        if opened_stamp != stamp:
+            logging.info('{} has changed, reopening it'.format(path))
+        release(path)
+
+    env = lmdb.open(path, readonly=True, lock=lock, max_dbs=4000,
+                    max_readers=int(1e7))
+    _readers[path] = (env, stamp, lock)
+    return env
+
+
+def hold(database, env):
+    """
+    Hand env, a writable environment open on database in this process, to
+    every reader of database in this process until release is called. The
+    writer still owns env and closes it.
+
+    Args:
+        database (str):         Path to the lmdb database.
+        env (lmdb.Environment): The writable environment.
+
+    Returns:
+        None
+    """
+    release(database)
+    _writers[os.path.realpath(str(database))] = env
+
+
+def release(database):
+    """
+    Close the shared environment for database, if it is open. Call before
+    writing to database, or after removing it. An environment held with hold
+    is only let go of, not closed.
+
+    Args:
+        database (str): Path to the lmdb database.
+
+    Returns:
+        None
+    """
+    path = os.path.realpath(str(database))
+    if os.getpid() != _owner:
+        return
+    _writers.pop(path, None)
+    if path in _readers:
+        env = _readers.pop(path)[0]
+        env.close()
+
+
+@atexit.register
+def release_all():
+    """
+    Close every shared environment opened by this process.
+
+    Returns:
+        None
+    """
+    for path in list(_readers):
+        release(path)
@@ -0,0 +1,188 @@
+"""
+Sorted run files and a bounded memory k-way merge, used to build the global
+and file counts of a complete database without a read-modify-write of every
+kmer of every genome.
+
+Each genome is written to a run: two .npy files holding its kmers in sorted
+order and their counts. The existing counts of a database are spilled to a
+run the same way, with the number of files each kmer appears in, so adding
+genomes never needs the old counts in memory. The runs are memory mapped and merged a key range at
+a time, every step takes at most chunk_length kmers from each run so memory
+use is bounded by the memory budget no matter how large the runs are. Runs
+that do not fit in memory stay on disk and are paged in as they are merged.
+"""
+
+import os
+import numpy as np
+from kmerprediction import constants
+
+# Bytes used per merged kmer on top of the kmer itself: its count and file
+# count, the index and weights used to sum them, and the concatenated copy.
+ENTRY_OVERHEAD = 48
+
+
+def run_files(path):
+    """
+    Get the files a run is stored in.
+
+    Args:
+        path (str): Path the run was written to, without a suffix.
+
+    Returns:
+        tuple(str, str, str): The kmer, count and file count files.
+    """
+    return path + '.kmers.npy', path + '.counts.npy', path + '.files.npy'
+
+
+def write_run(path, kmers, counts, files=None):
+    """
+    Write kmers and their counts to a run. Kmers that are not sorted and
+    unique are sorted and their counts summed first.
+
+    Args:
+        path (str):         Path to write the run to, without a suffix.
+        kmers (ndarray):    The kmers, as bytes or as codes.
+        counts (ndarray):   The count of each kmer.
+        files (ndarray):    The number of files each kmer appears in, only
+                            stored if given.
+
+    Returns:
+        str: path
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    if kmers.shape[0] > 1 and not np.all(kmers[1:] > kmers[:-1]):
+        kmers, index = np.unique(kmers, return_inverse=True)
+        index = index.ravel()
+        counts = np.bincount(index, weights=counts,
+                             minlength=len(kmers)).astype(np.int64)
+        if files is not None:
+            files = np.bincount(index, weights=files,
+                                minlength=len(kmers)).astype(np.int64)
+    kmer_file, count_file, file_file = run_files(path)
+    np.save(kmer_file, kmers)
+    np.save(count_file, counts)
+    if files is not None:
+        np.save(file_file, np.asarray(files, dtype=np.int64))
+    return path
+
+
+def create_run(path, length, dtype, files=False):
+    """
+    Create an empty run to be filled in place, for runs that are too large to
+    build in memory. The kmers must be written in sorted order.
+
+    Args:
+        path (str):     Path to write the run to, without a suffix.
+        length (int):   The number of kmers in the run.
+        dtype:          The dtype of the kmers.
+        files (bool):   If True the run also stores file counts.
+
+    Returns:
+        tuple(ndarray): Writable memory maps of the kmers, the counts and, if
+                        files is True, the file counts.
+    """
+    paths = run_files(path)[:3 if files else 2]
+    dtypes = [dtype, np.int64, np.int64]
+    return tuple(np.lib.format.open_memmap(x, mode='w+', dtype=dtypes[i],
+                                           shape=(length,))
+                 for i, x in enumerate(paths))
+
+
+def read_run(path, files=1):
+    """
+    Memory map a run written by write_run or create_run.
+
+    Args:
+        path (str):     Path the run was written to, without a suffix.
+        files (int):    The file count of every kmer, used if the run does
+                        not store file counts.
+
+    Returns:
+        tuple(ndarray, ndarray, ndarray or int): The sorted kmers, their
+                                                 counts and their file counts,
+                                                 ready for merge_runs.
+    """
+    kmer_file, count_file, file_file = run_files(path)
+    if os.path.exists(file_file):
+        files = np.load(file_file, mmap_mode='r')
+    return (np.load(kmer_file, mmap_mode='r'),
+            np.load(count_file, mmap_mode='r'), files)
+
+
+def chunk_length(memory_budget, runs, itemsize):
+    """
+    Decide how many kmers to take from each run at once.
+
+    Args:
+        memory_budget (int):    Bytes that may be used by one merge step.
+        runs (int):             The number of runs being merged.
+        itemsize (int):         Bytes per kmer.
+
+    Returns:
+        int: The number of kmers.
+    """
+    return max(1, memory_budget // (max(runs, 1) * (itemsize + ENTRY_OVERHEAD)))
+
+
+def merge_runs(runs, memory_budget=constants.MEMORY_BUDGET):
+    """
+    Merge sorted runs into one sorted sequence of unique kmers with their
+    total count and the number of runs (files) they appear in.
+
+    Each step finds the smallest of the kmers chunk_length past the current
+    position of every run, and takes every kmer up to it from each run. No run
+    can give more than chunk_length kmers to a step, and every kmer is
+    complete when it is yielded.
+
+    Args:
+        runs (list(tuple)):     (kmers, counts, files) for every run. kmers
+                                are sorted and unique, files is the number of
+                                files each kmer appears in, an array or a
+                                single number for every kmer in the run.
+        memory_budget (int):    Bytes that may be used by one merge step.
+
+    Returns:
+        generator(tuple(ndarray, ndarray, ndarray)): Consecutive chunks of the
+                                                     merged kmers, their
+                                                     counts and their file
+                                                     counts.
+    """
+    runs = [run for run in runs if run[0].shape[0]]
+    if not runs:
+        return
+    itemsize = max(run[0].dtype.itemsize for run in runs)
+    chunk = chunk_length(memory_budget, len(runs), itemsize)
+    positions = [0] * len(runs)
+    while True:
+        active = [i for i, run in enumerate(runs)
+                  if positions[i] < run[0].shape[0]]
+        if not active:
+            break
+        boundary = min(runs[i][0][min(positions[i] + chunk,
+                                      runs[i][0].shape[0]) - 1]
+                       for i in active)
+
+        kmers = []
+        counts = []
+        files = []
+        for i in active:
+            run_kmers, run_counts, run_file_counts = runs[i]
+            start = positions[i]
+            window = run_kmers[start:start + chunk]
+            end = start + np.searchsorted(window, boundary, side='right')
+            positions[i] = end
+            kmers.append(np.asarray(run_kmers[start:end]))
+            counts.append(np.asarray(run_counts[start:end]))
+            if np.ndim(run_file_counts):
+                files.append(np.asarray(run_file_counts[start:end]))
+            else:
+                files.append(np.full(end - start, run_file_counts,
+                                     dtype=np.int64))
+
+        kmers, index = np.unique(np.concatenate(kmers), return_inverse=True)
+        index = index.ravel()
+        counts = np.bincount(index, weights=np.concatenate(counts),
+                             minlength=len(kmers)).astype(np.int64)
+        files = np.bincount(index, weights=np.concatenate(files),
+                            minlength=len(kmers)).astype(np.int64)
+        yield kmers, counts, files
@@ -7,7 +7,8 @@ x_train and x_test scaled according to the specifications of the method and it's
 given parameters.
 """
 
-from sklearn.preprocessing import MinMaxScaler
+from sklearn.preprocessing import MinMaxScaler, MaxAbsScaler
+from scipy.sparse import issparse
 import numpy as np
 
 
@@ -15,6 +16,12 @@ def scale_to_range(input_data, low=-1, high=1):
     """
     Scales the features in x_train and x_test to lie within the range low, high
 
+    Shifting a feature so that its minimum becomes low would fill in every zero
+    of a sparse matrix, so if x_train is a scipy sparse matrix each feature is
+    instead divided by its largest absolute value in x_train and multiplied by
+    max(abs(low), abs(high)). Zeros stay zero and the kmer counts, which are
+    never negative, lie within 0, max(abs(low), abs(high)).
+
     Args:
         input_data (tuple): x_train, y_train, x_test, y_test
         low (int):          The lower limit to scale the data to lie within.
@@ -23,6 +30,14 @@ def scale_to_range(input_data, low=-1, high=1):
     Returns:
         tuple: x_train, y_train, x_test, y_test
     """
+    if issparse(input_data[0]):
+        scaler = MaxAbsScaler()
+        x_train = scaler.fit_transform(input_data[0].astype('float64'))
+        x_test = scaler.transform(input_data[2].astype('float64'))
+        limit = max(abs(low), abs(high))
+        return (x_train * limit, np.asarray(input_data[1]), x_test * limit,
+                np.asarray(input_data[3]))
+
     x_train = np.asarray(input_data[0], dtype='float64')
     y_train = np.asarray(input_data[1])
     x_test = np.asarray(input_data[2], dtype='float64')
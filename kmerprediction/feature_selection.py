@@ -18,6 +18,8 @@ from sklearn.feature_selection import VarianceThreshold, SelectKBest, chi2
 from sklearn.feature_selection import SelectPercentile, f_classif, RFE, RFECV
 from sklearn.feature_selection import SelectFdr
 from sklearn.svm import SVC
+from sklearn.utils.sparsefuncs import mean_variance_axis
+from scipy.sparse import issparse
 from kmerprediction.utils import flatten, make3D
 import pandas as pd
 import numpy as np
@@ -109,7 +111,8 @@ def variance_threshold(input_data, feature_names, threshold=0.16):
     Removes all features from x_train and x_test whose variances in x_train is
     less than threshold. Uses scikit-learn's VarianceThreshold If feature_names
     is given it is also returned with any features removed from x_train and
-    x_test also removed from feature_names.
+    x_test also removed from feature_names. x_train and x_test may be scipy
+    sparse matrices.
 
     Args:
         input_data (tuple):     x_train, y_train, x_test, y_test
@@ -151,6 +154,9 @@ def remove_constant(input_data, feature_names):
     x_train. If feature_names is given it is also returned with any
     features removed from x_train and x_test also removed from feature_names.
 
+    If x_train is a scipy sparse matrix the variances are computed from its
+    nonzero values and x_train and x_test are returned sparse.
+
     Args:
         input_data (tuple):     x_train, y_train, x_test, y_test
         feature_names (list):   The names of all features before selection or
@@ -159,6 +165,16 @@ def remove_constant(input_data, feature_names):
     Returns:
         tuple: (x_train, y_train, x_test, y_test), feature_names, input_args
     """
+    if issparse(input_data[0]):
+        x_train = input_data[0].tocsr()
+        _, variances = mean_variance_axis(x_train.astype('float64'), axis=0)
+        keep = np.flatnonzero(variances != 0.0)
+        output_data = (x_train[:, keep], input_data[1],
+                       input_data[2].tocsr()[:, keep], input_data[3])
+        if feature_names is not None:
+            feature_names = feature_names[keep]
+        return output_data, feature_names, {}
+
     x_train = pd.DataFrame(input_data[0])
     x_train = x_train.loc[:, x_train.var() != 0.0]
     x_test = pd.DataFrame(input_data[2])
@@ -179,7 +195,7 @@ def select_k_best(input_data, feature_names, score_func=f_classif, k=500):
     x_test. Selects the best features by using the score function score_func
     and scikit-learn's SelectKBest. If feature_names is given it is also
     returned with any features removed from x_train and x_test also removed from
-    feature_names.
+    feature_names. x_train and x_test may be scipy sparse matrices.
 
     Args:
         input_data (tuple):     x_train, y_train, x_test, y_test
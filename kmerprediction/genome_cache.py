@@ -0,0 +1,192 @@
+"""
+A content addressed cache of the kmer counts of each genome.
+
+Genomes are identified by the sha256 digest of their file, so the same genome
+stored under different names or directories is only counted once for each
+length of kmer, and a file whose contents change is never matched with its old
+counts. Every entry is an external_sort run named after the digest and k.
+
+Hashing a genome costs a full read of the file, so the size and modification
+time of every file that has been hashed is kept in an index, and a file is
+only hashed again when either changes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from kmerprediction import external_sort
+
+INDEX_FILE = 'index.json'
+
+# Bytes of a file read at once while hashing it
+READ_SIZE = 2 ** 20
+
+
+def file_digest(path):
+    """
+    Hash the contents of a file.
+
+    Args:
+        path (str): The file to hash.
+
+    Returns:
+        str: The hex sha256 digest of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def describe(path, known=None):
+    """
+    Get the size, modification time and digest of a file. The digest in known
+    is reused if it was recorded for the same file with the same size and
+    modification time.
+
+    Args:
+        path (str):     The file to describe.
+        known (dict):   A previous description of the file, or None.
+
+    Returns:
+        dict: The 'path', 'size', 'mtime' and 'digest' of the file.
+    """
+    stat = os.stat(path)
+    record = {'path': os.path.realpath(path), 'size': stat.st_size,
+              'mtime': stat.st_mtime_ns}
+    if known and all(known.get(x) == record[x] for x in record):
+        record['digest'] = known['digest']
+    else:
+        record['digest'] = file_digest(path)
+    return record
+
+
+def read_index(cache):
+    """
+    Read the descriptions of every file hashed into cache.
+
+    Args:
+        cache (str):    The cache directory.
+
+    Returns:
+        dict: Maps the real path of each file to its description.
+    """
+    try:
+        with open(os.path.join(cache, INDEX_FILE)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_index(cache, index):
+    """
+    Replace the index of cache, the index is written to a temporary file
+    first so that readers never see a partial index.
+
+    Args:
+        cache (str):    The cache directory.
+        index (dict):   See read_index.
+
+    Returns:
+        None
+    """
+    handle, temp_file = tempfile.mkstemp(dir=cache)
+    with os.fdopen(handle, 'w') as f:
+        json.dump(index, f)
+    os.replace(temp_file, os.path.join(cache, INDEX_FILE))
+
+
+def describe_all(files, cache=None, known=None):
+    """
+    Describe every file, reusing the digests recorded in known and in the
+    index of cache, and add the descriptions to the index.
+
+    Args:
+        files (list(str)):  The files to describe.
+        cache (str):        The cache directory, or None.
+        known (dict):       Maps files to previous descriptions of them.
+
+    Returns:
+        dict: Maps each file to its description, see describe.
+    """
+    known = known or {}
+    index = {}
+    if cache:
+        if not os.path.exists(cache):
+            os.makedirs(cache)
+        index = read_index(cache)
+    records = {}
+    for f in files:
+        previous = known.get(f)
+        if not previous or previous.get('path') != os.path.realpath(f):
+            previous = index.get(os.path.realpath(f))
+        records[f] = describe(f, previous)
+        index[records[f]['path']] = records[f]
+    if cache:
+        write_index(cache, index)
+    return records
+
+
+def entry_path(cache, digest, k):
+    """
+    Get the path of the run holding the counts of a genome.
+
+    Args:
+        cache (str):    The cache directory.
+        digest (str):   The digest of the genome's file.
+        k (int):        The length of kmer.
+
+    Returns:
+        str: The path, see external_sort.read_run.
+    """
+    return os.path.join(cache, '{}-k{}'.format(digest, k))
+
+
+def load(cache, digest, k):
+    """
+    Get the cached counts of a genome.
+
+    Args:
+        cache (str):    The cache directory.
+        digest (str):   The digest of the genome's file.
+        k (int):        The length of kmer.
+
+    Returns:
+        tuple(ndarray, ndarray): The sorted kmers and their counts, None if
+                                 the genome is not in the cache.
+    """
+    path = entry_path(cache, digest, k)
+    if not os.path.exists(external_sort.run_files(path)[0]):
+        return None
+    kmers, counts, _ = external_sort.read_run(path)
+    logging.info('Found {}-mer counts for {} in {}'.format(k, digest, cache))
+    return kmers, counts
+
+
+def store(cache, digest, k, kmers, counts):
+    """
+    Add the counts of a genome to the cache. The run is written under a
+    temporary name and renamed, so that processes adding the same genome at
+    once can not leave a partial entry.
+
+    Args:
+        cache (str):        The cache directory.
+        digest (str):       The digest of the genome's file.
+        k (int):            The length of kmer.
+        kmers (ndarray):    The kmers, as bytes or as codes.
+        counts (ndarray):   The count of each kmer.
+
+    Returns:
+        None
+    """
+    temp_dir = tempfile.mkdtemp(dir=cache)
+    temp_path = external_sort.write_run(os.path.join(temp_dir, 'run'), kmers,
+                                        counts)
+    final = external_sort.run_files(entry_path(cache, digest, k))
+    # the counts are moved first, load only trusts entries whose kmers exist
+    os.replace(external_sort.run_files(temp_path)[1], final[1])
+    os.replace(external_sort.run_files(temp_path)[0], final[0])
+    os.rmdir(temp_dir)
@@ -35,7 +35,7 @@ from kmerprediction import constants
 
 def get_kmer(metadata_kwargs=None, kmer_kwargs=None, recount=False,
              database=constants.DEFAULT_DB, validate=True,
-             complete_count=True):
+             complete_count=True, sparse=False):
     """
     Get kmer data for genomes specified in kwargs, uses kmer_counter and
     utils.parse_metadata
@@ -49,6 +49,14 @@ def get_kmer(metadata_kwargs=None, kmer_kwargs=None, recount=False,
         L (int):         kmer cutoff value. Ignored if recount is false
         validate (bool): If True y_test is created, if False y_test is
                          an empty ndarray.
+        sparse (bool):   If True x_train and x_test are
+                         scipy.sparse.csr_matrix instead of ndarrays, see
+                         feature_selection and feature_scaling for the
+                         methods that accept them.
+
+    The feature_names are packed kmer codes, they are decoded by the models
+    when feature importances are reported, see
+    native_counter.unpack_names.
 
     Returns:
         tuple:  (x_train, y_train, x_test, y_test), feature_names, file_names,
@@ -77,20 +85,25 @@ def get_kmer(metadata_kwargs=None, kmer_kwargs=None, recount=False,
     test_files = [str(x) for x in x_test]
     all_files = x_train + x_test
 
+    train_counts = None
     if recount:
         counter.count_kmers(all_files, database, **kmer_kwargs, force=True)
     else:
         try:
-            temp = counter.get_counts(x_train, output_db, name)
+            train_counts = counter.get_counts(x_train, output_db, name,
+                                              sparse=sparse)
         except KmerCounterError as e:
             msg = 'Warning: get_counts failed, attempting a recount'
             logging.exception(msg)
             counter.count_kmers(all_files, database, **kmer_kwargs)
 
-    x_train = counter.get_counts(x_train, output_db, name)
-    x_test = counter.get_counts(x_test, output_db, name)
+    if train_counts is None:
+        train_counts = counter.get_counts(x_train, output_db, name,
+                                          sparse=sparse)
+    x_train = train_counts
+    x_test = counter.get_counts(x_test, output_db, name, sparse=sparse)
 
-    feature_names = counter.get_kmer_names(output_db, name)
+    feature_names = counter.get_kmer_names(output_db, name, packed=True)
 
     y_train, y_test, le = encode_labels(y_train, y_test)
 
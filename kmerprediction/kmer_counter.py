@@ -14,191 +14,503 @@ import sys
 import os
 import lmdb
 import numpy as np
+from kmerprediction import cardinality
 from kmerprediction import constants
-from kmerprediction.complete_kmer_counter import KmerCounterError
+from kmerprediction import environments
+from kmerprediction import pipeline
+from kmerprediction import native_counter
+from kmerprediction import read_filter
+from kmerprediction.complete_kmer_counter import KmerCounterError, check_backend
+from kmerprediction.complete_kmer_counter import count_genome, grow_map
+from kmerprediction.complete_kmer_counter import size_database, to_csr
+from kmerprediction.complete_kmer_counter import kmer_names, compact_dtype
+from kmerprediction.complete_kmer_counter import read_dtype, write_dtype
+from kmerprediction.complete_kmer_counter import record_sizes
 import logging
-import tempfile
-from threading import Thread
 
-def count_file(input_file, output_file, k, limit):
-    handle, jf_file = tempfile.mkstemp()
-    args = ['jellyfish', 'count', '-m', '%d' % k, '-s', '10M', '-t', '30',
-            '-C', str(input_file), '-o', str(jf_file), '-L', '%d' % limit]
-    p = subprocess.Popen(args, bufsize=-1)
-    p.communicate()
+def count_sorted(input_file, k, limit=None, backend=constants.DEFAULT_BACKEND,
+                 threads=None, size=None):
+    """
+    Count the kmers in input_file and sort them, so that they can be merged
+    with the kmers of other genomes, see merge_shared.
 
-    args = ['jellyfish', 'dump', '-c', '-t', str(jf_file), '-o', str(output_file)]
-    p = subprocess.Popen(args, bufsize=-1)
-    p.communicate()
+    Args:
+        input_file (str):   Fasta file to perform a kmer count on.
+        k (int):            The length of kmer to count.
+        limit (int):        Minimum frequency of kmer count to be output.
+        backend (str):      The kmer counter to use.
+        threads (int):      Number of threads jellyfish may use.
+        size (str):         Jellyfish hash size.
 
-    os.remove(jf_file)
-    logging.info('Counted kmers for {}'.format(input_file))
+    Returns:
+        tuple(ndarray, ndarray): The sorted kmers as bytes and their counts.
+    """
+    kmers, counts = count_genome(input_file, k, limit, backend, threads, size)
+    if backend != 'native':
+        order = np.argsort(kmers)
+        kmers = kmers[order]
+        counts = counts[order]
+    return kmers, counts
 
 
-def start(input_file, k, limit, env, txn, master):
+def read_sorted(filename, env, txn):
     """
-    Performs a kmer count on filename, counting kmers with a length of k and
-    removing any kmer that has a count less than limit. Resets the master
-    database data and then writes each kmer as a key with value -1 to data.
-    Creates a new database called filename, writes each kmer/count pair to the
-    new database as a key value pair.
+    Read the kmer counts already stored for filename, lmdb returns them
+    sorted.
 
     Args:
-        filename (str):             Fasta file to perform a kmer count on
-        k (int):                    The length of kmer to count
-        limit (int):                Minimum frequency of kmer count to be
-                                    output
+        filename (str):         Fasta file whose counts to read.
         env (lmdb.Environment):
         txn (lmdb.Transaction):
-        data (Environment handle):
 
     Returns:
-        None
+        tuple(ndarray, ndarray): The sorted kmers as bytes and their counts.
     """
-    handle, temp_file = tempfile.mkstemp()
-    count_file(input_file, temp_file, k, limit)
+    current = env.open_db(filename.encode(), txn=txn, create=False)
+    with txn.cursor(db=current) as cursor:
+        items = list(cursor.iternext())
+    if not items:
+        return np.array([], dtype='S1'), np.array([], dtype=np.int64)
+    kmers, counts = zip(*items)
+    return np.array(kmers, dtype='S'), np.array(counts).astype(np.int64)
 
-    current = env.open_db(input_file.encode(), txn=txn)
-    txn.drop(master, delete=False)
 
-    with open(temp_file, 'r') as f:
-        for line in f:
-            kmer = line.split()[0].encode()
-            count = str(line.split()[1]).encode()
-            txn.put(kmer, count, db=current)
-            txn.put(kmer, '-1'.encode(), db=master)
-    os.remove(temp_file)
+def merge_shared(shared, filename, kmers, counts):
+    """
+    Intersect the kmers of filename with the kmers shared by every genome
+    merged so far. Both are sorted, so the intersection is a single
+    np.searchsorted merge and only the counts of kmers that are still shared
+    are kept.
 
+    Args:
+        shared (dict):      'kmers' holds the sorted shared kmers (None
+                            before the first genome) and 'counts' maps each
+                            merged filename to the counts of those kmers.
+        filename (str):     Fasta file the kmers were counted from.
+        kmers (ndarray):    The sorted kmers of filename, as bytes.
+        counts (ndarray):   The count of each kmer.
 
-def firstpass(filename, k, limit, env, master):
+    Returns:
+        None
     """
-    Performs a kmer count on filename, counting kmers with a length of k and
-    removing any kmer that has a count less than limit. Creates a new database
-    called filename and writes each kmer/count pair from the kmer count to the
-    new database. Only writes kmers that are already present in the master
-    database that txn points to. Removes any kmer from the master database that
-    is not present in filename.
+    if shared['kmers'] is None:
+        shared['kmers'] = kmers
+        shared['counts'][filename] = counts
+        return
+
+    index = np.searchsorted(kmers, shared['kmers'])
+    index = np.minimum(index, max(len(kmers) - 1, 0))
+    if len(kmers):
+        found = kmers[index] == shared['kmers']
+    else:
+        found = np.zeros(len(shared['kmers']), dtype=bool)
+    shared['kmers'] = shared['kmers'][found]
+    for key in shared['counts']:
+        shared['counts'][key] = shared['counts'][key][found]
+    shared['counts'][filename] = counts[index[found]]
+
+
+def write_shared(shared, env, master, saturate=None):
+    """
+    Replace the master database and the database of every merged genome
+    with the shared kmers and their counts, in one write transaction. The
+    smallest dtype that holds the largest count is recorded, get_counts
+    returns the counts in it.
 
     Args:
-        filename (str):         Fasta file to perform a kmer count on.
-        k (int):                Length of kmer to count.
-        limit (int):            Minimum frequency of kmer to be output.
+        shared (dict):              See merge_shared.
         env (lmdb.Environment):
-        txn (lmdb.Transaction):
+        master (Environment handle):
+        saturate (int):             get_counts returns counts larger than
+                                    saturate as saturate, None to return
+                                    every count.
 
     Returns:
         None
     """
-    handle, temp_file = tempfile.mkstemp()
-    count_file(filename, temp_file, k, limit)
+    keys = [] if shared['kmers'] is None else shared['kmers'].tolist()
+    with env.begin(write=True) as txn:
+        txn.drop(master, delete=False)
+        with txn.cursor(db=master) as cursor:
+            cursor.putmulti(zip(keys, ['-1'.encode()] * len(keys)), append=True)
+        for filename, counts in shared['counts'].items():
+            current = env.open_db(filename.encode(), txn=txn)
+            txn.drop(current, delete=False)
+            values = [str(x).encode() for x in counts.tolist()]
+            with txn.cursor(db=current) as cursor:
+                cursor.putmulti(zip(keys, values), append=True)
+    max_count = max([int(x.max()) for x in shared['counts'].values() if len(x)]
+                    or [0])
+    write_dtype(env, compact_dtype(max_count, saturate), saturate)
+    logging.info('Stored {} shared kmers'.format(len(keys)))
+
+
+def read_limit(env):
+    """
+    Get the limit the counts in env were made with, every stored count is
+    at least this large.
 
-    current = env.open_db(filename.encode())
+    Args:
+        env (lmdb.Environment):
 
-    with env.begin(write=True, db=master) as txn:
-        txn.drop(current, delete=False)
-        with open(temp_file, 'r') as f:
-            for line in f:
-                kmer = line.split()[0].encode()
-                count = str(line.split()[1]).encode()
-                if txn.get(kmer, default=False, db=master):
-                    txn.put(kmer, count, db=master)
-                    txn.put(kmer, count, db=current)
+    Returns:
+        int: The limit, None if it was never recorded.
+    """
+    try:
+        metadata = env.open_db('metadata'.encode(), create=False)
+    except lmdb.NotFoundError:
+        return None
+    with env.begin(write=False, db=metadata) as txn:
+        limit = txn.get('limit'.encode())
+    return None if limit is None else int(limit)
 
-        with txn.cursor(db=master) as cursor:
-            for key, value in cursor:
-                if value == '-1'.encode():
-                    txn.delete(key)
-                else:
-                    txn.put(key, '-1'.encode())
 
-    os.remove(temp_file)
-    logging.info('Counted kmers for {}'.format(filename))
+def write_limit(env, limit):
+    """
+    Record the limit counts were added to env with. When genomes counted with
+    different limits share a database the largest limit is kept, since only
+    cutoffs at least that large can be derived from it exactly, see
+    derive_limit.
+
+    Args:
+        env (lmdb.Environment):
+        limit (int):            The limit the counts were made with.
+
+    Returns:
+        None
+    """
+    recorded = read_limit(env)
+    limit = max(limit or 0, recorded or 0)
+    metadata = env.open_db('metadata'.encode())
+    with env.begin(write=True, db=metadata) as txn:
+        txn.put('limit'.encode(), str(limit).encode())
 
 
-def secondpass(filename, env, master):
+def derive_limit(files, database, output, limit):
     """
-    Removes every kmer from the database named filename that is not present in
-    the master database.
+    Make the database count_kmers would make for files with a larger limit,
+    from the counts already stored in database. A kmer that appears at least
+    limit times in every genome was also shared at the smaller limit the
+    database was counted with, so filtering each genome's stored counts and
+    intersecting them again gives the same kmers and counts without reading
+    any fasta file.
 
     Args:
-        filename (str):         Fasta file to perform a kmer count on.
-        k (int):                Length of kmer to count.
-        env (lmdb.Environment):
-        txn (lmdb.Transaction):
+        files (list(str)):  The fasta files to keep, they must already be
+                            counted in database.
+        database (str):     Database made by count_kmers.
+        output (str):       Database to store the counts with the new limit
+                            in, use get_counts on it as usual.
+        limit (int):        Minimum frequency for a kmer to be output, at
+                            least the limit database was counted with.
 
     Returns:
         None
     """
-    current = env.open_db(filename.encode())
-    with env.begin(write=True, db=master) as txn:
-        with txn.cursor(db=current) as cursor:
-            for key, val in cursor:
-                if not txn.get(key, default=False, db=master):
-                    txn.delete(key, val, db=current)
-    logging.info('Remove missing kmers from {}'.format(filename))
+    if not os.path.exists(database):
+        msg = 'Attempted to derive counts from an uncreated database:'
+        msg += ' {}'.format(database)
+        raise(KmerCounterError(msg))
+
+    env = environments.reader(database)
+    recorded = read_limit(env)
+    if recorded is not None and limit < recorded:
+        msg = 'Can not derive a limit of {} from {}, it was counted with a'
+        msg += ' limit of {}'
+        raise(KmerCounterError(msg.format(limit, database, recorded)))
+    if recorded is None:
+        logging.warning('{} does not record its limit'.format(database))
+    saturate = read_dtype(env)[1]
+
+    shared = {'kmers': None, 'counts': {}}
+    with env.begin(write=False) as txn:
+        for filename in files:
+            if not txn.get(filename.encode(), default=False):
+                msg = 'Attempted to derive counts for an uncounted genome:'
+                msg += ' {} in DB: {}'.format(filename, database)
+                raise(KmerCounterError(msg))
+            kmers, counts = read_sorted(filename, env, txn)
+            keep = counts >= limit
+            merge_shared(shared, filename, kmers[keep], counts[keep])
+    used = (env.info()['last_pgno'] + 1) * env.stat()['psize']
+
+    environments.release(output)
+    output_env = lmdb.open(str(output), map_size=constants.MIN_MAP_SIZE,
+                           max_dbs=4000)
+    grow_map(output_env, used)
+    master = output_env.open_db('master'.encode(), dupsort=False)
+    write_shared(shared, output_env, master, saturate)
+    write_limit(output_env, limit)
+    output_env.close()
+    logging.info('Derived {} with a limit of {}'.format(output, limit))
 
 
 def count_kmers(files, database, k=constants.DEFAULT_K,
-                limit=constants.DEFAULT_LIMIT, force=False):
+                limit=constants.DEFAULT_LIMIT, force=False,
+                backend=constants.DEFAULT_BACKEND, workers=None,
+                memory_budget=constants.MEMORY_BUDGET, cores=constants.CORES,
+                sizing=True, saturate=constants.SATURATE):
     """
     Counts all kmers of length "k" in the fasta files "files", removing any
     that appear fewer than "limit" times. Stores the output in a lmdb database
     named "database".
 
+    Each genome is counted and sorted by a pool of worker processes and merged
+    into the kmers shared by every genome as soon as it finishes. The
+    database is only written once, with the shared kmers and the count of
+    each in every genome. The limit is recorded so that databases with larger
+    limits can be made from this one without counting again, see
+    derive_limit.
+
     Args:
-        k (int):            The length of kmer to count.
-        limit (int):        Minimum frequency for a kmer to be output.
-        files (list(str)):  The fasta files to count kmers from.
-        database (str):     Name of database where the counts will be stored.
-        force (bool):       If True all files are recounted, if False only
-                            that do not already appear in the database are
-                            recounted.
+        k (int):             The length of kmer to count.
+        limit (int):         Minimum frequency for a kmer to be output.
+        files (list(str)):   The fasta files to count kmers from.
+        database (str):      Name of database where the counts will be stored.
+        force (bool):        If True all files are recounted, if False only
+                             that do not already appear in the database are
+                             recounted.
+        backend (str):       'jellyfish' to count kmers with the jellyfish
+                             program, 'native' to count them in process with
+                             native_counter.
+        workers (int):       Number of worker processes that count kmers,
+                             chosen from cores if not given.
+        memory_budget (int): Upper limit, in bytes, on the kmer counts held by
+                             the workers that are waiting to be merged.
+        cores (int):         Total number of cores to use, split between the
+                             genomes counted at once and the threads each
+                             jellyfish process gets. Defaults to every core.
+        sizing (bool):       If True the number of distinct kmers in each
+                             genome is estimated and used to size jellyfish's
+                             hash and the database, see
+                             complete_kmer_counter.size_database.
+        saturate (int):      get_counts returns counts larger than saturate
+                             as saturate, so they fit in a smaller dtype. None
+                             to return every count.
 
     Returns:
         None
     """
     logging.info('Begin kmer_counter.count_kmers')
-    env = lmdb.open(str(database), map_size=int(160e9), max_dbs=4000)
+    check_backend(backend)
+    environments.release(database)
+    env = lmdb.open(str(database), map_size=constants.MIN_MAP_SIZE, max_dbs=4000)
     master = env.open_db('master'.encode(), dupsort=False)
+    if sizing:
+        hash_sizes = size_database(files, files, k, env, force, outputs=False,
+                                   workers=workers, cores=cores)
+    else:
+        hash_sizes = {}
+        grow_map(env, constants.MAP_SIZE)
 
-    recounts = []
-    with env.begin(write=True, db=master) as txn:
-        logging.info('Begin counting kmers')
-        if force or not txn.get(files[0].encode(), default=False):
-            start(files[0], k, limit, env, txn, master)
-            recounts.append(files[0])
-
-    threads = []
-    for filename in files[1:]:
-        with env.begin(write=False) as txn:
+    shared = {'kmers': None, 'counts': {}}
+    jobs = []
+    with env.begin(write=False) as txn:
+        for filename in files:
             if force or not txn.get(filename.encode(), default=False):
-                args = [filename, k, limit, env, master]
-                threads.append(Thread(target=firstpass, args=args))
-                recounts.append(filename)
-    for t in threads:
-        t.start()
-    for t in threads:
-        t.join()
+                jobs.append((filename, k, limit, backend))
+            else:
+                kmers, counts = read_sorted(filename, env, txn)
+                merge_shared(shared, filename, kmers, counts)
+
+    def merge(job, result):
+        merge_shared(shared, job[0], result[0], result[1])
+        logging.info('Counted kmers for {}'.format(job[0]))
+
+    logging.info('Begin counting kmers')
+    workers, threads = pipeline.schedule(len(jobs), cores, workers)
+    jobs = [job + (threads, hash_sizes.get(job[0])) for job in jobs]
+    pipeline.run(jobs, count_sorted, merge, workers, memory_budget)
     logging.info('Done counting kmers')
 
-    logging.info('Begin removing missing kmers')
-    threads = []
-    for filename in files[::-1]:
-        with env.begin(write=False) as txn:
-            if force or filename in recounts:
-                args = [filename, env, master]
-                threads.append(Thread(target=secondpass, args=args))
-    for t in threads:
-        t.start()
-    for t in threads:
-        t.join()
-    logging.info('Done removing missing kmers')
-
+    write_shared(shared, env, master, saturate)
+    write_limit(env, limit)
     env.close()
     logging.info('Done kmer_counter.count_kmers')
 
 
-def get_counts(files, database, name=None):
+def count_sorted_multi(input_file, ks, limit=None,
+                       backend=constants.DEFAULT_BACKEND, threads=None,
+                       sizes=None):
+    """
+    Count the kmers of every length in ks in input_file. With the native
+    backend the genome is read and 2-bit encoded once for every k, see
+    read_filter.count_file_multi. Jellyfish can only count one length at a
+    time so it is run once per k.
+
+    Args:
+        input_file (str):   Fasta file to perform a kmer count on.
+        ks (list(int)):     The lengths of kmer to count.
+        limit (int):        Minimum frequency of kmer count to be output.
+        backend (str):      The kmer counter to use.
+        threads (int):      Number of threads jellyfish may use.
+        sizes (dict):       The jellyfish hash size for each k.
+
+    Returns:
+        list(tuple(int, ndarray, ndarray)): Each k with its sorted kmers as
+                                            bytes and their counts.
+    """
+    if backend == 'native' and max(ks) <= native_counter.MAX_K:
+        counted = read_filter.count_file_multi(input_file, ks, limit)
+        return [(k, native_counter.decode_kmers(codes, k, as_bytes=True),
+                 counts) for k, (codes, counts) in sorted(counted.items())]
+    sizes = sizes or {}
+    return [(k,) + count_sorted(input_file, k, limit, backend, threads,
+                                sizes.get(k))
+            for k in ks]
+
+
+def size_multi(needed, ks, envs, workers=None, cores=None):
+    """
+    Estimate the number of distinct kmers of every length in each genome
+    that is going to be counted, sketching every length in one pass over
+    each genome, and size the database of each length with the estimates,
+    see complete_kmer_counter.size_database.
+
+    Args:
+        needed (dict):      Maps each fasta file that is going to be counted
+                            to the lengths it is counted for.
+        ks (list(int)):     Every length being counted.
+        envs (dict):        The environment of each length.
+        workers (int):      Number of genomes to sketch at once, see
+                            pipeline.schedule.
+        cores (int):        Total number of cores to use, see
+                            pipeline.schedule.
+
+    Returns:
+        dict: Maps each fasta file to the jellyfish hash size of each length
+              it is counted for.
+    """
+    sketched = [k for k in ks if k <= native_counter.MAX_K]
+    for k in ks:
+        if k > native_counter.MAX_K:
+            logging.info('Can not estimate the size of {}-mer counts'.format(k))
+            grow_map(envs[k], constants.MAP_SIZE)
+    jobs = [(f, [k for k in needed[f] if k in sketched]) for f in needed]
+    jobs = [job for job in jobs if job[1]]
+    registers = dict((k, {}) for k in sketched)
+
+    def collect(job, result):
+        for k, sketch in result.items():
+            registers[k][job[0]] = sketch
+
+    workers = pipeline.schedule(len(jobs), cores, workers)[0]
+    pipeline.run(jobs, cardinality.sketch_file_multi, collect, workers)
+    hash_sizes = {}
+    for k in sketched:
+        sizes = record_sizes(envs[k], k, [], registers[k], outputs=False)
+        for f, size in sizes.items():
+            hash_sizes.setdefault(f, {})[k] = size
+    return hash_sizes
+
+
+def multi_database(database, k):
+    """
+    Get the database count_kmers_multi stores the kmers of length k in.
+
+    Args:
+        database (str): The database passed to count_kmers_multi.
+        k (int):        The length of kmer.
+
+    Returns:
+        str: The path of the database, for use with get_counts.
+    """
+    return os.path.join(database, 'k{}'.format(k))
+
+
+def count_kmers_multi(files, database, ks, limit=constants.DEFAULT_LIMIT,
+                      force=False, backend=constants.DEFAULT_BACKEND,
+                      workers=None, memory_budget=constants.MEMORY_BUDGET,
+                      cores=constants.CORES, saturate=constants.SATURATE,
+                      sizing=True):
+    """
+    Count the kmers of every length in ks in files, reading each genome once,
+    and store the kmers of each length in the same way as count_kmers in its
+    own database, see multi_database.
+
+    Each worker process counts every length for one genome and the counts of
+    each length are merged into the kmers shared by every genome for that
+    length. The worker's result holds the counts of every length in ks, so
+    memory_budget should allow for len(ks) counts per genome.
+
+    Args:
+        files (list(str)):   The fasta files to count kmers from.
+        database (str):      Directory to store the database for each length
+                             in.
+        ks (list(int)):      The lengths of kmer to count.
+        limit (int):         Minimum frequency for a kmer to be output.
+        force (bool):        If True all files are recounted, if False a file
+                             is only counted for the lengths whose database
+                             does not already contain it.
+        backend (str):       The kmer counter to use, see count_kmers.
+        workers (int):       Number of worker processes that count kmers,
+                             chosen from cores if not given.
+        memory_budget (int): Upper limit, in bytes, on the kmer counts held by
+                             the workers that are waiting to be merged.
+        cores (int):         Total number of cores to use, see count_kmers.
+        saturate (int):      See count_kmers.
+        sizing (bool):       If True the number of distinct kmers of each
+                             length is estimated and used to size
+                             jellyfish's hash and the database of that
+                             length, see size_multi. If False
+                             constants.HASH_SIZE and constants.MAP_SIZE are
+                             used.
+
+    Returns:
+        None
+    """
+    logging.info('Begin kmer_counter.count_kmers_multi')
+    check_backend(backend)
+    ks = sorted(set(ks))
+    if not os.path.exists(database):
+        os.makedirs(database)
+
+    envs = {}
+    masters = {}
+    shared = {}
+    needed = {}
+    for k in ks:
+        environments.release(multi_database(database, k))
+        envs[k] = lmdb.open(multi_database(database, k),
+                            map_size=constants.MIN_MAP_SIZE, max_dbs=4000)
+        masters[k] = envs[k].open_db('master'.encode(), dupsort=False)
+        shared[k] = {'kmers': None, 'counts': {}}
+        with envs[k].begin(write=False) as txn:
+            for filename in files:
+                if force or not txn.get(filename.encode(), default=False):
+                    needed.setdefault(filename, []).append(k)
+                else:
+                    kmers, counts = read_sorted(filename, envs[k], txn)
+                    merge_shared(shared[k], filename, kmers, counts)
+
+    if sizing:
+        hash_sizes = size_multi(needed, ks, envs, workers, cores)
+    else:
+        hash_sizes = {}
+        for k in ks:
+            grow_map(envs[k], constants.MAP_SIZE)
+
+    jobs = [(f, needed[f], limit, backend) for f in files if f in needed]
+
+    def merge(job, result):
+        for k, kmers, counts in result:
+            merge_shared(shared[k], job[0], kmers, counts)
+        logging.info('Counted kmers for {}'.format(job[0]))
+
+    logging.info('Begin counting kmers')
+    workers, threads = pipeline.schedule(len(jobs), cores, workers)
+    jobs = [job + (threads, hash_sizes.get(job[0])) for job in jobs]
+    pipeline.run(jobs, count_sorted_multi, merge, workers, memory_budget)
+    logging.info('Done counting kmers')
+
+    for k in ks:
+        write_shared(shared[k], envs[k], masters[k], saturate)
+        write_limit(envs[k], limit)
+        envs[k].close()
+    logging.info('Done kmer_counter.count_kmers_multi')
+
+
+def get_counts(files, database, name=None, dtype=None, sparse=False):
     """
     Returns (as an array) the kmer counts of each fasta file in "files"
     contained in the lmdb database named "database". The length and lower limit
@@ -211,6 +523,11 @@ def get_counts(files, database, name=None):
                            calculated using count_kmers.
         database (str):    The databse where the kmer counts are stored.
         name:              Not used, here for compatability.
+        dtype:             The dtype of the output, defaults to the dtype
+                           recorded by count_kmers (float64 for databases
+                           that do not record one).
+        sparse (bool):     If True a scipy.sparse.csr_matrix is returned, built
+                           one genome at a time.
 
     Returns:
         list(list): The kmer counts for each genome in files.
@@ -220,7 +537,7 @@ def get_counts(files, database, name=None):
         msg += ' {}'.format(database)
         raise(KmerCounterError(msg))
 
-    env = lmdb.open(database, map_size=int(160e9), max_dbs=4000, max_readers=1e7)
+    env = environments.reader(database)
     try:
         master = env.open_db('master'.encode(), dupsort=False, create=False)
     except lmdb.NotFoundError:
@@ -229,31 +546,65 @@ def get_counts(files, database, name=None):
         logging.exception(msg)
         raise(KmerCounterError(msg))
 
+    recorded, saturate = read_dtype(env)
+    dtype = dtype or recorded or 'float64'
     if not files:
-        output = np.array([], dtype='float64')
+        output = np.array([], dtype=dtype)
+        if sparse:
+            output = to_csr([], dtype)
     else:
         with env.begin(write=False, db=master) as txn:
             num_keys = txn.stat(master)['entries']
-            output = np.zeros((len(files), num_keys), dtype='float64')
+            rows = read_rows(files, database, env, txn, num_keys, dtype,
+                             saturate)
+            if sparse:
+                output = to_csr(rows, dtype)
+            else:
+                output = np.zeros((len(files), num_keys), dtype=dtype)
+                for index, row in enumerate(rows):
+                    output[index] = row
 
-            for index, value in enumerate(files):
-                try:
-                    current = env.open_db(value.encode(), txn=txn, create=False)
-                except lmdb.NotFoundError:
-                    msg = 'Attempted to get counts for a potentially uncounted'
-                    msg += ' genome: {} in DB: {}'.format(value, database)
-                    logging.exception(msg)
-                    raise(KmerCounterError(msg))
+    return output
 
-                cursor = txn.cursor(db=current)
-                for i, (key, value) in enumerate(cursor):
-                    output[index, i] = float(value)
 
-    env.close()
-    return output
+def read_rows(files, database, env, txn, num_keys, dtype, saturate=None):
+    """
+    Yield the kmer counts of each file in files as a row of get_counts.
+
+    Args:
+        files (list(str)):      The fasta files to read the counts of.
+        database (str):         The database the counts are stored in.
+        env (lmdb.Environment):
+        txn (lmdb.Transaction):
+        num_keys (int):         The number of kmers in the master database.
+        dtype:                  The dtype of each row.
+        saturate (int):         Counts larger than saturate are returned as
+                                saturate, None to return every count.
+
+    Returns:
+        generator(ndarray): The counts of each file.
+    """
+    for value in files:
+        try:
+            current = env.open_db(value.encode(), txn=txn, create=False)
+        except lmdb.NotFoundError:
+            msg = 'Attempted to get counts for a potentially uncounted'
+            msg += ' genome: {} in DB: {}'.format(value, database)
+            logging.exception(msg)
+            raise(KmerCounterError(msg))
+
+        row = np.zeros(num_keys, dtype=dtype)
+        with txn.cursor(db=current) as cursor:
+            values = list(cursor.iternext(keys=False))
+        if values:
+            values = np.array(values).astype(np.int64)
+            if saturate is not None:
+                np.minimum(values, saturate, out=values)
+            row[:len(values)] = values
+        yield row
 
 
-def get_kmer_names(database, name=None):
+def get_kmer_names(database, name=None, packed=False):
     """
     Returns (as a numpy 1D array) every key in the databse, this should be an
     alphabetical list of all the kmers in the database.
@@ -261,12 +612,20 @@ def get_kmer_names(database, name=None):
     Args:
         database (str): The name of the database to get the keys from.
         name:           Not used, here for compatability.
+        packed (bool):  If True the kmers are returned as uint64 codes, see
+                        complete_kmer_counter.kmer_names.
 
     Returns:
         list(str): Every kmer in the database sorted alphabetically.
     """
-    env = lmdb.open(str(database), map_size=int(160e9), max_dbs=4000)
-    data = env.open_db('master'.encode(), dupsort=False)
+    env = environments.reader(database)
+    try:
+        data = env.open_db('master'.encode(), dupsort=False, create=False)
+    except lmdb.NotFoundError:
+        msg = 'Attempted to get kmer names from a database that does not'
+        msg += ' contain master {}'.format(database)
+        logging.exception(msg)
+        raise(KmerCounterError(msg))
 
     with env.begin(write=False, db=data) as txn:
 
@@ -274,13 +633,13 @@ def get_kmer_names(database, name=None):
         cursor = txn.cursor()
 
         for item in cursor:
-            kmer_list.append(item[0].decode())
+            kmer_list.append(item[0])
 
-    env.close()
-    return np.asarray(kmer_list)
+    return kmer_names(np.array(kmer_list, dtype='S'), packed=packed)
 
 
-def add(filename, k, env, txn):
+def add(filename, k, env, txn, backend=constants.DEFAULT_BACKEND,
+        threads=None, size=None):
     """
     Counts kmers in filename and adds them to the database pointed to by env.
     Only counts kmers that already exists in env.
@@ -290,38 +649,34 @@ def add(filename, k, env, txn):
         k (int):                Length of kmer to count.
         env (lmdb.Environment):
         txn (lmdb.Transaction):
+        backend (str):          The kmer counter to use.
+        threads (int):          Number of threads jellyfish may use.
+        size (str):             Jellyfish hash size.
 
     Returns:
-        None
+        int: The largest count added.
     """
-    args = ['jellyfish', 'count', '-m', '%d' % k, '-s', '10M', '-t', '30',
-            '-C', str(filename), '-o', 'counts.jf']
-    p = subprocess.Popen(args, bufsize=-1)
-    p.communicate()
-
-    # Get results from kmer count
-    args = ['jellyfish', 'dump', '-c', 'counts.jf']
-    p = subprocess.Popen(args, bufsize=-1, stdout=subprocess.PIPE,
-                         universal_newlines=True)
-    out, err = p.communicate()
-    os.remove('counts.jf')
-    # Transform results into usable format
-    arr = [x.split(' ') for x in out.split('\n') if x]
+    kmers, counts = count_genome(filename, k, backend=backend, threads=threads,
+                                 size=size)
 
     current = env.open_db(filename.encode(), txn=txn)
     txn.drop(current, delete=False)
 
-    for line in arr:
-        if txn.get(line[0].encode(), default=False):
-            txn.put(line[0].encode(), line[1].encode(), overwrite=True,
+    max_count = 0
+    for kmer, count in zip(kmers.tolist(), counts.tolist()):
+        if txn.get(kmer, default=False):
+            txn.put(kmer, str(count).encode(), overwrite=True,
                     dupdata=False, db=current)
+            max_count = max(max_count, count)
 
     with txn.cursor() as cursor:
         for item in cursor:
             if not txn.get(item[0], default=False, db=current):
                 txn.put(item[0], '0'.encode(), overwrite=True, db=current)
+    return max_count
 
-def add_counts(files, database):
+def add_counts(files, database, backend=constants.DEFAULT_BACKEND,
+               cores=constants.CORES, sizing=True):
     """
     Counts kmers in the fasta files "files" removing any that do not already
     appear in "database". If a kmer in "files" has a count less than "limit",
@@ -335,20 +690,47 @@ def add_counts(files, database):
         files (list(str)): The fasta files containing the genomes whose kmer
                            counts you want added to the database.
         database (str):    The name of the database to add the kmer counts to.
+        backend (str):     The kmer counter to use, see count_kmers.
+        cores (int):       Number of threads jellyfish may use, defaults to
+                           every core.
+        sizing (bool):     If True jellyfish's hash and the database are sized
+                           from the estimated number of distinct kmers in
+                           files, see count_kmers.
 
     Returns:
         None
     """
-    env = lmdb.open(str(database), map_size=int(160e9), max_dbs=100000)
+    check_backend(backend)
+    environments.release(database)
+    env = lmdb.open(str(database), map_size=constants.MIN_MAP_SIZE,
+                    max_dbs=100000)
     master = env.open_db('master'.encode(), dupsort=False)
 
-    with env.begin(write=True, db=master) as txn:
+    with env.begin(write=False, db=master) as txn:
         with txn.cursor() as cursor:
             cursor.first()
             item = cursor.item()
             k = len(item[0].decode())
 
+    if sizing:
+        hash_sizes = size_database(files, files, k, env, True, outputs=False,
+                                   cores=cores)
+    else:
+        hash_sizes = {}
+        grow_map(env, constants.MAP_SIZE)
+
+    max_count = 0
+    with env.begin(write=True, db=master) as txn:
+        threads = pipeline.schedule(1, cores)[1]
         for f in files:
-            add(f, k, env, txn)
+            max_count = max(max_count, add(f, k, env, txn, backend, threads,
+                                           hash_sizes.get(f)))
+
+    # Widen the recorded dtype if the new genomes do not fit in it
+    recorded, saturate = read_dtype(env)
+    if recorded is not None:
+        dtype = compact_dtype(max_count, saturate)
+        if dtype.itemsize > recorded.itemsize:
+            write_dtype(env, dtype, saturate)
 
     env.close()
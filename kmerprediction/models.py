@@ -21,6 +21,7 @@ x_test and y_test is ignored.
 
 from builtins import zip
 import numpy as np
+from scipy.sparse import issparse
 from sklearn import svm
 from sklearn.ensemble import RandomForestClassifier
 from keras.layers import Dense, Flatten
@@ -28,6 +29,7 @@ from keras.models import Sequential
 from keras.layers.convolutional import Conv1D
 from keras.utils import to_categorical
 from kmerprediction.utils import flatten, make3D, convert_well_index
+from kmerprediction.native_counter import unpack_names
 
 
 def neural_network(input_data, feature_names=None, validate=True):
@@ -124,11 +126,15 @@ def support_vector_machine(input_data, kernel='linear', C=1,
 
     if feature_names is not None:
         coefs = model.coef_
+        if issparse(coefs):
+            # Fitting on a sparse x_train gives sparse coefficients.
+            coefs = coefs.toarray()
         if coefs.ndim > 1:
             coefs = coefs.sum(axis=0)
         coefs = coefs.ravel()
         absolute_coefs = np.absolute(coefs)
         absolute_coefs = [float(x) for x in absolute_coefs]
+        feature_names = unpack_names(feature_names)
         feature_names = [convert_well_index(x) for x in feature_names]
         features_coefs = dict(list(zip(feature_names, absolute_coefs)))
         output = (output_data, features_coefs)
@@ -187,6 +193,7 @@ def random_forest(input_data, n_estimators=50, feature_names=None,
     if feature_names is not None:
         importances = model.feature_importances_.ravel()
         importances = [float(x) for x in importances]
+        feature_names = unpack_names(feature_names)
         feature_names = [convert_well_index(x) for x in feature_names]
         features_importances = dict(list(zip(feature_names, importances)))
         output = (output_data, features_importances)
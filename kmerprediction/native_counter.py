@@ -0,0 +1,383 @@
+"""
+A pure NumPy kmer counter that can be used in place of jellyfish.
+
+Each genome is 2-bit encoded (A=0, C=1, G=2, T=3) and every kmer is packed
+into a single unsigned 64 bit integer. The canonical code of a kmer is the
+smaller of its own code and the code of its reverse complement, which is
+exactly the kmer jellyfish reports when run with -C. Because the encoding
+preserves alphabetical order, sorting the codes sorts the kmers.
+
+Short kmers are tallied with np.bincount over every possible code, longer
+kmers are tallied by sorting the codes and counting the unique values.
+"""
+
+import logging
+import numpy as np
+from kmerprediction import compression
+
+# Largest kmer whose codes fit in a uint64
+MAX_K = 32
+
+# Largest kmer that is tallied with a dense np.bincount over all 4^k codes
+DENSE_MAX_K = 13
+
+# Number of kmer windows that are encoded at once, bounds memory use on
+# large genomes.
+CHUNK_SIZE = 2 ** 22
+
+NUCLEOTIDES = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+# Maps every byte to its 2-bit code, anything that is not a nucleotide maps
+# to 4 which breaks any kmer that contains it.
+ENCODING = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(b'ACGT'):
+    ENCODING[_base] = _code
+    ENCODING[ord(chr(_base).lower())] = _code
+
+_TWO = np.uint64(2)
+_THREE = np.uint64(3)
+
+
+def read_sequences(input_file):
+    """
+    Read every sequence out of a fasta or fastq file, which may be
+    compressed, see compression.open_genome.
+
+    Args:
+        input_file (str):   Path to a fasta or fastq file.
+
+    Returns:
+        list(bytes): The sequence of every record in the file.
+    """
+    with compression.open_genome(input_file) as f:
+        data = f.read()
+    data = data.lstrip()
+    if not data:
+        return []
+    if data[:1] == b'@':
+        lines = data.splitlines()
+        return lines[1::4]
+    sequences = []
+    for record in data.split(b'\n>'):
+        sequence = record.split(b'\n', 1)
+        if len(sequence) == 2:
+            sequences.append(sequence[1].translate(None, b'\r\n'))
+    return sequences
+
+
+def encode_sequences(sequences):
+    """
+    2-bit encode a list of sequences into a single array. The sequences are
+    joined by an invalid base so that no kmer spans two records.
+
+    Args:
+        sequences (list(bytes)):    The sequences to encode.
+
+    Returns:
+        ndarray: uint8 array with values 0-3 for nucleotides and 4 elsewhere.
+    """
+    joined = b'N'.join(sequences)
+    return ENCODING[np.frombuffer(joined, dtype=np.uint8)]
+
+
+def kmer_codes(encoded, k):
+    """
+    Compute the canonical code of every valid kmer of length k in encoded.
+
+    Args:
+        encoded (ndarray):  Output of encode_sequences.
+        k (int):            Length of kmer.
+
+    Returns:
+        ndarray: uint64 canonical code of every kmer that does not contain an
+                 invalid base, in the order they appear.
+    """
+    n = encoded.shape[0] - k + 1
+    if n <= 0:
+        return np.array([], dtype=np.uint64)
+    invalid = np.concatenate(([0], np.cumsum(encoded > 3)))
+    valid = (invalid[k:] - invalid[:-k]) == 0
+    bases = np.where(encoded > 3, 0, encoded).astype(np.uint64)
+    forward = np.zeros(n, dtype=np.uint64)
+    reverse = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        window = bases[j:j + n]
+        forward <<= _TWO
+        forward |= window
+        reverse |= (_THREE - window) << np.uint64(2 * j)
+    return np.minimum(forward, reverse)[valid]
+
+
+def kmer_codes_multi(encoded, ks, positions=None):
+    """
+    Compute the canonical codes of every valid kmer for several lengths at
+    once. The codes of each length are extended from the codes one base
+    shorter, so every base is shifted in once per length up to max(ks)
+    instead of once for every k in ks, see kmer_codes.
+
+    Args:
+        encoded (ndarray):  Output of encode_sequences.
+        ks (list(int)):     Lengths of kmer.
+        positions (int):    If given only kmers that start before positions
+                            are returned.
+
+    Returns:
+        generator(tuple(int, ndarray)): Each k in increasing order and the
+                                        uint64 canonical codes of its kmers,
+                                        in the order they appear.
+    """
+    ks = sorted(set(ks))
+    n = encoded.shape[0]
+    invalid = np.concatenate(([0], np.cumsum(encoded > 3)))
+    bases = np.where(encoded > 3, 0, encoded).astype(np.uint64)
+    forward = np.zeros(n + 1, dtype=np.uint64)
+    reverse = np.zeros(n + 1, dtype=np.uint64)
+    for k in range(1, ks[-1] + 1):
+        if n - k + 1 <= 0:
+            forward = reverse = np.array([], dtype=np.uint64)
+            if k in ks:
+                yield k, forward
+            continue
+        window = bases[k - 1:]
+        forward = (forward[:n - k + 1] << _TWO) | window
+        reverse = reverse[:n - k + 1] | ((_THREE - window) <<
+                                         np.uint64(2 * (k - 1)))
+        if k in ks:
+            valid = (invalid[k:] - invalid[:-k]) == 0
+            codes = np.minimum(forward, reverse)
+            yield k, codes[:positions][valid[:positions]]
+
+
+def count_codes_multi(encoded, ks):
+    """
+    Count the canonical kmers of every length in ks in an encoded sequence,
+    encoding each window of the sequence once for all of them.
+
+    Args:
+        encoded (ndarray):  Output of encode_sequences.
+        ks (list(int)):     Lengths of kmer.
+
+    Returns:
+        dict: Maps each k to the sorted unique canonical codes and the number
+              of times each appears.
+    """
+    ks = sorted(set(ks))
+    if ks[0] < 1 or ks[-1] > MAX_K:
+        raise ValueError('k must be between 1 and {}'.format(MAX_K))
+    totals = {k: np.zeros(4 ** k, dtype=np.int64) for k in ks
+              if k <= DENSE_MAX_K}
+    found = {k: ([], []) for k in ks if k > DENSE_MAX_K}
+    n = max(encoded.shape[0] - ks[0] + 1, 0)
+    for start in range(0, n, CHUNK_SIZE):
+        chunk = encoded[start:start + CHUNK_SIZE + ks[-1] - 1]
+        for k, codes in kmer_codes_multi(chunk, ks, CHUNK_SIZE):
+            if k <= DENSE_MAX_K:
+                totals[k] += np.bincount(codes.astype(np.int64),
+                                         minlength=4 ** k)
+            else:
+                codes, counts = np.unique(codes, return_counts=True)
+                found[k][0].append(codes)
+                found[k][1].append(counts)
+
+    counted = {}
+    for k, total in totals.items():
+        codes = np.flatnonzero(total)
+        counted[k] = (codes.astype(np.uint64), total[codes])
+    for k, (all_codes, all_counts) in found.items():
+        if not all_codes:
+            counted[k] = (np.array([], dtype=np.uint64),
+                          np.array([], dtype=np.int64))
+            continue
+        codes = np.concatenate(all_codes)
+        counts = np.concatenate(all_counts).astype(np.int64)
+        if len(all_codes) > 1:
+            codes, index = np.unique(codes, return_inverse=True)
+            counts = np.bincount(index.ravel(),
+                                 weights=counts).astype(np.int64)
+        counted[k] = (codes, counts)
+    return counted
+
+
+def count_codes(encoded, k):
+    """
+    Count the canonical kmers of length k in an encoded sequence.
+
+    Args:
+        encoded (ndarray):  Output of encode_sequences.
+        k (int):            Length of kmer.
+
+    Returns:
+        tuple(ndarray, ndarray): The sorted unique canonical codes and the
+                                 number of times each appears.
+    """
+    return count_codes_multi(encoded, [k])[k]
+
+
+def count_file(input_file, k, limit=None):
+    """
+    Count the canonical kmers of length k in a fasta or fastq file.
+
+    Args:
+        input_file (str):   Path to the file to count kmers in.
+        k (int):            Length of kmer to count.
+        limit (int):        If given kmers that appear fewer than limit times
+                            are dropped, equivalent to jellyfish's -L.
+
+    Returns:
+        tuple(ndarray, ndarray): The sorted canonical codes and their counts.
+    """
+    encoded = encode_sequences(read_sequences(input_file))
+    codes, counts = count_codes(encoded, k)
+    if limit:
+        keep = counts >= limit
+        codes = codes[keep]
+        counts = counts[keep]
+    logging.info('Counted kmers for {}'.format(input_file))
+    return codes, counts
+
+
+def count_file_multi(input_file, ks, limit=None):
+    """
+    Count the canonical kmers of every length in ks in a fasta or fastq file,
+    reading and encoding the file once.
+
+    Args:
+        input_file (str):   Path to the file to count kmers in.
+        ks (list(int)):     Lengths of kmer to count.
+        limit (int):        If given kmers that appear fewer than limit times
+                            are dropped, see count_file.
+
+    Returns:
+        dict: Maps each k to the sorted canonical codes and their counts.
+    """
+    encoded = encode_sequences(read_sequences(input_file))
+    counted = count_codes_multi(encoded, ks)
+    if limit:
+        for k, (codes, counts) in counted.items():
+            keep = counts >= limit
+            counted[k] = (codes[keep], counts[keep])
+    logging.info('Counted kmers for {}'.format(input_file))
+    return counted
+
+
+def decode_kmers(codes, k, as_bytes=False):
+    """
+    Convert kmer codes back into kmer strings.
+
+    Args:
+        codes (ndarray):    uint64 kmer codes.
+        k (int):            Length of the kmers.
+        as_bytes (bool):    If True the kmers are returned as bytes, ready to
+                            be used as lmdb keys.
+
+    Returns:
+        ndarray: The kmers as unicode strings (or bytes).
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    letters = np.empty((codes.shape[0], k), dtype=np.uint8)
+    for j in range(k):
+        shift = np.uint64(2 * (k - 1 - j))
+        letters[:, j] = NUCLEOTIDES[(codes >> shift) & _THREE]
+    kmers = letters.view('S{}'.format(k)).ravel()
+    if as_bytes:
+        return kmers
+    return kmers.astype('U{}'.format(k))
+
+
+def encode_kmers(kmers):
+    """
+    Convert kmer strings into kmer codes, the inverse of decode_kmers.
+
+    Args:
+        kmers (list(str)):  kmers that all have the same length.
+
+    Returns:
+        ndarray: The uint64 code of each kmer.
+    """
+    kmers = np.asarray(kmers, dtype='S')
+    if kmers.shape[0] == 0:
+        return np.array([], dtype=np.uint64)
+    k = kmers.dtype.itemsize
+    letters = ENCODING[kmers.view(np.uint8).reshape(-1, k)].astype(np.uint64)
+    codes = np.zeros(kmers.shape[0], dtype=np.uint64)
+    for j in range(k):
+        codes <<= _TWO
+        codes |= letters[:, j]
+    return codes
+
+
+def pack_names(codes, k):
+    """
+    Mark kmer codes with their length so that they can be used as kmer names
+    and decoded without knowing k. A 1 bit is set just above the 2k bits of
+    each code, which keeps the codes in alphabetical order.
+
+    Args:
+        codes (ndarray):    uint64 kmer codes.
+        k (int):            Length of the kmers, less than MAX_K.
+
+    Returns:
+        ndarray: The uint64 packed names.
+    """
+    if k >= MAX_K:
+        raise ValueError('Only kmers shorter than {} can be packed'.format(MAX_K))
+    return np.asarray(codes, dtype=np.uint64) | (np.uint64(1) << np.uint64(2 * k))
+
+
+def unpack_names(names):
+    """
+    Convert names made by pack_names back into kmer strings, any other names
+    are returned unchanged.
+
+    Args:
+        names (ndarray):    Kmer names.
+
+    Returns:
+        ndarray: The names as strings.
+    """
+    names = np.asarray(names)
+    if names.dtype != np.uint64:
+        return names
+    if names.shape[0] == 0:
+        return np.array([], dtype='U1')
+    k = (int(names[0]).bit_length() - 1) // 2
+    return decode_kmers(names ^ (np.uint64(1) << np.uint64(2 * k)), k)
+
+
+def dump_file(input_file, output_file, k, limit=None):
+    """
+    Count kmers in input_file and write them to output_file in the same tab
+    separated format as "jellyfish dump -c -t".
+
+    Args:
+        input_file (str):   Path to a fasta or fastq file to count kmers in.
+        output_file (str):  Path to write the kmer counts to.
+        k (int):            Length of kmer to count.
+        limit (int):        If given kmers that appear fewer than limit times
+                            are dropped.
+
+    Returns:
+        None
+    """
+    codes, counts = count_file(input_file, k, limit)
+    write_dump(codes, counts, k, output_file)
+
+
+def write_dump(codes, counts, k, output_file):
+    """
+    Write kmer counts to output_file in the same tab separated format as
+    "jellyfish dump -c -t".
+
+    Args:
+        codes (ndarray):    The kmer codes.
+        counts (ndarray):   The count of each kmer.
+        k (int):            Length of the kmers.
+        output_file (str):  Path to write the kmer counts to.
+
+    Returns:
+        None
+    """
+    kmers = decode_kmers(codes, k)
+    with open(output_file, 'w') as f:
+        for kmer, count in zip(kmers, counts):
+            f.write('{}\t{}\n'.format(kmer, count))
@@ -0,0 +1,284 @@
+"""
+A bounded producer/consumer pipeline used to build the kmer count databases.
+
+LMDB only allows one writer at a time, so instead of starting a thread per
+genome that then waits on the write lock, the expensive per genome work
+(counting kmers, parsing counts, building output rows) is done by a pool of
+worker processes and every result is handed to a single writer that runs in
+the calling process. Only as many jobs are started as fit in the memory
+budget, and never more than a few per worker, so results can not pile up
+faster than the writer can commit them. When run is given the environment
+being written to, the writer adds results to one write transaction and only
+commits it every constants.COMMIT_COUNT results or constants.COMMIT_SIZE
+bytes, instead of paying for a commit and a sync per genome.
+
+schedule splits a budget of cores between the worker processes and the
+threads each job may start (jellyfish's -t), so that the counters never run
+more threads than there are cores.
+
+A process started by a pool can not start a pool of its own, so run calls
+produce in the calling process when it is itself a pool worker, for example
+when each shard of a complete database is built by its own process.
+"""
+
+import logging
+import os
+import time
+from multiprocessing import Pool, current_process
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import numpy as np
+from kmerprediction import constants
+
+
+def result_size(result):
+    """
+    Approximate the number of bytes held by a worker's result.
+
+    Args:
+        result: The return value of a producer.
+
+    Returns:
+        int: The total size of every numpy array in result.
+    """
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, (list, tuple)):
+        return sum(result_size(x) for x in result)
+    return 0
+
+
+def schedule(n_jobs, cores=None, workers=None):
+    """
+    Decide how many jobs to run at once and how many threads each job gets.
+    Running many single threaded jobs scales better than running a few jobs
+    with many threads, so threads are only handed out when there are fewer
+    jobs than cores.
+
+    Args:
+        n_jobs (int):   The number of jobs to run.
+        cores (int):    Total number of cores to use, defaults to
+                        constants.CORES or the number of cpus.
+        workers (int):  Number of jobs to run at once, chosen from cores if
+                        not given.
+
+    Returns:
+        tuple(int, int): The number of worker processes and the number of
+                         threads per job.
+    """
+    cores = cores or constants.CORES or os.cpu_count() or 1
+    workers = max(1, min(workers or cores, n_jobs))
+    threads = max(1, cores // workers)
+    return workers, threads
+
+
+def max_in_flight(workers, memory_budget, largest):
+    """
+    Decide how many jobs may be running or waiting to be consumed at once.
+
+    Args:
+        workers (int):          Number of worker processes.
+        memory_budget (int):    Upper limit, in bytes, on the results in
+                                flight.
+        largest (int):          Size in bytes of the largest result so far.
+
+    Returns:
+        int: The number of jobs, at least 1 and at most
+             constants.PENDING_PER_WORKER per worker.
+    """
+    limit = memory_budget // max(largest, 1)
+    return max(1, min(limit, constants.PENDING_PER_WORKER * workers))
+
+
+def batched(consume, env=None, commit_size=constants.COMMIT_SIZE,
+            commit_count=constants.COMMIT_COUNT):
+    """
+    Wrap consume so that the results it writes to env are committed in large
+    transactions, see run.
+
+    Args:
+        consume (function):     Called as consume(txn, job, result) with an
+                                open write transaction on env, or as
+                                consume(job, result) if env is None.
+        env (lmdb.Environment): The environment consume writes to.
+        commit_size (int):      Bytes of results after which the transaction
+                                is committed.
+        commit_count (int):     Number of results after which the transaction
+                                is committed.
+
+    Returns:
+        tuple(function, function): add(job, result), which consumes a result,
+                                   and finish(commit=True), which commits (or
+                                   aborts) the open transaction.
+    """
+    batch = {'txn': None, 'size': 0, 'count': 0}
+
+    def finish(commit=True):
+        txn = batch['txn']
+        batch['txn'] = None
+        if txn is None:
+            return
+        if commit:
+            txn.commit()
+            logging.info('Committed {} results'.format(batch['count']))
+        else:
+            txn.abort()
+
+    def add(job, result):
+        if env is None:
+            consume(job, result)
+            return
+        if batch['txn'] is None:
+            batch.update(txn=env.begin(write=True), size=0, count=0)
+        consume(batch['txn'], job, result)
+        batch['size'] += result_size(result)
+        batch['count'] += 1
+        if batch['size'] >= commit_size or batch['count'] >= commit_count:
+            finish()
+
+    return add, finish
+
+
+def timed(produce, job):
+    """
+    Call produce(*job) and record when it started and finished.
+
+    Args:
+        produce (function): The function to call.
+        job (tuple):        The arguments for produce.
+
+    Returns:
+        tuple(float, float, object): The start time, end time and the result
+                                     of produce.
+    """
+    start = time.time()
+    result = produce(*job)
+    return start, time.time(), result
+
+
+def run_inline(jobs, produce, consume, initializer=None, initargs=(),
+               env=None, commit_size=constants.COMMIT_SIZE,
+               commit_count=constants.COMMIT_COUNT):
+    """
+    Call produce on every job and pass each result to consume, one job at a
+    time in the calling process, see run.
+
+    Args:
+        jobs (list(tuple)):     The arguments for each call to produce.
+        produce (function):     Called as produce(*job).
+        consume (function):     Called as consume(job, result), or as
+                                consume(txn, job, result) if env is given.
+        initializer (function): Called once before the first job.
+        initargs (tuple):       The arguments for initializer.
+        env (lmdb.Environment): See run.
+        commit_size (int):      See run.
+        commit_count (int):     See run.
+
+    Returns:
+        list(tuple): The job, seconds spent waiting and seconds spent running
+                     for every job, see run.
+    """
+    stats = []
+    if initializer is not None:
+        initializer(*initargs)
+    add, finish = batched(consume, env, commit_size, commit_count)
+    queued = time.time()
+    try:
+        for job in jobs:
+            start, end, result = timed(produce, job)
+            stats.append((job, start - queued, end - start))
+            add(job, result)
+            del result
+        finish()
+    finally:
+        finish(commit=False)
+    return stats
+
+
+def run(jobs, produce, consume, workers=None,
+        memory_budget=constants.MEMORY_BUDGET, initializer=None,
+        initargs=(), env=None, commit_size=constants.COMMIT_SIZE,
+        commit_count=constants.COMMIT_COUNT):
+    """
+    Call produce on every job in a pool of worker processes and pass each
+    result to consume in the calling process as soon as it is ready.
+
+    Args:
+        jobs (list(tuple)):     The arguments for each call to produce.
+        produce (function):     Run in a worker process as produce(*job), must
+                                be defined at the top level of a module.
+        consume (function):     Run in the calling process as
+                                consume(job, result), in the order the jobs
+                                finish. This is the only place the database
+                                should be written to. If env is given it is
+                                called as consume(txn, job, result) and
+                                writes in txn.
+        workers (int):          Number of worker processes, defaults to the
+                                number of cores given by schedule.
+        memory_budget (int):    Upper limit, in bytes, on the results that may
+                                be in flight at once. At least one job is
+                                always in flight.
+        initializer (function): Run once in each worker process when it
+                                starts.
+        initargs (tuple):       The arguments for initializer.
+        env (lmdb.Environment): The environment consume writes to. Results
+                                are consumed in shared write transactions,
+                                see batched. If consume raises, the results
+                                since the last commit are rolled back.
+        commit_size (int):      Bytes of results written before a commit.
+        commit_count (int):     Number of results written before a commit.
+
+    Returns:
+        list(tuple): The job, seconds spent waiting for a worker, and seconds
+                     spent running for every job.
+    """
+    jobs = list(jobs)
+    stats = []
+    if not jobs:
+        return stats
+    if current_process().daemon:
+        return run_inline(jobs, produce, consume, initializer, initargs, env,
+                          commit_size, commit_count)
+    workers, threads = schedule(len(jobs), workers=workers)
+    results = queue.Queue()
+    pool = Pool(workers, initializer, initargs)
+    add, finish = batched(consume, env, commit_size, commit_count)
+    queued = time.time()
+    try:
+        next_job = 0
+        pending = 0
+        max_pending = max_in_flight(workers, memory_budget, 0)
+        largest = 0
+        while next_job < len(jobs) or pending:
+            while next_job < len(jobs) and pending < max_pending:
+                job = jobs[next_job]
+                pool.apply_async(timed, (produce, job),
+                                 callback=lambda r, j=job: results.put((j, r, None)),
+                                 error_callback=lambda e, j=job: results.put((j, None, e)))
+                next_job += 1
+                pending += 1
+
+            job, result, error = results.get()
+            pending -= 1
+            if error is not None:
+                logging.error('Worker failed on {}'.format(job))
+                raise error
+
+            start, end, result = result
+            stats.append((job, start - queued, end - start))
+            logging.info('{} waited {:.1f}s for a worker and ran for {:.1f}s'
+                         .format(job, start - queued, end - start))
+
+            largest = max(largest, result_size(result))
+            max_pending = max_in_flight(workers, memory_budget, largest)
+            add(job, result)
+            del result
+        finish()
+        pool.close()
+    finally:
+        finish(commit=False)
+        pool.terminate()
+        pool.join()
+    return stats
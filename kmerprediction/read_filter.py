@@ -0,0 +1,306 @@
+"""
+Counting kmers in raw sequencing reads without counting sequencing errors.
+
+Most kmers that contain a sequencing error are only seen once, so when a
+genome is given as reads (a fastq file) rather than as an assembly only the
+kmers seen at least MIN_COUNT times are kept. Instead of counting every kmer
+and dropping the rare ones afterwards, short kmers are tallied densely as
+usual and longer kmers go through two passes over the reads with two Bloom
+filters: the first pass remembers every kmer in one filter and every kmer
+seen again in the other, the second pass only counts the kmers in the second
+filter. The counter then holds the repeated kmers, plus the few false
+positives of the filter which are dropped with the rest of the kmers seen
+fewer than MIN_COUNT times, and their counts are exact.
+
+The reads are streamed from the file a chunk of about
+native_counter.CHUNK_SIZE bases at a time and never held whole, and the
+kmers of each chunk are merged into the running counts before the next chunk
+is read, so memory is bounded by the filters, one chunk and the repeated
+kmers. The file is read once to tally the short kmers and to sketch the
+longer ones, and twice more for each longer k. The filters are sized from
+the number of distinct kmers estimated by the sketch (see cardinality.py) at
+a false positive rate of FALSE_POSITIVE_RATE, rather than from the number of
+bases, which overstates the distinct kmers by the coverage of the reads.
+
+Jellyfish has a Bloom filter of its own, see
+complete_kmer_counter.jellyfish_count.
+"""
+
+import logging
+import numpy as np
+from kmerprediction import cardinality
+from kmerprediction import compression
+from kmerprediction import constants
+from kmerprediction import native_counter
+
+# Kmers seen fewer times than this in a set of reads are dropped
+MIN_COUNT = 2
+
+# The false positive rate each Bloom filter is sized for when it holds every
+# distinct kmer of the reads, and the number of bits set for each kmer. 1%
+# with 3 hashes takes about 12.4 bits per distinct kmer.
+FALSE_POSITIVE_RATE = 0.01
+HASHES = 3
+
+
+def is_reads(input_file):
+    """
+    Check if a genome is given as sequencing reads, i.e. is a fastq file.
+
+    Args:
+        input_file (str):   The fasta or fastq file, which may be compressed.
+
+    Returns:
+        bool: True if the file is fastq.
+    """
+    with compression.open_genome(input_file) as f:
+        start = f.read(constants.SNIFF_SIZE).lstrip()
+    return start[:1] == b'@'
+
+
+def bloom_filter(distinct):
+    """
+    Make an empty Bloom filter for the kmers of a set of reads, large enough
+    that the false positive rate stays under FALSE_POSITIVE_RATE once it
+    holds distinct kmers.
+
+    Args:
+        distinct (int): The number of distinct kmers in the reads.
+
+    Returns:
+        ndarray: The uint8 bits of the filter, a power of two bytes long.
+    """
+    per_hash = FALSE_POSITIVE_RATE ** (1.0 / HASHES)
+    bits = max(-HASHES * distinct / np.log(1 - per_hash), 64)
+    return np.zeros(2 ** int(np.ceil(np.log2(bits / 8))), dtype=np.uint8)
+
+
+def bloom_bits(bloom, codes):
+    """
+    Find the bits of a Bloom filter that stand for each kmer, with double
+    hashing over the splitmix64 hash of the code.
+
+    Args:
+        bloom (ndarray):    The filter, see bloom_filter.
+        codes (ndarray):    uint64 kmer codes.
+
+    Returns:
+        tuple(ndarray, ndarray): The (HASHES, n) byte index and bit mask of
+                                 every bit.
+    """
+    mask = np.uint64(bloom.shape[0] * 8 - 1)
+    first = cardinality.hash_codes(codes)
+    second = cardinality.hash_codes(first) | np.uint64(1)
+    bits = np.empty((HASHES, codes.shape[0]), dtype=np.uint64)
+    for i in range(HASHES):
+        bits[i] = (first + np.uint64(i) * second) & mask
+    index = (bits >> np.uint64(3)).astype(np.intp)
+    bit = np.left_shift(1, (bits & np.uint64(7)).astype(np.uint8))
+    return index, bit.astype(np.uint8)
+
+
+def bloom_contains(bloom, bits):
+    """
+    Check which kmers may be in a Bloom filter.
+
+    Args:
+        bloom (ndarray):    The filter, see bloom_filter.
+        bits (tuple):       The bits of each kmer, see bloom_bits.
+
+    Returns:
+        ndarray: False for the kmers that are certainly not in the filter.
+    """
+    index, bit = bits
+    return np.all(bloom[index] & bit, axis=0)
+
+
+def bloom_add(bloom, bits):
+    """
+    Add kmers to a Bloom filter.
+
+    Args:
+        bloom (ndarray):    The filter, see bloom_filter.
+        bits (tuple):       The bits of each kmer, see bloom_bits.
+
+    Returns:
+        None
+    """
+    index, bit = bits
+    np.bitwise_or.at(bloom, index.ravel(), bit.ravel())
+
+
+def read_chunks(input_file):
+    """
+    Yield the reads of a fastq file encoded a chunk of about
+    native_counter.CHUNK_SIZE bases at a time. Reads are never split across
+    chunks, so no kmer is lost between them.
+
+    Args:
+        input_file (str):   The fastq file, which may be compressed.
+
+    Returns:
+        generator(ndarray): Each chunk, see native_counter.encode_sequences.
+    """
+    reads = []
+    size = 0
+    with compression.open_genome(input_file) as f:
+        lines = (line for line in f if line.strip())
+        for i, line in enumerate(lines):
+            if i % 4 != 1:
+                continue
+            reads.append(line.rstrip(b'\r\n'))
+            size += len(reads[-1]) + 1
+            if size >= native_counter.CHUNK_SIZE:
+                yield native_counter.encode_sequences(reads)
+                reads = []
+                size = 0
+    if reads:
+        yield native_counter.encode_sequences(reads)
+
+
+def merge_counts(codes, counts, new_codes, new_counts):
+    """
+    Add the counts of new_codes to the running counts of codes.
+
+    Args:
+        codes (ndarray):        Sorted unique uint64 codes.
+        counts (ndarray):       The count of each code.
+        new_codes (ndarray):    Unique uint64 codes to add.
+        new_counts (ndarray):   The count of each new code.
+
+    Returns:
+        tuple(ndarray, ndarray): The sorted unique codes and their counts.
+    """
+    codes, index = np.unique(np.concatenate((codes, new_codes)),
+                             return_inverse=True)
+    counts = np.bincount(index.ravel(),
+                         weights=np.concatenate((counts, new_counts)),
+                         minlength=len(codes)).astype(np.int64)
+    return codes, counts
+
+
+def count_bloom(input_file, k, distinct):
+    """
+    Count the kmers of length k in a fastq file that are seen at least
+    MIN_COUNT times, with two passes over the reads and two Bloom filters.
+
+    Args:
+        input_file (str):   The fastq file, which may be compressed.
+        k (int):            Length of kmer.
+        distinct (int):     The estimated number of distinct kmers of length
+                            k in the reads, see bloom_filter.
+
+    Returns:
+        tuple(ndarray, ndarray): The sorted canonical codes and their counts.
+    """
+    seen = bloom_filter(distinct)
+    repeated = bloom_filter(distinct)
+    for chunk in read_chunks(input_file):
+        codes, counts = np.unique(native_counter.kmer_codes(chunk, k),
+                                  return_counts=True)
+        bits = bloom_bits(seen, codes)
+        again = bloom_contains(seen, bits) | (counts > 1)
+        bloom_add(repeated, (bits[0][:, again], bits[1][:, again]))
+        bloom_add(seen, bits)
+    del seen
+
+    codes = np.array([], dtype=np.uint64)
+    counts = np.array([], dtype=np.int64)
+    for chunk in read_chunks(input_file):
+        new_codes, new_counts = np.unique(native_counter.kmer_codes(chunk, k),
+                                          return_counts=True)
+        keep = bloom_contains(repeated, bloom_bits(repeated, new_codes))
+        codes, counts = merge_counts(codes, counts, new_codes[keep],
+                                     new_counts[keep])
+    keep = counts >= MIN_COUNT
+    return codes[keep], counts[keep]
+
+
+def count_repeated(input_file, ks):
+    """
+    Count the canonical kmers of every length in ks in a fastq file that are
+    seen at least MIN_COUNT times.
+
+    Args:
+        input_file (str):   The fastq file, which may be compressed.
+        ks (list(int)):     Lengths of kmer.
+
+    Returns:
+        dict: Maps each k to the sorted canonical codes and their counts.
+    """
+    ks = sorted(set(ks))
+    dense = [k for k in ks if k <= native_counter.DENSE_MAX_K]
+    totals = {k: np.zeros(4 ** k, dtype=np.int64) for k in dense}
+    sketches = {k: np.zeros(2 ** cardinality.PRECISION, dtype=np.uint8)
+                for k in ks if k not in totals}
+    for chunk in read_chunks(input_file):
+        for k, codes in native_counter.kmer_codes_multi(chunk, ks):
+            if k in totals:
+                totals[k] += np.bincount(codes.astype(np.int64),
+                                         minlength=4 ** k)
+            else:
+                cardinality.sketch_codes(codes, sketches[k])
+
+    counted = {}
+    for k, total in totals.items():
+        codes = np.flatnonzero(total >= MIN_COUNT)
+        counted[k] = (codes.astype(np.uint64), total[codes])
+    for k, registers in sketches.items():
+        counted[k] = count_bloom(input_file, k,
+                                 cardinality.estimate(registers))
+    return counted
+
+
+def count_file(input_file, k, limit=None):
+    """
+    Count the canonical kmers of length k in a fasta or fastq file, with
+    native_counter.count_file for fasta and count_repeated for fastq when
+    constants.FILTER_READS is set.
+
+    Args:
+        input_file (str):   Path to the file to count kmers in.
+        k (int):            Length of kmer to count.
+        limit (int):        If given kmers that appear fewer than limit times
+                            are dropped.
+
+    Returns:
+        tuple(ndarray, ndarray): The sorted canonical codes and their counts.
+    """
+    if not constants.FILTER_READS or not is_reads(input_file):
+        return native_counter.count_file(input_file, k, limit)
+    codes, counts = count_repeated(input_file, [k])[k]
+    if limit:
+        keep = counts >= limit
+        codes = codes[keep]
+        counts = counts[keep]
+    logging.info('Counted repeated kmers in the reads of {}'.format(input_file))
+    return codes, counts
+
+
+def count_file_multi(input_file, ks, limit=None):
+    """
+    Count the canonical kmers of every length in ks in a fasta or fastq file,
+    see count_file and native_counter.count_file_multi. The reads are read
+    and tallied once for every short k, see count_repeated.
+
+    Args:
+        input_file (str):   Path to the file to count kmers in.
+        ks (list(int)):     Lengths of kmer to count.
+        limit (int):        If given kmers that appear fewer than limit times
+                            are dropped.
+
+    Returns:
+        dict: Maps each k to the sorted canonical codes and their counts.
+    """
+    if not constants.FILTER_READS or not is_reads(input_file):
+        return native_counter.count_file_multi(input_file, ks, limit)
+    counted = count_repeated(input_file, ks)
+    for k, (codes, counts) in counted.items():
+        if limit:
+            keep = counts >= limit
+            codes = codes[keep]
+            counts = counts[keep]
+        counted[k] = (codes, counts)
+    logging.info('Counted repeated kmers in the reads of {}'.format(input_file))
+    return counted
+
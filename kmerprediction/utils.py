@@ -14,7 +14,7 @@ import re
 import pandas as pd
 import numpy as np
 from kmerprediction import constants
-from Bio import SeqIO
+from kmerprediction import compression
 from sklearn.preprocessing import LabelEncoder
 
 
@@ -34,9 +34,40 @@ def setup_files(filepath):
     return [filepath + x for x in os.listdir(filepath)]
 
 
+# Results of check_fasta, keyed by the real path, size and modification time
+# of each file so that a file is only read again after it changes.
+_checked_fasta = {}
+
+
+def sniff_fasta(f):
+    """
+    Check that a file starts with a fasta record, or with a complete fastq
+    record. Only the first record is read.
+
+    Args:
+        f (file): The file, opened in binary mode.
+
+    Returns:
+        bool: True if the first record is fasta|q otherwise False.
+    """
+    line = f.readline(constants.SNIFF_SIZE)
+    while line and not line.strip():
+        line = f.readline(constants.SNIFF_SIZE)
+    if line.startswith(b'>'):
+        return True
+    if line.startswith(b'@'):
+        sequence, separator, quality = [f.readline() for _ in range(3)]
+        return (separator.startswith(b'+') and
+                len(sequence.strip()) == len(quality.strip()))
+    return False
+
+
 def check_fasta(filename):
     """
-    Returns True if the file is fasta or fastq, False otherwise.
+    Returns True if the file is fasta or fastq, False otherwise. Compressed
+    files are checked after decompressing them, see compression.open_genome.
+    Only the first record is checked, and the result is reused until the
+    file's size or modification time change.
 
     Args:
         filename (str): File to check.
@@ -44,11 +75,12 @@ def check_fasta(filename):
     Returns:
         bool: True if file is fasta|q otherwise False.
     """
-    with open(filename, 'r') as f:
-        fasta = any(SeqIO.parse(f, "fasta"))
-    with open(filename, 'r') as f:
-        fastq = any(SeqIO.parse(f, "fastq"))
-    return bool(fasta or fastq)
+    stat = os.stat(filename)
+    key = (os.path.realpath(filename), stat.st_size, stat.st_mtime_ns)
+    if key not in _checked_fasta:
+        with compression.open_genome(filename) as f:
+            _checked_fasta[key] = sniff_fasta(f)
+    return _checked_fasta[key]
 
 
 def valid_file(test_files, *invalid_files):
@@ -344,14 +376,14 @@ def parse_json_helper(json_file, fasta_key, label_key, prefix, suffix,
     if label_key:
         labels = [str(x[label_key]) for x in data]
 
-    keep = [fasta.index(x) for x in fasta if valid_file(x)]
+    keep = [i for i, x in enumerate(fasta) if valid_file(x)]
     fasta = [fasta[x] for x in keep]
     if label_key:
         labels = [labels[x] for x in keep]
 
     fasta = [prefix + x + suffix for x in fasta]
 
-    keep = [fasta.index(x) for x in fasta if check_fasta(x)]
+    keep = [i for i, x in enumerate(fasta) if check_fasta(x)]
     fasta = [fasta[x] for x in keep]
     if label_key:
         labels = [labels[x] for x in keep]
@@ -1,14 +1,13 @@
 #!/usr/bin/env python
 
-from Bio import Seq, SeqIO
-from pathlib import Path
 import numpy as np
 import os
 import sys
-import itertools
-import re
 from concurrent.futures import ProcessPoolExecutor
-from multiprocessing import cpu_count
+from multiprocessing import cpu_count, shared_memory
+from kmerprediction.complete_kmer_counter import compact_dtype
+from kmerprediction.compression import open_genome, strip_suffix
+from kmerprediction.native_counter import decode_kmers, encode_kmers
 
 
 def get_files_to_analyze(file_or_directory):
@@ -35,38 +34,165 @@ def get_files_to_analyze(file_or_directory):
     return sorted(files_list)
 
 
-def make_row(filename):
+def reverse_complement(codes, k):
     """
-    Given a genome file, create and return a row of kmer counts
-    to be inerted into the mer matrix.
+    :param codes: uint64 2-bit codes (A=0, C=1, G=2, T=3) of kmers of length k
+    :param k: the kmer length
+    :return: the codes of the reverse complement of each kmer
     """
-    # Filepath
-    thefile = str(filename[0])
+    codes = np.asarray(codes, dtype=np.uint64)
+    reverse = np.zeros(codes.shape[0], dtype=np.uint64)
+    for j in range(k):
+        base = (codes >> np.uint64(2 * j)) & np.uint64(3)
+        reverse = (reverse << np.uint64(2)) | (np.uint64(3) - base)
+    return reverse
+
+
+def count_canonical(k):
+    """
+    :param k: the kmer length
+    :return: the number of canonical kmers, the columns of the matrix. Every
+             kmer pairs with its reverse complement, except the palindromes
+             of even length which are their own.
+    """
+    return (4 ** k + (4 ** (k // 2) if k % 2 == 0 else 0)) // 2
+
+
+def canonical_codes(k):
+    """
+    :param k: the kmer length
+    :return: the sorted code of every canonical kmer, a kmer is canonical
+             if it is not larger than its reverse complement. The 2-bit codes
+             sort the same way as the kmer strings, so this is the column
+             order of the matrix. The codes are checked a block at a time so
+             only the canonical ones are held.
+    """
+    block = 4 ** min(k, 10)
+    found = []
+    for start in range(0, 4 ** k, block):
+        codes = np.arange(start, start + block, dtype=np.uint64)
+        found.append(codes[codes <= reverse_complement(codes, k)])
+    return np.concatenate(found)
 
-    # Get the genome id from the filepath
-    genomeid = filename[0].split('/')[-1]
-    genomeid = genomeid.split('.')[-2]
 
-    # Create a temp row to fill and return (later placed in the kmer_matrix)
-    temp_row = [0]*num_cols
+def canonical_rank(codes, k):
+    """
+    :param codes: uint64 2-bit codes of canonical kmers of length k
+    :param k: the kmer length
+    :return: the position of each code among the sorted canonical codes,
+             i.e. its column in the matrix
 
-    # Walk through the file
-    for record in SeqIO.parse(thefile, "fasta"):
-        # Retrieve the sequence as a string
-        kmerseq = record.seq
-        kmerseq = kmerseq._get_seq_str_and_check_alphabet(kmerseq)
+    The rank is the number of canonical codes below the code. A code x is
+    below c when they agree up to some base p and x has a smaller base at p,
+    so the rank is a sum over p of the canonical codes with that prefix.
+    Whether x is canonical is decided by the outermost pair of bases i and
+    k - 1 - i where x differs from the complement of its mirror, so each of
+    those sums is a product over the pairs of how many ways each pair can be
+    smaller, equal or larger, which only depends on which bases of the pair
+    are fixed by the prefix. That takes O(k) array operations per call.
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    bases = [((codes >> np.uint64(2 * (k - 1 - i))) & np.uint64(3))
+             .astype(np.int64) for i in range(k)]
+    half = k // 2
 
-        # Retrieve the kmer count as an int
-        kmercount = record.id
-        kmercount = int(kmercount)
+    # Canonical and total ways to fill the pairs i and up when none of their
+    # bases are fixed. Of the 16 fillings of a pair 6 are smaller, 4 equal
+    # and 6 larger, and the middle base of odd k is never equal.
+    free_canonical = [0] * (half + 1)
+    free_total = [0] * (half + 1)
+    free_canonical[half], free_total[half] = (2, 4) if k % 2 else (1, 1)
+    for i in range(half - 1, -1, -1):
+        free_canonical[i] = 6 * free_total[i + 1] + 4 * free_canonical[i + 1]
+        free_total[i] = 16 * free_total[i + 1]
 
-        # Lookup the seq in the column list for the index
-        col_index = col_names[kmerseq]
+    # The prefix ends in the left half: the pairs outside have their left
+    # base fixed and their right base free, which is equal in exactly one
+    # way, and outer[i] counts the ways they are smaller
+    rank = np.zeros(codes.shape[0], dtype=np.int64)
+    outer = [np.zeros(codes.shape[0], dtype=np.int64)]
+    for i in range(half):
+        c = bases[i]
+        smaller = 3 * c - c * (c - 1) // 2
+        rank += ((4 * c * outer[i] + smaller) * free_total[i + 1]
+                 + c * free_canonical[i + 1])
+        outer.append(4 * outer[i] + 3 - c)
 
-        # Put the kmercount in the right spot in the row
-        temp_row[col_index] = kmercount
+    # The prefix ends at the middle base or in the right half: the pairs
+    # inside are all fixed, and inner says whether they are canonical
+    if k % 2:
+        c = bases[half]
+        rank += c * outer[half] + np.minimum(c, 2)
+        inner = (c <= 1).astype(np.int64)
+    else:
+        inner = np.ones(codes.shape[0], dtype=np.int64)
+    for i in range(half - 1, -1, -1):
+        a, c = bases[i], bases[k - 1 - i]
+        rank += c * outer[i] + np.minimum(c, 3 - a) + (3 - a < c) * inner
+        inner = (a + c < 3) + (a + c == 3) * inner
+    return rank
 
-    return genomeid,temp_row
+
+def attach(matrix_name, shape, dtype):
+    """
+    Called once in every worker, maps the shared matrix so that make_row can
+    write into it directly.
+    """
+    global kmer_matrix, block
+    # Keep the block referenced for as long as the matrix is used
+    block = shared_memory.SharedMemory(name=matrix_name)
+    kmer_matrix = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def read_dump(thefile):
+    """
+    :param thefile: a jellyfish dump in fasta format, '>count' followed by the
+                    kmer on the next line
+    :return: the kmers (as bytes) and their counts
+    """
+    with open_genome(thefile) as f:
+        fields = f.read().replace(b'>', b'').split()
+    if not fields:
+        return np.array([], dtype='S1'), np.array([], dtype=np.int64)
+    counts = np.array(fields[0::2]).astype(np.int64)
+    kmers = np.array(fields[1::2])
+    return kmers, counts
+
+
+def make_row(job):
+    """
+    Given a row index and a genome's jellyfish dump, write the genome's kmer
+    counts into its row of the shared kmer matrix. Counts too large for the
+    matrix's dtype are stored as the largest value it can hold. Returns the
+    genome id and the largest count in the genome.
+    """
+    row_index, thefile = job
+
+    # Get the genome id from the filepath, ignoring any compression suffix
+    genomeid = strip_suffix(thefile.split('/')[-1])
+    genomeid = genomeid.split('.')[-2]
+
+    # Read the whole dump at once
+    kmers, counts = read_dump(thefile)
+    if not counts.shape[0]:
+        return genomeid, 0
+
+    # The column of a kmer is the rank of its canonical code among the
+    # sorted canonical codes
+    codes = encode_kmers(kmers)
+    k = kmers.dtype.itemsize
+    codes = np.minimum(codes, reverse_complement(codes, k))
+    col_index = canonical_rank(codes, k)
+
+    # Put the kmer counts in the right spots in the row, saturating instead of
+    # wrapping around
+    if kmer_matrix.dtype.kind in 'iu':
+        limit = np.iinfo(kmer_matrix.dtype).max
+        kmer_matrix[row_index, col_index] = np.minimum(counts, limit)
+    else:
+        kmer_matrix[row_index, col_index] = counts
+
+    return genomeid, int(counts.max())
 
 
 if __name__ == "__main__":
@@ -80,67 +206,74 @@ if __name__ == "__main__":
     ## Input values
     kmer_size = int(sys.argv[1])            # Set this to your kmer length.
     matrix_dtype = sys.argv[2]              # Set the data type for the matrix.
-                                            #  ->Note uint8 has max kmercount of 256
+                                            #  ->Note uint8 has max kmercount of 255,
+                                            #    larger counts are stored as 255.
+                                            #  ->'auto' picks the smallest unsigned
+                                            #    type that holds every count.
     results_path = str(sys.argv[3])
     save_path = str(sys.argv[4])
     #####################################################################
 
-    # Initialize the dictionaries of row and col names
-    col_names = {}
-    row_names = {}
-
-    # Create the column dictionary of sequences and their col index
-    chars = "ACGT"
-    i = 0
-    for item in itertools.product(chars, repeat=kmer_size):
-        dna = "".join(item)
-        revcomp = Seq.reverse_complement(dna)
-        if revcomp < dna:
-            dna = revcomp
-        if not dna in col_names:
-            col_names[dna] = i
-            i += 1
-
-    # Get a list of all files and reshape it to use with concurrent futures
+    # Get a list of all files
     files = get_files_to_analyze(results_path)
-    x = np.asarray(files)
-    y = x.reshape((len(x),1))
-
-    # Initialize the kmer matrix
-    num_rows    = len(x)
-    num_cols    = i
-    kmer_matrix = np.zeros((num_rows,num_cols), dtype=matrix_dtype)
-
-    # Use concurent futures to get multiple rows at the same time
-    # Then place completed rows into the matrix and update the row dictionary
-    row_index = 0
-    with ProcessPoolExecutor(max_workers=cpu_count()) as ppe:
-        for genomeid,temp_row in ppe.map(make_row, y):
-            row_names[genomeid] = row_index
-            kmer_matrix[row_index,:] = temp_row
-            row_index += 1
-
-    # Save the matrix and its dictionaries
-    if not os.path.exists(os.path.abspath(os.path.curdir)+'/'+save_path):
-        os.mkdir(os.path.abspath(os.path.curdir)+'/'+save_path)
-    np.save(os.path.abspath(os.path.curdir)+'/'+save_path+'kmer_matrix.npy', kmer_matrix)
-    np.save(os.path.abspath(os.path.curdir)+'/'+save_path+'dict_kmer_rows.npy', row_names)
-    np.save(os.path.abspath(os.path.curdir)+'/'+save_path+'dict_kmer_cols.npy', col_names)
+
+    # With 'auto' the counts are gathered as uint32 and the matrix is saved
+    # in the smallest type that holds the largest count
+    save_dtype = matrix_dtype
+    if matrix_dtype == 'auto':
+        matrix_dtype = 'uint32'
+
+    # Initialize the kmer matrix in shared memory, the workers write their
+    # rows straight into it
+    num_rows    = len(files)
+    num_cols    = count_canonical(kmer_size)
+    shape       = (num_rows, num_cols)
+    nbytes      = max(num_rows * num_cols * np.dtype(matrix_dtype).itemsize, 1)
+    matrix_block = shared_memory.SharedMemory(create=True, size=nbytes)
+    kmer_matrix = np.ndarray(shape, dtype=matrix_dtype,
+                             buffer=matrix_block.buf)
+    try:
+        kmer_matrix[:] = 0
+
+        # Use concurent futures to fill multiple rows at the same time
+        # Then update the row dictionary as each row is completed
+        row_names = {}
+        max_count = 0
+        initargs = (matrix_block.name, shape, matrix_dtype)
+        with ProcessPoolExecutor(max_workers=cpu_count(), initializer=attach,
+                                 initargs=initargs) as ppe:
+            for row_index, (genomeid, count) in enumerate(
+                    ppe.map(make_row, enumerate(files))):
+                row_names[genomeid] = row_index
+                max_count = max(max_count, count)
+        if save_dtype == 'auto':
+            save_dtype = compact_dtype(max_count)
+            print("saving the matrix as {}".format(save_dtype))
+
+        # Save the matrix and its dictionaries, the column names are the
+        # sorted canonical kmers
+        col_array = decode_kmers(canonical_codes(kmer_size),
+                                 kmer_size).astype('object')
+        col_names = dict(zip(col_array.tolist(), range(num_cols)))
+        if not os.path.exists(os.path.abspath(os.path.curdir)+'/'+save_path):
+            os.mkdir(os.path.abspath(os.path.curdir)+'/'+save_path)
+        np.save(os.path.abspath(os.path.curdir)+'/'+save_path+'kmer_matrix.npy', kmer_matrix.astype(save_dtype, copy=False))
+        np.save(os.path.abspath(os.path.curdir)+'/'+save_path+'dict_kmer_rows.npy', row_names)
+        np.save(os.path.abspath(os.path.curdir)+'/'+save_path+'dict_kmer_cols.npy', col_names)
+    finally:
+        del kmer_matrix
+        matrix_block.close()
+        matrix_block.unlink()
 
     print("end: create matrix (parallel)")
 
     # Convert dict to array
     row_array = np.empty([num_rows], dtype='object')
-    col_array = np.empty([num_cols], dtype='object')
 
     # Walk through row dictionary, place genome in correct index
     for key, index in row_names.items():
     	row_array[index] = key
 
-    # Walk through col dictionary, place sequence in correct index
-    for key, index in col_names.items():
-    	col_array[index] = key
-
     print("end: convert dict to npy")
 
     # Save the np arrays